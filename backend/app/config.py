@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -8,3 +9,67 @@ load_dotenv(dotenv_path=env_path)
 
 MONGO_URL = os.getenv("MONGO_URL")
 JWT_SECRET = os.getenv("JWT_SECRET")
+
+# Number of replayed expenses between stored balance checkpoints
+BALANCE_CHECKPOINT_INTERVAL = int(os.getenv("BALANCE_CHECKPOINT_INTERVAL", 500))
+
+# Settlement computations over at least this many expenses run in a worker process
+SETTLEMENT_OFFLOAD_THRESHOLD = int(os.getenv("SETTLEMENT_OFFLOAD_THRESHOLD", 20000))
+# Size of the settlement worker process pool (0 = always compute inline)
+SETTLEMENT_POOL_WORKERS = int(os.getenv("SETTLEMENT_POOL_WORKERS", 2))
+# How long a request waits for an offloaded computation before returning 503
+SETTLEMENT_TIMEOUT_SECONDS = float(os.getenv("SETTLEMENT_TIMEOUT_SECONDS", 10))
+SETTLEMENT_RETRY_AFTER_SECONDS = int(os.getenv("SETTLEMENT_RETRY_AFTER_SECONDS", 5))
+
+# Per-worker cache of user -> group ids used for membership checks. Changes made through
+# this worker invalidate it immediately; the TTL bounds staleness from other workers.
+MEMBERSHIP_CACHE_TTL_SECONDS = float(os.getenv("MEMBERSHIP_CACHE_TTL_SECONDS", 60))
+MEMBERSHIP_CACHE_MAX_USERS = int(os.getenv("MEMBERSHIP_CACHE_MAX_USERS", 10000))
+# A "not a member" answer is re-checked against the database once its cache entry is older
+# than this, so a user added through another worker waits at most this long
+MEMBERSHIP_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("MEMBERSHIP_CACHE_NEGATIVE_TTL_SECONDS", 5))
+
+# Maximum number of sub-requests accepted by POST /batch
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 20))
+
+# Maximum number of expenses stored in one bucket document (bucketed expense storage)
+EXPENSE_BUCKET_SIZE = int(os.getenv("EXPENSE_BUCKET_SIZE", 500))
+
+# Background group delete/archive jobs: documents removed per batch, minimum pause between
+# batches, and how long a worker holds a job before another worker may resume it
+GROUP_JOB_BATCH_SIZE = int(os.getenv("GROUP_JOB_BATCH_SIZE", 500))
+GROUP_JOB_BATCH_PAUSE_SECONDS = float(os.getenv("GROUP_JOB_BATCH_PAUSE_SECONDS", 0.2))
+GROUP_JOB_LEASE_SECONDS = float(os.getenv("GROUP_JOB_LEASE_SECONDS", 60))
+
+# Recurring expense scheduler: how often each worker looks for due templates, and the most
+# occurrences of one template materialized per insert (catch-up after downtime is batched)
+RECURRING_POLL_SECONDS = float(os.getenv("RECURRING_POLL_SECONDS", 30))
+RECURRING_BATCH_SIZE = int(os.getenv("RECURRING_BATCH_SIZE", 500))
+
+# Multi-currency groups: currency of groups created without one, the currency exchange rates
+# are quoted in, the in-memory rate table's size (currencies) and refresh interval, and how
+# often each worker checks whether new rates were loaded
+DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", "USD")
+FX_REFERENCE_CURRENCY = os.getenv("FX_REFERENCE_CURRENCY", "USD")
+FX_CACHE_MAX_CURRENCIES = int(os.getenv("FX_CACHE_MAX_CURRENCIES", 64))
+FX_CACHE_TTL_SECONDS = float(os.getenv("FX_CACHE_TTL_SECONDS", 3600))
+FX_VERSION_CHECK_SECONDS = float(os.getenv("FX_VERSION_CHECK_SECONDS", 10))
+
+# Request profiling: fraction of requests profiled (changeable per worker at runtime through
+# PUT /admin/profiling), a secret that profiles any request sending it in the X-Profile
+# header (unset = header disabled), the stack sampling interval, and where and how many
+# profiles are kept
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_HEADER_TOKEN = os.getenv("PROFILE_HEADER_TOKEN")
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", 0.005))
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(Path(tempfile.gettempdir()) / "expense_splitter_profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 200))
+
+# Receipt attachments (GridFS): chunk size uploads and downloads are streamed in, largest
+# accepted receipt, thumbnail edge length, largest image (in pixels) a thumbnail is made
+# from, and thumbnails generated at once per worker
+RECEIPT_CHUNK_SIZE = int(os.getenv("RECEIPT_CHUNK_SIZE", 255 * 1024))
+RECEIPT_MAX_BYTES = int(os.getenv("RECEIPT_MAX_BYTES", 10 * 1024 * 1024))
+RECEIPT_THUMBNAIL_SIZE = int(os.getenv("RECEIPT_THUMBNAIL_SIZE", 256))
+RECEIPT_THUMBNAIL_MAX_PIXELS = int(os.getenv("RECEIPT_THUMBNAIL_MAX_PIXELS", 50_000_000))
+RECEIPT_THUMBNAIL_CONCURRENCY = int(os.getenv("RECEIPT_THUMBNAIL_CONCURRENCY", 2))
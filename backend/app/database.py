@@ -1,5 +1,73 @@
-from pymongo import MongoClient
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pymongo import MongoClient, ASCENDING, DESCENDING, monitoring
 from app.config import MONGO_URL
+from typing import Iterator, List, Optional
 
-client = MongoClient(MONGO_URL)
+# Commands sent from inside a `count_commands()` block. Worker threads running a request's
+# sync code get a copy of its context, so they count towards the same request.
+_command_count: ContextVar[Optional[List[int]]] = ContextVar("command_count", default=None)
+
+
+class _CommandCounter(monitoring.CommandListener):
+    def started(self, event):
+        count = _command_count.get()
+        if count is not None:
+            count[0] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+@contextmanager
+def count_commands() -> Iterator[List[int]]:
+    """
+    Count the database round trips made in this context: `count[0]` after the block.
+    """
+    count = [0]
+    token = _command_count.set(count)
+    try:
+        yield count
+    finally:
+        _command_count.reset(token)
+
+
+client = MongoClient(MONGO_URL, event_listeners=[_CommandCounter()])
 db = client["expense_splitter"]
+
+
+def ensure_indexes():
+    """
+    Create the indexes the services rely on. Safe to call on every startup.
+    """
+    db.expenses.create_index([("groupId", ASCENDING), ("date", ASCENDING)])
+    # Search tokens, scoped by group (see app.services.expense_search)
+    db.expenses.create_index([("groupId", ASCENDING), ("descriptionTokens", ASCENDING)])
+    db.expenses.create_index([("groupId", ASCENDING), ("categoryTokens", ASCENDING)])
+    db.balance_checkpoints.create_index([("groupId", ASCENDING), ("asOf", DESCENDING)], unique=True)
+    db.expense_rollups.create_index(
+        [("groupId", ASCENDING), ("month", ASCENDING), ("category", ASCENDING), ("member", ASCENDING)],
+        unique=True
+    )
+    db.expense_rollups.create_index([("member", ASCENDING), ("month", ASCENDING)])
+    db.settlements.create_index("groupId")
+    db["receipts.files"].create_index("metadata.expenseId")
+    db["receipts.files"].create_index("metadata.groupId")
+    db.receipt_thumbnails.create_index("groupId")
+    db.fx_rates.create_index([("currency", ASCENDING), ("date", ASCENDING)], unique=True)
+    db.recurring_expenses.create_index("groupId")
+    db.recurring_expenses.create_index("nextRunAt")
+    db.group_jobs.create_index([("status", ASCENDING), ("notBefore", ASCENDING)])
+    db.expense_buckets.create_index([("groupId", ASCENDING), ("period", ASCENDING), ("count", ASCENDING)])
+    db.expense_buckets.create_index([("groupId", ASCENDING), ("maxDate", ASCENDING)])
+    db.expense_buckets.create_index("expenses._id")
+    db.expense_buckets.create_index("expenses.paidBy")
+    db.expense_buckets.create_index([("groupId", ASCENDING), ("expenses.descriptionTokens", ASCENDING)])
+    db.expense_buckets.create_index([("groupId", ASCENDING), ("expenses.categoryTokens", ASCENDING)])
+    # Text indexes of earlier versions, replaced by the token indexes above
+    for collection, name in ((db.expenses, "expense_text_search"), (db.expense_buckets, "expense_bucket_text_search")):
+        if name in collection.index_information():
+            collection.drop_index(name)
@@ -0,0 +1,16 @@
+from fastapi import Depends, HTTPException, status
+from app.deps.current_user import get_current_user
+from app.models.user import UserBase
+
+
+def get_admin_user(current_user: UserBase = Depends(get_current_user)) -> UserBase:
+    """
+    Returns the current user if they have the admin flag (`isAdmin: true` on their user
+    document). Raises 403 otherwise.
+    """
+    if not current_user.isAdmin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
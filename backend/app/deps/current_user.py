@@ -1,4 +1,4 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt  # instead of PyJWT
 from jose.exceptions import JWTError
@@ -11,11 +11,16 @@ from app.models.user import UserBase
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> UserBase:
+def get_current_user(request: Request, token: str = Depends(oauth2_scheme)) -> UserBase:
     """
     Decodes JWT token, fetches user from MongoDB, and returns user data.
     Raises 401 if invalid or expired.
     """
+    # Sub-requests of POST /batch reuse the user the batch endpoint already authenticated
+    batch_user = getattr(request.state, "batch_user", None)
+    if batch_user is not None:
+        return batch_user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials. Please log in again.",
@@ -42,5 +47,6 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> UserBase:
         id=str(user["_id"]),
         name=user["name"],
         email=user["email"],
-        createdAt=user["createdAt"]
+        createdAt=user["createdAt"],
+        isAdmin=user.get("isAdmin", False)
     )
@@ -0,0 +1,18 @@
+from fastapi import Depends, HTTPException, status
+from app.deps.current_user import get_current_user
+from app.models.user import UserBase
+from app.services import membership_cache
+
+
+def require_group_member(group_id: str, current_user: UserBase = Depends(get_current_user)) -> UserBase:
+    """
+    Returns the current user if they belong to the group in the `group_id` path parameter.
+    Raises 403 otherwise. Uses the per-worker membership cache, so allowed requests
+    normally cost no extra database round trip.
+    """
+    if not membership_cache.is_member(current_user.email, group_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not a member of this group"
+        )
+    return current_user
@@ -1,12 +1,28 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import auth, users, group, expenses, settlement
-from app.database import db
+from fastapi.responses import JSONResponse
+from app.routers import auth, users, group, expenses, settlement, analytics, batch, recurring, admin
+from app.database import db, ensure_indexes
+from app.services import compute_pool, fx_rates, group_jobs, recurring_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ensure_indexes()
+    group_jobs.start_worker()
+    recurring_service.start_scheduler()
+    yield
+    recurring_service.stop_scheduler()
+    group_jobs.stop_worker()
+    compute_pool.shutdown()
+
 
 app = FastAPI(
     title="Expense Splitter API",
     description="Backend API for Splitwise-like Expense Management App",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS configuration - Allow frontend to make requests
@@ -26,12 +42,34 @@ app.add_middleware(
     allow_headers=["*"],              # Allow all headers
 )
 
+
+@app.exception_handler(compute_pool.ComputationUnavailable)
+async def computation_unavailable_handler(request: Request, exc: compute_pool.ComputationUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Settlement computation is busy. Please retry shortly."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(fx_rates.MissingExchangeRate)
+async def missing_exchange_rate_handler(request: Request, exc: fx_rates.MissingExchangeRate):
+    return JSONResponse(
+        status_code=422,
+        content={"detail": f"No exchange rates for currency {exc.currency}"}
+    )
+
+
 # include all routers
 app.include_router(auth.router)
 # app.include_router(users.router)
 app.include_router(group.router)
 app.include_router(expenses.router)
 app.include_router(settlement.router)
+app.include_router(analytics.router)
+app.include_router(batch.router)
+app.include_router(recurring.router)
+app.include_router(admin.router)
 
 
 # root route
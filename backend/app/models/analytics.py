@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from typing import List, Dict
+
+
+# -------- Response Models ---------
+class SpendingRollup(BaseModel):
+    groupId: str
+    month: str  # "YYYY-MM"
+    category: str
+    member: str
+    paid: float  # amount the member paid
+    share: float  # the member's share of the expenses
+    expenseCount: int  # number of expenses the member paid
+
+
+class SpendingTotals(BaseModel):
+    paid: float
+    share: float
+
+
+class SpendingReport(BaseModel):
+    rollups: List[SpendingRollup]
+    byCategory: Dict[str, SpendingTotals]
+    byMonth: Dict[str, SpendingTotals]
+    byMember: Dict[str, SpendingTotals]
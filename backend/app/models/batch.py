@@ -0,0 +1,25 @@
+from pydantic import BaseModel, Field
+from typing import Any, List, Literal, Optional
+
+
+# -------- Request Models ---------
+class BatchRequestItem(BaseModel):
+    id: Optional[str] = None  # echoed back so the client can match responses
+    method: Literal["GET", "POST", "PUT", "DELETE"]
+    path: str = Field(..., description="API path including any query string, e.g. /expenses/group/123")
+    body: Optional[Any] = None
+
+
+class BatchRequest(BaseModel):
+    requests: List[BatchRequestItem]
+
+
+# -------- Response Models ---------
+class BatchResponseItem(BaseModel):
+    id: Optional[str] = None
+    status: int
+    body: Optional[Any] = None
+
+
+class BatchResponse(BaseModel):
+    responses: List[BatchResponseItem]
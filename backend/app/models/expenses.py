@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, field_validator
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 class ExpenseCreate(BaseModel):
     amount: float = Field(..., gt=0, description="Amount must be greater than 0")
@@ -14,6 +14,7 @@ class ExpenseCreate(BaseModel):
     # For "unequal": {"user1@ex.com": 60, "user2@ex.com": 40} -> exact amounts each owes
     # For "percentage": {"user1@ex.com": 60, "user2@ex.com": 40} -> percentages (should total 100)
     date: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    currency: Optional[str] = Field(None, pattern="^[A-Z]{3}$")  # ISO 4217 code, null -> the group's base currency
 
 class ExpenseUpdate(BaseModel):
     """Partial update model - all fields are optional"""
@@ -25,6 +26,7 @@ class ExpenseUpdate(BaseModel):
     splitType: Optional[str] = None
     splits: Optional[Dict[str, float]] = None
     date: Optional[datetime] = None
+    currency: Optional[str] = Field(None, pattern="^[A-Z]{3}$")  # the group's base currency clears it
 
 class ExpenseBase(BaseModel):
     id: str
@@ -36,7 +38,25 @@ class ExpenseBase(BaseModel):
     splitType: str
     splits: Optional[Dict[str, float]] = None
     date: datetime
+    currency: Optional[str] = None  # null -> the group's base currency
     createdAt: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class ExpenseSearchHit(ExpenseBase):
+    score: float  # relevance: 3 per query word in the description, 1 per word in the category
+
+class ExpenseSearchResults(BaseModel):
+    items: List[ExpenseSearchHit]
+    page: int
+    pageSize: int
+    hasMore: bool
+
+class ReceiptInfo(BaseModel):
+    id: str
+    expenseId: str
+    contentType: str
+    size: int  # bytes
+    uploadedBy: EmailStr
+    uploadedAt: datetime
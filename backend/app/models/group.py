@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
@@ -7,6 +7,7 @@ class GroupCreate(BaseModel):
     name: str
     description: Optional[str] = None
     members: Optional[list[EmailStr]] = []
+    baseCurrency: Optional[str] = Field(None, pattern="^[A-Z]{3}$")  # ISO 4217 code balances are kept in, defaults to DEFAULT_CURRENCY
     createdBy: Optional[EmailStr] = None  # Will be set by router from current_user
 
 class AddMembersPayload(BaseModel):
@@ -18,8 +19,22 @@ class GroupBase(BaseModel):
     name: str
     description: Optional[str] = None
     members: List[Dict[str, Any]] = []  # List of dicts with name and email
+    baseCurrency: str
     createdBy: EmailStr
     createdAt: datetime
 
     class Config:
-        orm_mode = True    # important for return types
\ No newline at end of file
+        orm_mode = True    # important for return types
+
+class GroupJob(BaseModel):
+    """Progress of a background group delete/archive job"""
+    id: str
+    groupId: str
+    action: str                  # "delete" or "archive"
+    status: str                  # "pending", "running", "completed" or "failed"
+    step: Optional[str] = None   # collection currently being processed
+    progress: Dict[str, int] = {}  # documents removed per collection
+    error: Optional[str] = None
+    createdAt: datetime
+    updatedAt: datetime
+    finishedAt: Optional[datetime] = None
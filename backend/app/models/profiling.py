@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+
+
+# -------- Request/Response Models ---------
+class ProfilingSettings(BaseModel):
+    sampleRate: float = Field(..., ge=0, le=1, description="Fraction of requests profiled by this worker")
+
+
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    route: str  # path template, e.g. "/settlements/calculate/{group_id}"
+    path: str
+    statusCode: int
+    durationMs: float
+    samples: int  # stack samples taken
+    dbRoundTrips: int
+    groupId: Optional[str] = None
+    groupSize: Optional[int] = None  # members of the group in the path, if any
+    createdAt: str
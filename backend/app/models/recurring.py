@@ -0,0 +1,46 @@
+from pydantic import BaseModel, EmailStr, Field, field_validator
+from datetime import datetime
+from typing import Optional, Dict
+from app.services.cron import CronSchedule
+
+# -------- request models ---------
+class RecurringExpenseCreate(BaseModel):
+    amount: float = Field(..., gt=0, description="Amount must be greater than 0")
+    description: Optional[str] = None
+    paidBy: EmailStr
+    groupId: str
+    category: str
+    splitType: str = "equal"  # same split rules as a single expense
+    splits: Optional[Dict[str, float]] = None
+    currency: Optional[str] = Field(None, pattern="^[A-Z]{3}$")  # null -> the group's base currency
+    schedule: str  # 5-field cron expression in UTC, e.g. "0 9 1 * *" = 09:00 on the 1st of each month
+    startAt: datetime = Field(default_factory=datetime.utcnow)  # omitted -> now; null is rejected
+    endAt: Optional[datetime] = None
+
+    @field_validator("schedule")
+    @classmethod
+    def validate_schedule(cls, value: str) -> str:
+        CronSchedule(value)  # raises ValueError -> 422
+        return value
+
+# -------- response models ---------
+class RecurringExpenseBase(BaseModel):
+    id: str
+    amount: float
+    description: Optional[str] = None
+    paidBy: EmailStr
+    groupId: str
+    category: str
+    splitType: str
+    splits: Optional[Dict[str, float]] = None
+    currency: Optional[str] = None
+    schedule: str
+    startAt: datetime
+    endAt: Optional[datetime] = None
+    nextRunAt: Optional[datetime] = None            # None once the schedule has ended
+    materializedThrough: Optional[datetime] = None  # last occurrence created as an expense
+    createdBy: EmailStr
+    createdAt: datetime
+
+    class Config:
+        from_attributes = True
@@ -72,3 +72,13 @@ class SettlementBetweenUsers(BaseModel):
     class Config:
         orm_mode = True
 
+
+class MemberBalance(BaseModel):
+    userEmail: EmailStr
+    netBalance: float  # positive = should receive, negative = owes
+
+
+class GroupBalances(BaseModel):
+    groupId: str
+    asOf: Optional[datetime] = None  # None = all expenses up to now
+    balances: List[MemberBalance]
@@ -24,6 +24,7 @@ class UserBase(BaseModel):
     name: str
     email: EmailStr
     createdAt: datetime
+    isAdmin: bool = False  # set directly in the database; grants the /admin endpoints
 
     class Config:
         orm_mode = True    # important for return types
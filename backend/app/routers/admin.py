@@ -0,0 +1,52 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import PlainTextResponse
+from typing import List
+from app.models.profiling import ProfilingSettings, ProfileSummary
+from app.models.user import UserBase
+from app.services import profiling
+from app.deps.admin_user import get_admin_user
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"]
+)
+
+
+@router.get("/profiling", response_model=ProfilingSettings)
+def get_profiling_settings(admin: UserBase = Depends(get_admin_user)):
+    """
+    The fraction of requests this worker profiles.
+    """
+    return {"sampleRate": profiling.get_sample_rate()}
+
+
+@router.put("/profiling", response_model=ProfilingSettings)
+def update_profiling_settings(payload: ProfilingSettings, admin: UserBase = Depends(get_admin_user)):
+    """
+    Change the fraction of requests profiled. Applies to the worker that handles this
+    request until it restarts; PROFILE_SAMPLE_RATE sets it for all workers.
+    """
+    profiling.set_sample_rate(payload.sampleRate)
+    return payload
+
+
+@router.get("/profiles", response_model=List[ProfileSummary])
+def list_profiles(
+    limit: int = Query(50, ge=1, le=500),
+    admin: UserBase = Depends(get_admin_user)
+):
+    """
+    The most recent request profiles, newest first.
+    """
+    return profiling.list_profiles(limit)
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str, admin: UserBase = Depends(get_admin_user)):
+    """
+    A profile's samples as folded stacks, ready for flamegraph.pl or speedscope.
+    """
+    stacks = profiling.read_folded_stacks(profile_id)
+    if stacks is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return stacks
@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+from app.models.analytics import SpendingReport
+from app.models.user import UserBase
+from app.services import analytics_service, group_service
+from app.deps.current_user import get_current_user
+from app.deps.group_member import require_group_member
+from app.services.profiling import ProfiledRoute
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["Analytics"],
+    route_class=ProfiledRoute
+)
+
+MONTH_PATTERN = r"^\d{4}-\d{2}$"
+
+
+@router.get("/group/{group_id}", response_model=SpendingReport)
+def get_group_spending(
+    group_id: str,
+    start_month: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    end_month: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    current_user: UserBase = Depends(require_group_member)
+):
+    """
+    Per-category, per-month and per-member spending for a group.
+    Months are "YYYY-MM" and the range is inclusive.
+    """
+    return analytics_service.get_group_spending(group_id, start_month, end_month)
+
+
+@router.get("/my", response_model=SpendingReport)
+def get_user_spending(
+    start_month: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    end_month: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    current_user: UserBase = Depends(get_current_user)
+):
+    """
+    Spending of the logged-in user across all of their groups.
+    """
+    return analytics_service.get_user_spending(current_user.email, start_month, end_month)
+
+
+@router.post("/group/{group_id}/rebuild")
+def rebuild_group_spending(
+    group_id: str,
+    current_user: UserBase = Depends(get_current_user)
+):
+    """
+    Recompute a group's rollups from its expenses. Only the group's creator or an admin
+    can do this, since it rereads every expense of the group.
+    """
+    if not current_user.isAdmin and not group_service.is_group_creator(group_id, current_user.email):
+        raise HTTPException(status_code=403, detail="Only the group creator or an admin can rebuild its analytics")
+    buckets = analytics_service.rebuild_group_rollups(group_id)
+    return {"message": f"Rebuilt {buckets} rollup bucket(s)"}
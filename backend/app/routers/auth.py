@@ -3,10 +3,12 @@
 from fastapi import APIRouter, HTTPException, Depends
 from app.models.user import UserSignup, UserLogin, UserBase
 from app.services.auth_service import signup_user, login_user
+from app.services.profiling import ProfiledRoute
 
 router = APIRouter(
     prefix="/auth",
-    tags=["Auth"]
+    tags=["Auth"],
+    route_class=ProfiledRoute
 )
 
 
@@ -0,0 +1,124 @@
+import asyncio
+import json
+from itertools import groupby
+from fastapi import APIRouter, HTTPException, Depends, Request
+from app.config import BATCH_MAX_REQUESTS
+from app.models.batch import BatchRequest, BatchRequestItem, BatchResponse
+from app.models.user import UserBase
+from app.deps.current_user import get_current_user
+from app.services.profiling import ProfiledRoute
+
+router = APIRouter(
+    prefix="/batch",
+    tags=["Batch"],
+    route_class=ProfiledRoute
+)
+
+
+async def _dispatch(request: Request, item: BatchRequestItem, current_user: UserBase) -> dict:
+    """
+    Run one sub-request through the app in-process and capture its response.
+    """
+    path, _, query_string = item.path.partition("?")
+    if not path.startswith("/") or path.rstrip("/") == router.prefix:
+        return {"id": item.id, "status": 400, "body": {"detail": "Invalid sub-request path"}}
+
+    body = b"" if item.body is None else json.dumps(item.body).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode())
+    ]
+    authorization = request.headers.get("authorization")
+    if authorization:
+        headers.append((b"authorization", authorization.encode()))
+
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": "1.1",
+        "method": item.method,
+        "scheme": request.url.scheme,
+        "server": request.scope.get("server"),
+        "client": request.scope.get("client"),
+        "root_path": request.scope.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "headers": headers,
+        # Picked up by get_current_user, so sub-requests skip JWT decoding and the user lookup
+        "state": {"batch_user": current_user}
+    }
+
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if body_sent:
+            return {"type": "http.disconnect"}
+        body_sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    response = {"status": 500, "headers": [], "chunks": [], "binary": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+            content_type = dict(response["headers"]).get(b"content-type", b"")
+            # Only JSON and text fit in a batch response; files (e.g. receipts) aren't buffered
+            response["binary"] = bool(content_type) and not content_type.startswith((b"application/json", b"text/"))
+        elif message["type"] == "http.response.body" and not response["binary"]:
+            response["chunks"].append(message.get("body", b""))
+
+    try:
+        await request.app(scope, receive, send)
+    except Exception:
+        # Unhandled errors are re-raised after the 500 response has been sent
+        if not response["chunks"]:
+            return {"id": item.id, "status": 500, "body": {"detail": "Internal Server Error"}}
+
+    raw_body = b"".join(response["chunks"])
+    content_type = dict(response["headers"]).get(b"content-type", b"")
+    try:
+        if response["binary"]:
+            raise UnicodeDecodeError("binary", b"", 0, 0, "not a JSON or text response")
+        if raw_body and content_type.startswith(b"application/json"):
+            response_body = json.loads(raw_body)
+        else:
+            response_body = raw_body.decode() or None
+    except UnicodeDecodeError:
+        return {
+            "id": item.id,
+            "status": 400,
+            "body": {"detail": "Files can't be returned in a batch. Request them directly."}
+        }
+
+    return {"id": item.id, "status": response["status"], "body": response_body}
+
+
+@router.post("/", response_model=BatchResponse)
+async def run_batch(
+    payload: BatchRequest,
+    request: Request,
+    current_user: UserBase = Depends(get_current_user)
+):
+    """
+    Run several API requests in one round trip.
+    The caller is authenticated once. Sub-requests run in the order given: writes one at a
+    time, and each run of consecutive GETs concurrently once the writes before it are done.
+    Each result carries its own status code, in the same order as the request list.
+    """
+    if len(payload.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can contain at most {BATCH_MAX_REQUESTS} requests"
+        )
+
+    responses = []
+    for is_read, items in groupby(payload.requests, key=lambda item: item.method == "GET"):
+        if is_read:
+            responses.extend(await asyncio.gather(*(_dispatch(request, item, current_user) for item in items)))
+        else:
+            for item in items:
+                responses.append(await _dispatch(request, item, current_user))
+    return {"responses": responses}
@@ -1,13 +1,22 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
-from app.models.expenses import ExpenseCreate, ExpenseBase, ExpenseUpdate
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from datetime import datetime
+from typing import List, Optional
+from pymongo.errors import ExecutionTimeout
+from app.config import RECEIPT_CHUNK_SIZE, RECEIPT_MAX_BYTES
+from app.models.expenses import ExpenseCreate, ExpenseBase, ExpenseUpdate, ExpenseSearchResults, ReceiptInfo
 from app.models.user import UserBase
 from app.services import expense_service   # your file with the logic above
 from app.deps.current_user import get_current_user
+from app.deps.group_member import require_group_member
+from app.services import membership_cache, fx_rates, receipt_service
+from app.services.profiling import ProfiledRoute
 
 router = APIRouter(
     prefix="/expenses",
-    tags=["Expenses"]
+    tags=["Expenses"],
+    route_class=ProfiledRoute
 )
 
 
@@ -19,6 +28,10 @@ def create_expense(
     """
     Create a new expense in a group.
     """
+    if not membership_cache.is_member(current_user.email, payload.groupId):
+        raise HTTPException(status_code=403, detail="You are not a member of this group")
+    if payload.currency is not None and not fx_rates.is_known_currency(payload.currency):
+        raise HTTPException(status_code=422, detail=f"No exchange rates for currency {payload.currency}")
     payload.paidBy = current_user.email
     new_expense = expense_service.create_expense(payload)
     return new_expense
@@ -27,7 +40,7 @@ def create_expense(
 @router.get("/group/{group_id}", response_model=List[ExpenseBase])
 def get_group_expenses(
     group_id: str,
-    current_user: UserBase = Depends(get_current_user)
+    current_user: UserBase = Depends(require_group_member)
 ):
     """
     Fetch all expenses belonging to a specific group.
@@ -47,17 +60,72 @@ def get_user_expenses(
     return expenses
 
 
-@router.get("/{expense_id}", response_model=ExpenseBase)
-def get_expense(expense_id: str, current_user: UserBase = Depends(get_current_user)):
+@router.get("/search", response_model=ExpenseSearchResults)
+def search_expenses(
+    q: str = Query(..., min_length=1, max_length=200),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    paid_by: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=expense_service.SEARCH_MAX_PAGE_SIZE),
+    current_user: UserBase = Depends(get_current_user)
+):
     """
-    Get a single expense by its ID.
+    Search expenses by description and category across the groups of the logged-in user.
+    Results are ranked by relevance and paginated, up to page SEARCH_MAX_PAGE.
     """
+    if page > expense_service.SEARCH_MAX_PAGE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Only the first {expense_service.SEARCH_MAX_PAGE} pages of results are available. Please narrow your query."
+        )
+    try:
+        return expense_service.search_expenses(
+            current_user.email, q,
+            start_date=start_date,
+            end_date=end_date,
+            min_amount=min_amount,
+            max_amount=max_amount,
+            paid_by=paid_by,
+            page=page,
+            page_size=page_size
+        )
+    except ExecutionTimeout:
+        raise HTTPException(status_code=503, detail="Search took too long. Please narrow your query.")
+
+
+def _get_member_expense(expense_id: str, current_user: UserBase) -> ExpenseBase:
     expense = expense_service.get_expense_by_id(expense_id)
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
+    if not membership_cache.is_member(current_user.email, expense.groupId):
+        raise HTTPException(status_code=403, detail="You are not a member of this group")
     return expense
 
 
+def _write_member_expense(write, expense_id: str, current_user: UserBase, *args):
+    """
+    Run `write(expense_id, *args, group_ids)` scoped to the caller's groups, so the write is
+    the membership check. If nothing matched, find out why: a missing expense or another
+    group's raises 404/403, and stale cached memberships are reloaded and the write retried.
+    """
+    result = write(expense_id, *args, membership_cache.get_user_group_ids(current_user.email))
+    if not result:
+        _get_member_expense(expense_id, current_user)
+        result = write(expense_id, *args, membership_cache.get_user_group_ids(current_user.email))
+    return result
+
+
+@router.get("/{expense_id}", response_model=ExpenseBase)
+def get_expense(expense_id: str, current_user: UserBase = Depends(get_current_user)):
+    """
+    Get a single expense by its ID.
+    """
+    return _get_member_expense(expense_id, current_user)
+
+
 @router.put("/{expense_id}", response_model=ExpenseBase)
 def update_expense(
     expense_id: str,
@@ -68,7 +136,12 @@ def update_expense(
     Update an existing expense by ID (partial or full update).
     Only provide the fields you want to update.
     """
-    updated = expense_service.update_expense(expense_id, payload)
+    # Both the expense's current group and the one it moves to must be the caller's
+    if payload.groupId is not None and not membership_cache.is_member(current_user.email, payload.groupId):
+        raise HTTPException(status_code=403, detail="You are not a member of this group")
+    if payload.currency is not None and not fx_rates.is_known_currency(payload.currency):
+        raise HTTPException(status_code=422, detail=f"No exchange rates for currency {payload.currency}")
+    updated = _write_member_expense(expense_service.update_expense, expense_id, current_user, payload)
     if not updated:
         raise HTTPException(status_code=404, detail="Expense not found or no changes made")
     return updated
@@ -82,7 +155,128 @@ def delete_expense(
     """
     Delete an expense by its ID.
     """
-    success = expense_service.delete_expense(expense_id)
+    success = _write_member_expense(expense_service.delete_expense, expense_id, current_user)
     if not success:
         raise HTTPException(status_code=404, detail="Expense not found")
     return {"message": "Expense deleted successfully"}
+
+
+def _get_member_receipt(expense_id: str, current_user: UserBase) -> dict:
+    _get_member_expense(expense_id, current_user)
+    receipt = receipt_service.get_receipt(expense_id)
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return receipt
+
+
+@router.put("/{expense_id}/receipt", response_model=ReceiptInfo, status_code=201)
+async def upload_receipt(
+    expense_id: str,
+    request: Request,
+    current_user: UserBase = Depends(get_current_user)
+):
+    """
+    Attach a receipt to an expense, replacing any previous one. Send the file as the raw
+    request body with its Content-Type (JPEG, PNG, WebP, HEIC or PDF). The body is
+    streamed to storage chunk by chunk rather than read into memory.
+    """
+    expense = await run_in_threadpool(_get_member_expense, expense_id, current_user)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in receipt_service.ALLOWED_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Receipts must be JPEG, PNG, WebP, HEIC or PDF files")
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > RECEIPT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Receipts can be at most {RECEIPT_MAX_BYTES} bytes")
+
+    upload = await run_in_threadpool(
+        receipt_service.ReceiptUpload, expense_id, expense.groupId, content_type, current_user.email
+    )
+    try:
+        # Network reads are small; hand them to storage a chunk at a time
+        pending = bytearray()
+        async for data in request.stream():
+            pending += data
+            if len(pending) >= RECEIPT_CHUNK_SIZE:
+                await run_in_threadpool(upload.write, bytes(pending))
+                pending.clear()
+        await run_in_threadpool(upload.write, bytes(pending))
+        if not upload.size:
+            raise HTTPException(status_code=400, detail="The receipt is empty")
+        return await run_in_threadpool(upload.complete)
+    except receipt_service.ReceiptTooLarge:
+        await run_in_threadpool(upload.abort)
+        raise HTTPException(status_code=413, detail=f"Receipts can be at most {RECEIPT_MAX_BYTES} bytes")
+    except receipt_service.ReceiptReplaced:
+        raise HTTPException(status_code=409, detail="A newer receipt was uploaded for this expense")
+    except BaseException:
+        await run_in_threadpool(upload.abort)
+        raise
+
+
+@router.get("/{expense_id}/receipt")
+def download_receipt(
+    expense_id: str,
+    request: Request,
+    current_user: UserBase = Depends(get_current_user)
+):
+    """
+    Download an expense's receipt. Supports single byte ranges (`Range: bytes=0-1023`),
+    answered with 206 Partial Content.
+    """
+    receipt = _get_member_receipt(expense_id, current_user)
+    size = receipt["length"]
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{receipt["_id"]}"',
+        "Content-Disposition": "inline"
+    }
+    try:
+        byte_range = receipt_service.parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        receipt_service.iter_receipt(receipt, start, end),
+        status_code=status_code,
+        media_type=receipt["metadata"]["contentType"],
+        headers=headers
+    )
+
+
+@router.get("/{expense_id}/receipt/thumbnail")
+def get_receipt_thumbnail(expense_id: str, current_user: UserBase = Depends(get_current_user)):
+    """
+    A small JPEG preview of an image receipt, generated on first request and cached.
+    """
+    receipt = _get_member_receipt(expense_id, current_user)
+    if not receipt_service.thumbnails_supported():
+        raise HTTPException(status_code=501, detail="Thumbnails are not available on this server")
+    try:
+        thumbnail = receipt_service.get_thumbnail(receipt)
+    except receipt_service.ThumbnailUnavailable as exc:
+        raise HTTPException(status_code=415, detail=str(exc))
+    except receipt_service.ThumbnailFailed as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    return Response(
+        content=thumbnail,
+        media_type=receipt_service.THUMBNAIL_CONTENT_TYPE,
+        headers={"ETag": f'"{receipt["_id"]}"', "Cache-Control": "private, max-age=86400"}
+    )
+
+
+@router.delete("/{expense_id}/receipt")
+def delete_receipt(expense_id: str, current_user: UserBase = Depends(get_current_user)):
+    """
+    Remove an expense's receipt.
+    """
+    _get_member_expense(expense_id, current_user)
+    if not receipt_service.delete_expense_receipts(expense_id):
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return {"message": "Receipt deleted successfully"}
@@ -1,13 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends
-from app.models.group import GroupCreate, GroupBase, AddMembersPayload
+from app.models.group import GroupCreate, GroupBase, AddMembersPayload, GroupJob
 from app.models.user import UserBase
 from app.services import group_service  # <-- your file with the logic you pasted
+from app.services import group_jobs, fx_rates
 from typing import List
 from app.deps.current_user import get_current_user  # to protect routes
+from app.deps.group_member import require_group_member
+from app.services.profiling import ProfiledRoute
 
 router = APIRouter(
     prefix="/groups",
-    tags=["Groups"]
+    tags=["Groups"],
+    route_class=ProfiledRoute
 )
 
 
@@ -16,9 +20,11 @@ def create_group(payload: GroupCreate, current_user: UserBase = Depends(get_curr
     """
     Create a new group. The logged-in user will be the creator.
     """
+    if payload.baseCurrency is not None and not fx_rates.is_known_currency(payload.baseCurrency):
+        raise HTTPException(status_code=422, detail=f"No exchange rates for currency {payload.baseCurrency}")
     payload.createdBy = current_user.email
     payload.members = [current_user.email]  # creator auto added
-    new_group = group_service.create_group(payload)
+    new_group = group_service.create_group(payload, known_names={current_user.email: current_user.name})
     return new_group
 
 
@@ -32,33 +38,70 @@ def get_user_groups(current_user: UserBase = Depends(get_current_user)):
 
 
 @router.post("/{group_id}/add-member")
-def add_member(group_id: str, member_email: str, current_user: UserBase = Depends(get_current_user)):
+def add_member(group_id: str, member_email: str, current_user: UserBase = Depends(require_group_member)):
     """
     Add a new member to a group.
     """
-    success = group_service.add_member_to_group(group_id, member_email)
-    if not success:
+    members = group_service.add_member_to_group(group_id, member_email)
+    if members is None:
         raise HTTPException(status_code=400, detail="Failed to add member (maybe already in group)")
-    return {"message": f"{member_email} added successfully"}
+    return {"message": f"{member_email} added successfully", "members": members}
 
 
 @router.post("/{group_id}/add-members")
-def add_multiple_members(group_id: str, payload: AddMembersPayload, current_user: UserBase = Depends(get_current_user)):
+def add_multiple_members(group_id: str, payload: AddMembersPayload, current_user: UserBase = Depends(require_group_member)):
     """
     Add multiple members to a group at once.
     """
-    success = group_service.add_multiple_members_to_group(group_id, payload.member_emails)
-    if not success:
+    members = group_service.add_multiple_members_to_group(group_id, payload.member_emails)
+    if members is None:
         raise HTTPException(status_code=400, detail="Failed to add members (maybe already in group)")
-    return {"message": f"{len(payload.member_emails)} member(s) added successfully"}
+    return {"message": f"{len(payload.member_emails)} member(s) added successfully", "members": members}
 
 
 @router.post("/{group_id}/remove-member")
-def remove_member(group_id: str, member_email: str, current_user: UserBase = Depends(get_current_user)):
+def remove_member(group_id: str, member_email: str, current_user: UserBase = Depends(require_group_member)):
     """
     Remove a member from a group.
     """
-    success = group_service.remove_member_from_group(group_id, member_email)
-    if not success:
+    members = group_service.remove_member_from_group(group_id, member_email)
+    if members is None:
         raise HTTPException(status_code=400, detail="Failed to remove member")
-    return {"message": f"{member_email} removed successfully"}
+    return {"message": f"{member_email} removed successfully", "members": members}
+
+
+def _start_removal(group_id: str, action: str, current_user: UserBase) -> dict:
+    job = group_jobs.start_group_job(group_id, action, current_user.email)
+    if not job:
+        raise HTTPException(status_code=403, detail="Only the group creator can delete or archive the group")
+    return job
+
+
+@router.delete("/{group_id}", response_model=GroupJob, status_code=202)
+def delete_group(group_id: str, current_user: UserBase = Depends(require_group_member)):
+    """
+    Delete a group with its expenses, settlements and derived data.
+    The group is hidden from its members immediately; its data is removed by a background
+    job whose progress can be followed at GET /groups/jobs/{job_id}.
+    """
+    return _start_removal(group_id, group_jobs.ACTION_DELETE, current_user)
+
+
+@router.post("/{group_id}/archive", response_model=GroupJob, status_code=202)
+def archive_group(group_id: str, current_user: UserBase = Depends(require_group_member)):
+    """
+    Archive a group: like delete, but the group, its expenses and its settlements are
+    kept in the archive collections.
+    """
+    return _start_removal(group_id, group_jobs.ACTION_ARCHIVE, current_user)
+
+
+@router.get("/jobs/{job_id}", response_model=GroupJob)
+def get_group_job(job_id: str, current_user: UserBase = Depends(get_current_user)):
+    """
+    Status and progress of a delete/archive job started by the current user.
+    """
+    job = group_jobs.get_group_job(job_id, current_user.email)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, HTTPException, Depends
+from typing import List
+from app.models.recurring import RecurringExpenseCreate, RecurringExpenseBase
+from app.models.user import UserBase
+from app.services import recurring_service, membership_cache, fx_rates
+from app.deps.current_user import get_current_user
+from app.deps.group_member import require_group_member
+from app.services.profiling import ProfiledRoute
+
+router = APIRouter(
+    prefix="/recurring",
+    tags=["Recurring Expenses"],
+    route_class=ProfiledRoute
+)
+
+
+@router.post("/", response_model=RecurringExpenseBase)
+def create_recurring_expense(
+    payload: RecurringExpenseCreate,
+    current_user: UserBase = Depends(get_current_user)
+):
+    """
+    Create a recurring expense template for a group (e.g. rent on the 1st of each month).
+    The scheduler adds an expense for every occurrence from `startAt` on, including
+    occurrences that are already in the past.
+    """
+    if not membership_cache.is_member(current_user.email, payload.groupId):
+        raise HTTPException(status_code=403, detail="You are not a member of this group")
+    if payload.currency is not None and not fx_rates.is_known_currency(payload.currency):
+        raise HTTPException(status_code=422, detail=f"No exchange rates for currency {payload.currency}")
+    payload.paidBy = current_user.email
+    return recurring_service.create_template(payload, current_user.email)
+
+
+@router.get("/group/{group_id}", response_model=List[RecurringExpenseBase])
+def get_group_recurring_expenses(
+    group_id: str,
+    current_user: UserBase = Depends(require_group_member)
+):
+    """
+    List the recurring expense templates of a group.
+    """
+    return recurring_service.get_group_templates(group_id)
+
+
+@router.delete("/{template_id}")
+def delete_recurring_expense(
+    template_id: str,
+    current_user: UserBase = Depends(get_current_user)
+):
+    """
+    Delete a recurring expense template. Expenses it already created are kept.
+    """
+    template = recurring_service.get_template(template_id)
+    if not template or not membership_cache.is_member(current_user.email, template["groupId"]):
+        raise HTTPException(status_code=404, detail="Recurring expense not found")
+    recurring_service.delete_template(template_id)
+    return {"message": "Recurring expense deleted successfully"}
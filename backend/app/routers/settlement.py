@@ -1,18 +1,22 @@
 from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from datetime import datetime
+from typing import List, Optional
+from app.services.balance_service import get_group_balances
 from app.services.settlement_service import (
     settle_group_expenses,
     record_settlements,
     get_group_settlements
 )
-from app.models.settlement import SettlementBase, SettlementList
+from app.models.settlement import SettlementBase, SettlementList, GroupBalances
 
-from app.deps.current_user import get_current_user
+from app.deps.group_member import require_group_member
 from app.models.user import UserBase
+from app.services.profiling import ProfiledRoute
 
 router = APIRouter(
     prefix="/settlements",
-    tags=["Settlements"]
+    tags=["Settlements"],
+    route_class=ProfiledRoute
 )
 
 # ----------------- ROUTES -----------------
@@ -20,7 +24,7 @@ router = APIRouter(
 @router.post("/settle/{group_id}", response_model=List[SettlementBase])
 def settle_expenses(
     group_id: str,
-    current_user: UserBase = Depends(get_current_user)
+    current_user: UserBase = Depends(require_group_member)
 ):
     """
     Calculate and record settlements for a group.
@@ -36,12 +40,14 @@ def settle_expenses(
 @router.post("/calculate/{group_id}")
 def calculate_settlements(
     group_id: str,
-    current_user: UserBase = Depends(get_current_user)
+    as_of: Optional[datetime] = None,
+    current_user: UserBase = Depends(require_group_member)
 ):
     """
     Preview the settlement result before recording in DB.
+    Pass `as_of` to see what the group owed at a point in time (e.g. month-end).
     """
-    settlements = settle_group_expenses(group_id)
+    settlements = settle_group_expenses(group_id, as_of)
     if not settlements:
         raise HTTPException(status_code=404, detail="No settlements found.")
     return settlements
@@ -50,10 +56,30 @@ def calculate_settlements(
 @router.get("/{group_id}", response_model=List[SettlementBase])
 def get_group_settlement_records(
     group_id: str,
-    current_user: UserBase = Depends(get_current_user)
+    current_user: UserBase = Depends(require_group_member)
 ):
     """
     Get all settlement transactions for a specific group.
     """
     settlements = get_group_settlements(group_id)
     return settlements
+
+
+@router.get("/balances/{group_id}", response_model=GroupBalances)
+def get_balances(
+    group_id: str,
+    as_of: Optional[datetime] = None,
+    current_user: UserBase = Depends(require_group_member)
+):
+    """
+    Net balance of every member, optionally as of a point in time.
+    """
+    balances = get_group_balances(group_id, as_of)
+    return {
+        "groupId": group_id,
+        "asOf": as_of,
+        "balances": [
+            {"userEmail": user, "netBalance": round(balance, 2)}
+            for user, balance in balances.items()
+        ]
+    }
@@ -0,0 +1,235 @@
+"""
+Spending analytics backed by pre-aggregated rollup documents.
+
+Each rollup in `db.expense_rollups` holds the totals for one
+(groupId, month, category, member) bucket:
+- paid: amount the member paid
+- share: the member's share of the expenses
+- expenseCount: number of expenses the member paid
+
+Rollups are updated incrementally whenever an expense is created, updated or deleted,
+so reports read O(buckets) documents instead of every expense. Equal splits without
+explicit splits are attributed to the members they were recorded with, which expense
+writes store on the expense as `participants`, so an update or delete takes back exactly
+what was added. Expenses without `participants` (written before it was stored) use the
+group's current members.
+Amounts are in the group's base currency, converted with the rate of each expense's date.
+
+Run a full rebuild from the backend directory with:
+    python -m app.services.analytics_service
+"""
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+from app.database import db
+from app.config import DEFAULT_CURRENCY
+from app.services import fx_rates
+from app.services.balance_service import to_utc_naive
+from app.services.expense_buckets import iter_group_expense_docs
+from app.services.balance_table import expense_shares
+from typing import Dict, Iterable, List, Optional, Tuple
+
+RollupKey = Tuple[str, str, str, str]  # (groupId, month, category, member)
+
+
+def _month_key(date: Optional[datetime]) -> str:
+    date = to_utc_naive(date) or datetime.utcnow()
+    return date.strftime("%Y-%m")
+
+
+def _get_group_members(group_id: str) -> Tuple[List[str], str]:
+    """
+    The group's members and base currency.
+    """
+    group = db.groups.find_one({"_id": ObjectId(group_id)}, {"members": 1, "baseCurrency": 1}) or {}
+    return _members_and_currency(group)
+
+
+def _members_and_currency(group: Dict) -> Tuple[List[str], str]:
+    return group.get("members", []), group.get("baseCurrency", DEFAULT_CURRENCY)
+
+
+def participants(split_type: Optional[str], splits: Optional[Dict], group: Dict) -> Optional[List[str]]:
+    """
+    The `participants` to store on an expense written with these splits: the group's
+    current members for equal splits without explicit splits, otherwise None.
+    """
+    if (split_type or "equal") == "equal" and splits is None:
+        return list(group.get("members", []))
+    return None
+
+
+def _accumulate(
+    totals: Dict[RollupKey, Dict[str, float]],
+    expense: Dict,
+    all_group_members: List[str],
+    base_currency: str,
+    sign: int = 1
+) -> None:
+    """
+    Add (sign=1) or remove (sign=-1) one expense's contribution to a map of rollup increments.
+    """
+    expense = fx_rates.to_currency(expense, base_currency)
+    month = _month_key(expense.get("date"))
+    group_id = expense["groupId"]
+    category = expense["category"]
+
+    payer_key = (group_id, month, category, expense["paidBy"])
+    payer = totals.setdefault(payer_key, {"paid": 0.0, "share": 0.0, "expenseCount": 0})
+    payer["paid"] += sign * expense["amount"]
+    payer["expenseCount"] += sign
+
+    for member, share in expense_shares(expense, expense.get("participants") or all_group_members).items():
+        bucket = totals.setdefault((group_id, month, category, member), {"paid": 0.0, "share": 0.0, "expenseCount": 0})
+        bucket["share"] += sign * share
+
+
+def _write_increments(totals: Dict[RollupKey, Dict[str, float]]) -> None:
+    if not totals:
+        return
+
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"groupId": group_id, "month": month, "category": category, "member": member},
+            {"$inc": increments, "$set": {"updatedAt": now}},
+            upsert=True
+        )
+        for (group_id, month, category, member), increments in totals.items()
+    ]
+    db.expense_rollups.bulk_write(operations, ordered=False)
+
+
+def _record_changes(changes: Iterable[Tuple[Optional[Dict], int]], groups: Iterable[Dict] = ()) -> None:
+    totals: Dict[RollupKey, Dict[str, float]] = {}
+    members_by_group = {str(group["_id"]): _members_and_currency(group) for group in groups if group}
+
+    for expense, sign in changes:
+        if not expense:
+            continue
+        group_id = expense["groupId"]
+        if group_id not in members_by_group:
+            members_by_group[group_id] = _get_group_members(group_id)
+        _accumulate(totals, expense, *members_by_group[group_id], sign)
+
+    _write_increments(totals)
+
+
+def record_expense_change(
+    old_expense: Optional[Dict] = None,
+    new_expense: Optional[Dict] = None,
+    groups: Iterable[Dict] = ()
+) -> None:
+    """
+    Update rollups for a created (old=None), updated, or deleted (new=None) expense.
+    All affected buckets are written in a single bulk write. `groups` are group documents
+    (with members and baseCurrency) the caller already loaded; other groups are read.
+    """
+    _record_changes(((old_expense, -1), (new_expense, 1)), groups)
+
+
+def record_expenses_created(expenses: List[Dict], groups: Iterable[Dict] = ()) -> None:
+    """
+    Update rollups for a batch of new expenses in a single bulk write.
+    """
+    _record_changes(((expense, 1) for expense in expenses), groups)
+
+
+def rebuild_group_rollups(group_id: str) -> int:
+    """
+    Recompute all rollups for a group from its expenses. Returns the number of buckets written.
+    """
+    all_group_members, base_currency = _get_group_members(group_id)
+    totals: Dict[RollupKey, Dict[str, float]] = {}
+
+    for expense in iter_group_expense_docs(group_id):
+        _accumulate(totals, expense, all_group_members, base_currency)
+
+    # Each bucket is replaced in place and only then are buckets that no longer exist
+    # deleted, so reports never see the group without rollups while it is rebuilt
+    now = datetime.utcnow()
+    rebuild_id = ObjectId()
+    operations = [
+        ReplaceOne(
+            {"groupId": key[0], "month": key[1], "category": key[2], "member": key[3]},
+            {
+                "groupId": key[0],
+                "month": key[1],
+                "category": key[2],
+                "member": key[3],
+                **values,
+                "rebuildId": rebuild_id,
+                "updatedAt": now
+            },
+            upsert=True
+        )
+        for key, values in totals.items()
+    ]
+    operations.append(DeleteMany({"groupId": group_id, "rebuildId": {"$ne": rebuild_id}}))
+    db.expense_rollups.bulk_write(operations, ordered=True)
+    return len(totals)
+
+
+def rebuild_all_rollups() -> int:
+    """
+    Rebuild rollups for every group. Returns the total number of buckets written.
+    """
+    written = 0
+    for group in db.groups.find({}, {"_id": 1}):
+        written += rebuild_group_rollups(str(group["_id"]))
+    return written
+
+
+def _build_report(rollup_query: Dict, start_month: Optional[str], end_month: Optional[str]) -> Dict:
+    month_filter = {}
+    if start_month:
+        month_filter["$gte"] = start_month
+    if end_month:
+        month_filter["$lte"] = end_month
+    if month_filter:
+        rollup_query["month"] = month_filter
+
+    rollups = []
+    by_category: Dict[str, Dict[str, float]] = {}
+    by_month: Dict[str, Dict[str, float]] = {}
+    by_member: Dict[str, Dict[str, float]] = {}
+
+    cursor = db.expense_rollups.find(rollup_query, {"_id": 0, "rebuildId": 0, "updatedAt": 0}).sort("month", 1)
+    for rollup in cursor:
+        # Buckets emptied by deletes stay behind with zero totals
+        if rollup["expenseCount"] == 0 and abs(rollup["paid"]) < 1e-6 and abs(rollup["share"]) < 1e-6:
+            continue
+
+        rollup["paid"] = round(rollup["paid"], 2)
+        rollup["share"] = round(rollup["share"], 2)
+        rollups.append(rollup)
+
+        for summary, key in ((by_category, rollup["category"]), (by_month, rollup["month"]), (by_member, rollup["member"])):
+            totals = summary.setdefault(key, {"paid": 0.0, "share": 0.0})
+            totals["paid"] = round(totals["paid"] + rollup["paid"], 2)
+            totals["share"] = round(totals["share"] + rollup["share"], 2)
+
+    return {
+        "rollups": rollups,
+        "byCategory": by_category,
+        "byMonth": by_month,
+        "byMember": by_member
+    }
+
+
+def get_group_spending(group_id: str, start_month: Optional[str] = None, end_month: Optional[str] = None) -> Dict:
+    """
+    Spending report for a group, optionally limited to a month range ("YYYY-MM", inclusive).
+    """
+    return _build_report({"groupId": group_id}, start_month, end_month)
+
+
+def get_user_spending(user_email: str, start_month: Optional[str] = None, end_month: Optional[str] = None) -> Dict:
+    """
+    Spending report for a user across all of their groups.
+    """
+    return _build_report({"member": user_email}, start_month, end_month)
+
+
+if __name__ == "__main__":
+    print(f"Rebuilt {rebuild_all_rollups()} rollup bucket(s)")
@@ -0,0 +1,367 @@
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.database import db
+from app.config import BALANCE_CHECKPOINT_INTERVAL, SETTLEMENT_OFFLOAD_THRESHOLD, DEFAULT_CURRENCY
+from app.services import compute_pool, expense_buckets, fx_rates
+from app.services.balance_table import (
+    BalanceTable,
+    ExpenseColumns,
+    apply_expense,
+    replay_columns,
+    replay_and_match,
+    match_settlements
+)
+from typing import Dict, List, Optional, Tuple
+
+
+def to_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    Stored dates come back from MongoDB as naive UTC, while request payloads may carry a
+    timezone. Normalise so the two can be compared in Python.
+    """
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class _ExpenseEncoder:
+    """
+    Encodes expenses into columns and notes those in another currency than the group's,
+    so they can be converted afterwards in one pass per currency.
+    """
+    __slots__ = ("table", "columns", "currency", "priced")
+
+    def __init__(self, table: BalanceTable, currency: str):
+        self.table = table
+        self.columns = ExpenseColumns()
+        self.currency = currency
+        self.priced = []  # (expense index, currency, date)
+
+    def append(self, expense: Dict) -> None:
+        currency = expense.get("currency")
+        if currency and currency != self.currency:
+            self.priced.append((len(self.columns), currency, expense.get("date") or datetime.utcnow()))
+        self.columns.append(expense, self.table)
+
+    def convert(self) -> ExpenseColumns:
+        if self.priced:
+            fx_rates.convert_columns(self.columns, self.priced, self.currency)
+        return self.columns
+
+
+def get_group_balance_table(
+    group_id: str,
+    as_of: Optional[datetime] = None,
+    match: bool = False
+) -> Tuple[BalanceTable, List[Tuple[int, int, float]]]:
+    """
+    Net balances for a group as a BalanceTable, considering only expenses dated on or before
+    `as_of` (all expenses when `as_of` is None). With `match=True` the minimal settlement
+    transfers (debtor id, creditor id, amount) are computed too; otherwise the list is empty.
+
+    Starts from the nearest checkpoint at or before `as_of` and replays only the expenses
+    after it. While replaying, a new checkpoint is stored every BALANCE_CHECKPOINT_INTERVAL
+    expenses so the next query has a shorter tail.
+
+    Tails of at least SETTLEMENT_OFFLOAD_THRESHOLD expenses are fetched, encoded into
+    compact columns and replayed in the worker process pool, which opens its own database
+    client, so none of that CPU-bound work holds this worker's GIL. Smaller tails are
+    replayed inline, straight from the documents as they are read.
+
+    Groups using bucketed storage start from the buckets' pre-aggregated deltas instead.
+
+    Checkpoints are only kept if no expense of the group was written while they were being
+    computed; see `invalidate_checkpoints`.
+
+    Balances are in the group's base currency. Expenses in other currencies are converted
+    with the rate of each expense's date (in bulk after encoding, when offloaded).
+    """
+    group = db.groups.find_one(
+        {"_id": ObjectId(group_id)},
+        {"members": 1, "baseCurrency": 1, "expenseStorage": 1, "checkpointEpoch": 1}
+    ) or {}
+    table = BalanceTable(group.get("members", []))
+    currency = group.get("baseCurrency", DEFAULT_CURRENCY)
+
+    if expense_buckets.is_bucketed_group(group):
+        return _get_bucketed_balance_table(group_id, _ExpenseEncoder(table, currency), as_of, match)
+
+    # Checkpoints that converted amounts are only valid for the rates they used
+    checkpoint_query = {
+        "groupId": group_id,
+        "$or": [{"ratesVersion": {"$exists": False}}, {"ratesVersion": fx_rates.rate_table.version()}]
+    }
+    if as_of is not None:
+        checkpoint_query["asOf"] = {"$lte": as_of}
+    checkpoint = db.balance_checkpoints.find_one(checkpoint_query, sort=[("asOf", DESCENDING)])
+    converted = bool(checkpoint) and "ratesVersion" in checkpoint
+
+    date_filter = {}
+    if checkpoint:
+        for entry in checkpoint["balances"]:
+            table.add(entry["user"], entry["amount"])
+        date_filter["$gt"] = checkpoint["asOf"]
+    if as_of is not None:
+        date_filter["$lte"] = as_of
+
+    expense_query = {"groupId": group_id}
+    if date_filter:
+        expense_query["date"] = date_filter
+
+    # Read before the expenses: a write made after this read changes the epoch
+    epoch = group.get("checkpointEpoch", 0)
+    if compute_pool.is_enabled() and _has_at_least(expense_query, SETTLEMENT_OFFLOAD_THRESHOLD):
+        encoder = _ExpenseEncoder(table, currency)
+        return compute_pool.run(_replay_expenses, group_id, encoder, expense_query, converted, match, epoch)
+    return _replay_documents(group_id, table, currency, expense_query, converted, match, epoch)
+
+
+def _has_at_least(expense_query: Dict, count: int) -> bool:
+    # Counting stops at `count`, so short tails cost only an index scan that short
+    return count <= 0 or db.expenses.count_documents(expense_query, limit=count) >= count
+
+
+def _replay_expenses(
+    group_id: str,
+    encoder: _ExpenseEncoder,
+    expense_query: Dict,
+    converted: bool,
+    match: bool,
+    epoch: int
+) -> Tuple[BalanceTable, List[Tuple[int, int, float]]]:
+    """
+    Fetch, encode and replay the expenses matching `expense_query` onto the encoder's
+    table, storing checkpoints along the way. `converted` tells whether the balances the
+    table starts from already include converted amounts, and `epoch` is the group's
+    checkpoint epoch read before the expenses. Runs in the worker pool; short tails are
+    replayed inline by `_replay_documents` instead.
+    """
+    table = encoder.table
+    # Only the fields the balance table reads
+    projection = {"_id": 0, "date": 1, "amount": 1, "currency": 1, "paidBy": 1, "splitType": 1, "splits": 1}
+    expenses_cursor = db.expenses.find(expense_query, projection).sort([("date", ASCENDING), ("_id", ASCENDING)])
+
+    cuts = []  # expense index a checkpoint is taken before
+    cut_dates = []
+    since_cut = 0
+    last_date = None
+    for expense in expenses_cursor:
+        # A checkpoint must cover every expense up to its date, so only cut one
+        # once the replay has moved past the last expense sharing that date.
+        if since_cut >= BALANCE_CHECKPOINT_INTERVAL and expense["date"] > last_date:
+            cuts.append(len(encoder.columns))
+            cut_dates.append(last_date)
+            since_cut = 0
+
+        encoder.append(expense)
+        since_cut += 1
+        last_date = expense["date"]
+
+    # Read before converting: a checkpoint may be stamped older than its rates, never newer
+    rates_version = fx_rates.rate_table.version()
+    first_converted = encoder.priced[0][0] if encoder.priced else None
+    values, snapshots = replay_columns(table.values, table.group_ids, encoder.convert(), cuts)
+    table.values = values
+    transfers = match_settlements(values) if match else []
+
+    checkpoints = []
+    for cut, cut_date, snapshot in zip(cuts, cut_dates, snapshots):
+        uses_rates = converted or (first_converted is not None and first_converted < cut)
+        checkpoints.append((cut_date, dict(zip(table.members, snapshot)), rates_version if uses_rates else None))
+    _save_checkpoints(group_id, epoch, checkpoints)
+
+    return table, transfers
+
+
+def _replay_documents(
+    group_id: str,
+    table: BalanceTable,
+    currency: str,
+    expense_query: Dict,
+    converted: bool,
+    match: bool,
+    epoch: int
+) -> Tuple[BalanceTable, List[Tuple[int, int, float]]]:
+    """
+    Inline counterpart of `_replay_expenses` for short tails: each expense is applied to
+    the table as it is read, without encoding the tail into columns first. Same results,
+    checkpoints and member interning order as `replay_columns`.
+    """
+    values, group_ids = table.values, table.group_ids
+    projection = {"_id": 0, "date": 1, "amount": 1, "currency": 1, "paidBy": 1, "splitType": 1, "splits": 1}
+    expenses_cursor = db.expenses.find(expense_query, projection).sort([("date", ASCENDING), ("_id", ASCENDING)])
+    # Read before converting: a checkpoint may be stamped older than its rates, never newer
+    rates_version = fx_rates.rate_table.version()
+
+    checkpoints = []
+    shared = 0.0  # whole-group equal splits, applied to every member at a checkpoint or the end
+    since_cut = 0
+    last_date = None
+    for expense in expenses_cursor:
+        # A checkpoint must cover every expense up to its date (see _replay_expenses)
+        if since_cut >= BALANCE_CHECKPOINT_INTERVAL and expense["date"] > last_date:
+            for member_id in group_ids:
+                values[member_id] -= shared
+            shared = 0.0
+            checkpoints.append((last_date, table.to_dict(), rates_version if converted else None))
+            since_cut = 0
+
+        expense_currency = expense.get("currency")
+        if expense_currency and expense_currency != currency:
+            expense = fx_rates.to_currency(expense, currency)
+            converted = True
+        shared += apply_expense(table, expense)
+        since_cut += 1
+        last_date = expense["date"]
+
+    if shared:
+        for member_id in group_ids:
+            values[member_id] -= shared
+    _save_checkpoints(group_id, epoch, checkpoints)
+    return table, match_settlements(values) if match else []
+
+
+def _get_bucketed_balance_table(
+    group_id: str,
+    encoder: _ExpenseEncoder,
+    as_of: Optional[datetime],
+    match: bool
+) -> Tuple[BalanceTable, List[Tuple[int, int, float]]]:
+    # Bucket deltas already are a checkpoint per bucket, so none are stored for these groups
+    table = encoder.table
+    shared_total = expense_buckets.load_bucket_balances(group_id, to_utc_naive(as_of), table, encoder.append)
+    if table.group_ids:
+        share = shared_total / len(table.group_ids)
+        for member_id in table.group_ids:
+            table.values[member_id] -= share
+
+    # Expenses not (yet) moved into buckets
+    expense_query = {"groupId": group_id}
+    if as_of is not None:
+        expense_query["date"] = {"$lte": as_of}
+    projection = {"_id": 0, "date": 1, "amount": 1, "currency": 1, "paidBy": 1, "splitType": 1, "splits": 1}
+    for expense in db.expenses.find(expense_query, projection):
+        encoder.append(expense)
+
+    _, transfers = _replay(table, encoder.convert(), (), match)
+    return table, transfers
+
+
+def _replay(
+    table: BalanceTable,
+    columns: ExpenseColumns,
+    cuts: List[int],
+    match: bool
+) -> Tuple[List, List[Tuple[int, int, float]]]:
+    """
+    Replay `columns` onto `table` in place, in the worker pool for large inputs.
+    Returns the checkpoint snapshots and, with `match=True`, the settlement transfers.
+    """
+    transfers = []
+    if compute_pool.is_enabled() and len(columns) >= SETTLEMENT_OFFLOAD_THRESHOLD:
+        if match:
+            values, snapshots, transfers = compute_pool.run(replay_and_match, table.values, table.group_ids, columns, cuts)
+        else:
+            values, snapshots = compute_pool.run(replay_columns, table.values, table.group_ids, columns, cuts)
+    else:
+        values, snapshots = replay_columns(table.values, table.group_ids, columns, cuts)
+        if match:
+            transfers = match_settlements(values)
+    table.values = values
+    return snapshots, transfers
+
+
+def get_group_balances(group_id: str, as_of: Optional[datetime] = None) -> Dict[str, float]:
+    """
+    Net balance per member (email -> balance) for a group, optionally as of a point in time.
+    """
+    table, _ = get_group_balance_table(group_id, as_of)
+    return table.to_dict()
+
+
+def _save_checkpoint(
+    group_id: str,
+    as_of: datetime,
+    balances: Dict[str, float],
+    rates_version: Optional[int] = None
+) -> None:
+    # Emails contain dots, so balances are stored as a list rather than a keyed sub-document
+    fields = {
+        "balances": [{"user": user, "amount": amount} for user, amount in balances.items()],
+        "createdAt": datetime.utcnow()
+    }
+    if rates_version is None:
+        db.balance_checkpoints.update_one({"groupId": group_id, "asOf": as_of}, {"$setOnInsert": fields}, upsert=True)
+        return
+
+    # Replaces a checkpoint computed with other rates; one with these rates is kept
+    try:
+        db.balance_checkpoints.update_one(
+            {"groupId": group_id, "asOf": as_of, "ratesVersion": {"$ne": rates_version}},
+            {"$set": {**fields, "ratesVersion": rates_version}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass
+
+
+def _save_checkpoints(
+    group_id: str,
+    epoch: int,
+    checkpoints: List[Tuple[datetime, Dict[str, float], Optional[int]]]
+) -> None:
+    """
+    Store the (asOf, balances, rates version) checkpoints of a replay that started at
+    checkpoint epoch `epoch`. They are written first and then recorded in the group's
+    `lastCheckpointAt`; if the epoch has moved by then, an expense was written during the
+    replay and may be missing from them, so they are deleted again.
+    """
+    if not checkpoints:
+        return
+    for as_of, balances, rates_version in checkpoints:
+        _save_checkpoint(group_id, as_of, balances, rates_version)
+
+    dates = [as_of for as_of, _, _ in checkpoints]
+    group = db.groups.find_one_and_update(
+        {"_id": ObjectId(group_id)},
+        {"$max": {"lastCheckpointAt": max(dates)}},
+        projection={"checkpointEpoch": 1}
+    )
+    if not group or group.get("checkpointEpoch", 0) != epoch:
+        db.balance_checkpoints.delete_many({"groupId": group_id, "asOf": {"$in": dates}})
+
+
+def invalidate_checkpoints(group_id: str, since: Optional[datetime] = None, group: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Drop checkpoints that may include a changed expense. Call it after writing the change.
+    Expenses dated `since` or later are affected, so every checkpoint at or after that date
+    goes. Passing no date drops all checkpoints for the group (e.g. after a membership change,
+    since equal splits without explicit splits depend on the current member list).
+
+    The group's `checkpointEpoch` is bumped first, so a replay that read the expenses before
+    the change drops the checkpoints it saves afterwards (see `_save_checkpoints`); those it
+    saved already are at or before `lastCheckpointAt` and deleted here. Callers that bumped
+    the epoch in their own update of the group pass the updated `group`, which must include
+    `lastCheckpointAt`. Returns the group document (with its members and base currency, for
+    the analytics rollups), or None if the group is gone.
+    """
+    if group is None:
+        group = db.groups.find_one_and_update(
+            {"_id": ObjectId(group_id)},
+            {"$inc": {"checkpointEpoch": 1}},
+            projection={"lastCheckpointAt": 1, "members": 1, "baseCurrency": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    last_checkpoint_at = (group or {}).get("lastCheckpointAt")
+    since = to_utc_naive(since)
+    if last_checkpoint_at is None or (since is not None and since > last_checkpoint_at):
+        # No checkpoint of the group can be affected
+        return group
+
+    query = {"groupId": group_id}
+    if since is not None:
+        query["asOf"] = {"$gte": since}
+    db.balance_checkpoints.delete_many(query)
+    return group
@@ -0,0 +1,299 @@
+from array import array
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Balances closer to zero than this are treated as settled
+EPSILON = 1e-6
+
+# How an encoded expense debits its participants
+KIND_NONE = 0        # invalid split configuration: only the payer is credited
+KIND_EQUAL_ALL = 1   # equal split over ALL group members (splits = None)
+KIND_EQUAL = 2       # equal split over the listed members
+KIND_UNEQUAL = 3     # listed members owe exact amounts
+KIND_PERCENTAGE = 4  # listed members owe a percentage of the amount
+
+
+def expense_shares(expense: Dict, all_group_members: List[str]) -> Dict[str, float]:
+    """
+    Amount each participant owes for a single expense (email -> share).
+
+    For equal split:
+    - splits = None: divide equally among ALL group members
+    - splits = {email: 1, email: 1, ...}: divide equally among ONLY participating members
+
+    For unequal split:
+    - splits = {email: amount, email: amount, ...}: each member owes the specified amount
+
+    For percentage split:
+    - splits = {email: percentage, email: percentage, ...}: each member owes the specified percentage
+
+    An invalid split configuration yields no shares.
+    """
+    amount = expense["amount"]
+    split_type = expense.get("splitType", "equal")
+    splits = expense.get("splits")  # can be None or dict
+
+    if split_type == "equal":
+        # No splits provided = all group members, otherwise only the listed members
+        participating_members = all_group_members if splits is None else list(splits.keys())
+        if not participating_members:
+            return {}
+        split_amount = amount / len(participating_members)
+        return {member: split_amount for member in participating_members}
+
+    if split_type == "unequal" and splits:
+        return dict(splits)
+
+    if split_type == "percentage" and splits:
+        return {member: (amount * percentage) / 100 for member, percentage in splits.items()}
+
+    return {}
+
+
+class BalanceTable:
+    """
+    Net balances for one group, held in a flat float array indexed by small integer ids.
+
+    Member emails are interned to ids once per group; callers map ids back to emails only
+    when producing output.
+
+    This module has no database dependency so it can be used from benchmarks and worker
+    processes.
+    """
+    __slots__ = ("members", "index", "values", "group_ids")
+
+    def __init__(self, group_members: Iterable[str] = ()):
+        self.members: List[str] = []       # id -> email
+        self.index: Dict[str, int] = {}    # email -> id
+        self.values = array("d")           # id -> net balance
+        # One entry per group member (duplicates included, as in the stored member list)
+        self.group_ids = array("i", [self.intern(member) for member in group_members])
+
+    def intern(self, email: str) -> int:
+        member_id = self.index.get(email)
+        if member_id is None:
+            member_id = len(self.members)
+            self.index[email] = member_id
+            self.members.append(email)
+            self.values.append(0.0)
+        return member_id
+
+    def add(self, email: str, amount: float) -> None:
+        self.values[self.intern(email)] += amount
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(zip(self.members, self.values))
+
+
+class ExpenseColumns:
+    """
+    Expenses encoded as parallel arrays of interned ids and floats.
+
+    This is the compact form shipped to worker processes: it pickles to a handful of
+    byte buffers instead of one dict per expense. Split participants of expense k are
+    entries [split_end[k - 1], split_end[k]) of split_member/split_value.
+    """
+    __slots__ = ("payer", "amount", "kind", "split_end", "split_member", "split_value")
+
+    def __init__(self):
+        self.payer = array("i")
+        self.amount = array("d")
+        self.kind = array("b")
+        self.split_end = array("i")
+        self.split_member = array("i")
+        self.split_value = array("d")
+
+    def __len__(self) -> int:
+        return len(self.payer)
+
+    def append(self, expense: Dict, table: BalanceTable) -> None:
+        """
+        Encode one expense, interning its members into `table`.
+        Split rules match `expense_shares`.
+        """
+        intern = table.intern
+        split_type = expense.get("splitType", "equal")
+        splits = expense.get("splits")
+
+        kind = KIND_NONE
+        if split_type == "equal":
+            if splits is None:
+                kind = KIND_EQUAL_ALL
+            elif splits:
+                kind = KIND_EQUAL
+                for member in splits:
+                    self.split_member.append(intern(member))
+                    self.split_value.append(0.0)
+        elif split_type in ("unequal", "percentage") and splits:
+            kind = KIND_UNEQUAL if split_type == "unequal" else KIND_PERCENTAGE
+            for member, value in splits.items():
+                self.split_member.append(intern(member))
+                self.split_value.append(value)
+
+        self.payer.append(intern(expense["paidBy"]))
+        self.amount.append(expense["amount"])
+        self.kind.append(kind)
+        self.split_end.append(len(self.split_member))
+
+
+def apply_expense(table: BalanceTable, expense: Dict) -> float:
+    """
+    Apply one expense document to `table` directly, without encoding it: participants are
+    debited their share and the payer is credited, interning members in the same order as
+    `ExpenseColumns.append`. A whole-group equal split is not applied; its per-member share
+    is returned for the caller to subtract from every group member later, as
+    `replay_columns` does. Split rules match `expense_shares`.
+    """
+    values = table.values
+    intern = table.intern
+    amount = expense["amount"]
+    split_type = expense.get("splitType", "equal")
+    splits = expense.get("splits")
+
+    shared = 0.0
+    if split_type == "equal":
+        if splits is None:
+            if table.group_ids:
+                shared = amount / len(table.group_ids)
+        elif splits:
+            split_amount = amount / len(splits)
+            for member in splits:
+                values[intern(member)] -= split_amount
+    elif split_type == "unequal" and splits:
+        for member, split_amount in splits.items():
+            values[intern(member)] -= split_amount
+    elif split_type == "percentage" and splits:
+        for member, percentage in splits.items():
+            values[intern(member)] -= (amount * percentage) / 100
+
+    values[intern(expense["paidBy"])] += amount
+    return shared
+
+
+def scale_expenses(columns: ExpenseColumns, indices: Sequence[int], factors: Sequence[float]) -> None:
+    """
+    Multiply the amounts of the given encoded expenses by per-expense factors in place,
+    e.g. to convert them to another currency. Exact (unequal) split amounts are scaled
+    too; equal and percentage splits follow the amount.
+    """
+    amounts, kinds = columns.amount, columns.kind
+    split_end, split_value = columns.split_end, columns.split_value
+    for k, factor in zip(indices, factors):
+        amounts[k] *= factor
+        if kinds[k] == KIND_UNEQUAL:
+            for p in range(split_end[k - 1] if k else 0, split_end[k]):
+                split_value[p] *= factor
+
+
+def replay_columns(
+    values: array,
+    group_ids: array,
+    columns: ExpenseColumns,
+    cuts: Sequence[int] = ()
+) -> Tuple[array, List[array]]:
+    """
+    Apply encoded expenses to a copy of `values`: the payer is credited with the full amount
+    and participants are debited their share.
+
+    `cuts` are ascending expense indices; a snapshot of the balances is taken just before
+    each of them is applied. Returns the final balances and the snapshots.
+
+    Whole-group equal splits are accumulated into one per-member amount and applied when
+    a snapshot is taken or at the end, so they cost O(1) per expense instead of O(members).
+    Pure function of its arguments, so it can run in a worker process.
+    """
+    values = array("d", values)
+    payer, amounts, kinds = columns.payer, columns.amount, columns.kind
+    split_end, split_member, split_value = columns.split_end, columns.split_member, columns.split_value
+    group_size = len(group_ids)
+
+    snapshots = []
+    pending_cuts = list(reversed(cuts))
+    shared = 0.0
+    start = 0
+    for k in range(len(payer)):
+        if pending_cuts and pending_cuts[-1] == k:
+            pending_cuts.pop()
+            for member_id in group_ids:
+                values[member_id] -= shared
+            shared = 0.0
+            snapshots.append(array("d", values))
+
+        amount = amounts[k]
+        values[payer[k]] += amount
+
+        kind = kinds[k]
+        end = split_end[k]
+        if kind == KIND_EQUAL_ALL:
+            if group_size:
+                shared += amount / group_size
+        elif kind == KIND_EQUAL:
+            share = amount / (end - start)
+            for p in range(start, end):
+                values[split_member[p]] -= share
+        elif kind == KIND_UNEQUAL:
+            for p in range(start, end):
+                values[split_member[p]] -= split_value[p]
+        elif kind == KIND_PERCENTAGE:
+            for p in range(start, end):
+                values[split_member[p]] -= (amount * split_value[p]) / 100
+        start = end
+
+    if shared:
+        for member_id in group_ids:
+            values[member_id] -= shared
+
+    return values, snapshots
+
+
+def match_settlements(values: Sequence[float]) -> List[Tuple[int, int, float]]:
+    """
+    Greedy matching of debtors to creditors for a minimal set of transfers.
+    Takes balances indexed by member id and returns (debtor id, creditor id, amount)
+    tuples; amounts are not rounded.
+
+    Largest debts and credits are matched first, and equal balances keep interning order:
+    the group's members as listed, then anyone else in the order they were loaded. The
+    dict-based version this replaces broke ties by first appearance in the expenses as
+    read, an order that checkpoints and buckets no longer replay; for balances without
+    ties both give the same transfers.
+    """
+    # Largest debts and credits first; ties keep interning order
+    debtor_ids = [member_id for member_id, balance in enumerate(values) if balance <= -EPSILON]
+    creditor_ids = [member_id for member_id, balance in enumerate(values) if balance >= EPSILON]
+    debtor_ids.sort(key=values.__getitem__)
+    creditor_ids.sort(key=values.__getitem__, reverse=True)
+
+    debts = array("d", [-values[member_id] for member_id in debtor_ids])
+    credits = array("d", [values[member_id] for member_id in creditor_ids])
+
+    transfers = []
+    i, j = 0, 0
+    while i < len(debts) and j < len(credits):
+        # Transfer the minimum of what debtor owes and creditor is owed
+        amount = min(debts[i], credits[j])
+        transfers.append((debtor_ids[i], creditor_ids[j], amount))
+
+        debts[i] -= amount
+        credits[j] -= amount
+
+        # Move to next debtor/creditor if current one is settled
+        if debts[i] < EPSILON:
+            i += 1
+        if credits[j] < EPSILON:
+            j += 1
+
+    return transfers
+
+
+def replay_and_match(
+    values: array,
+    group_ids: array,
+    columns: ExpenseColumns,
+    cuts: Sequence[int] = ()
+) -> Tuple[array, List[array], List[Tuple[int, int, float]]]:
+    """
+    `replay_columns` followed by `match_settlements` on the result, as one unit of work
+    for a worker process.
+    """
+    values, snapshots = replay_columns(values, group_ids, columns, cuts)
+    return values, snapshots, match_settlements(values)
@@ -0,0 +1,75 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from app.config import (
+    SETTLEMENT_POOL_WORKERS,
+    SETTLEMENT_TIMEOUT_SECONDS,
+    SETTLEMENT_RETRY_AFTER_SECONDS
+)
+
+# At most this many computations are queued or running at once; beyond that callers
+# wait (up to the timeout) for a slot instead of piling work onto the pool.
+MAX_IN_FLIGHT = max(SETTLEMENT_POOL_WORKERS, 1) * 2
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+
+class ComputationUnavailable(Exception):
+    """
+    Raised when an offloaded computation can't finish within SETTLEMENT_TIMEOUT_SECONDS.
+    Mapped to 503 with a Retry-After header in main.py.
+    """
+    retry_after = SETTLEMENT_RETRY_AFTER_SECONDS
+
+
+def is_enabled() -> bool:
+    return SETTLEMENT_POOL_WORKERS > 0
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # "spawn" keeps workers free of the parent's MongoClient and threads; a worker
+            # only imports the module of the function it runs, and opens its own client
+            # if that module uses the database.
+            _executor = ProcessPoolExecutor(
+                max_workers=SETTLEMENT_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def run(fn, *args):
+    """
+    Run `fn(*args)` in the worker pool and wait for the result.
+    `fn` must be a module-level function and its arguments picklable.
+    """
+    deadline = time.monotonic() + SETTLEMENT_TIMEOUT_SECONDS
+    if not _slots.acquire(timeout=SETTLEMENT_TIMEOUT_SECONDS):
+        raise ComputationUnavailable()
+
+    try:
+        future = _get_executor().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    # The slot is held until the worker finishes, even if the caller gives up waiting
+    future.add_done_callback(lambda _: _slots.release())
+
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeoutError:
+        future.cancel()
+        raise ComputationUnavailable()
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
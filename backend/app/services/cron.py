@@ -0,0 +1,96 @@
+"""
+Minimal 5-field cron schedules ("minute hour day-of-month month day-of-week"), in UTC.
+
+Each field accepts `*`, single values, ranges (`1-5`), lists (`1,15`) and steps (`*/15`,
+`9-17/2`). Day of week runs from 0 (Sunday) to 6, with 7 also meaning Sunday. As in cron,
+when both day fields are restricted a day matches if either of them does.
+
+    "0 9 1 * *"     09:00 on the first of every month
+    "30 18 * * 5"   18:30 every Friday
+"""
+from datetime import date, datetime, timedelta
+from typing import FrozenSet, List, Optional
+
+FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+# No valid schedule is more than a leap cycle away (e.g. "0 0 29 2 *")
+SEARCH_YEARS = 8
+
+
+def _parse_field(text: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in text.split(","):
+        span, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if span == "*":
+            start, end = low, high
+        elif "-" in span:
+            start_text, end_text = span.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(span)
+            end = high if step_text else start
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(text)
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule:
+    __slots__ = ("expression", "minutes", "hours", "days", "months", "weekdays", "any_day", "any_weekday")
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("A cron schedule needs 5 fields: minute hour day-of-month month day-of-week")
+        try:
+            parsed = [_parse_field(text, low, high) for text, (low, high) in zip(fields, FIELD_RANGES)]
+        except ValueError:
+            raise ValueError(f"Invalid cron schedule '{expression}'") from None
+
+        self.expression = expression
+        self.minutes: List[int] = sorted(parsed[0])
+        self.hours: List[int] = sorted(parsed[1])
+        self.days = parsed[2]
+        self.months = parsed[3]
+        self.weekdays = frozenset(weekday % 7 for weekday in parsed[4])
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _matches_day(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays  # cron counts from Sunday
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        """
+        The first occurrence strictly after `after`, or None if there is none.
+        """
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        last_day = day.replace(year=day.year + SEARCH_YEARS, day=1)
+        while day < last_day:
+            if day.month not in self.months:
+                # Skip to the first of the next month
+                day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+                continue
+            if self._matches_day(day):
+                for hour in self.hours:
+                    if day == start.date() and hour < start.hour:
+                        continue
+                    for minute in self.minutes:
+                        if day == start.date() and hour == start.hour and minute < start.minute:
+                            continue
+                        return datetime(day.year, day.month, day.day, hour, minute)
+            day += timedelta(days=1)
+        return None
+
+    def first_at_or_after(self, moment: datetime) -> Optional[datetime]:
+        """
+        The first occurrence at or after `moment`, or None if there is none.
+        """
+        return self.next_after(moment - timedelta(microseconds=1))
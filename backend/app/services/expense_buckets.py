@@ -0,0 +1,433 @@
+"""
+Optional bucketed storage for the expenses of very large groups.
+
+A group with `expenseStorage: "bucketed"` keeps its expenses in `db.expense_buckets`
+instead of one document per expense in `db.expenses`. Each bucket holds up to
+EXPENSE_BUCKET_SIZE expenses of one calendar month:
+
+    {
+      groupId, period: "YYYY-MM", count, minDate, maxDate,
+      expenses: [ <expense document with its own _id>, ... ],
+      deltas: { <escaped email>: net balance change },
+      sharedTotal: total of equal splits over ALL group members
+    }
+
+`deltas` pre-aggregates the balance effect of every expense in the bucket except equal
+splits without explicit splits. Those are shared by the *current* member list, so their
+amounts are summed into `sharedTotal` and divided when balances are read, exactly like
+the per-expense replay does. Expenses with an explicit `currency` are left out of both and
+counted in `pricedCount` instead: they are replayed and converted with the rate of their
+date when balances are read.
+
+expense_service reads and writes through this module, so callers see the same API for
+both layouts. Reads of a bucketed group also include any documents still in
+`db.expenses` (e.g. written by another worker during migration); re-running the
+migration moves them.
+
+Migrate a group from the backend directory with:
+    python -m app.services.expense_buckets <group_id>
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from app.database import db
+from app.config import EXPENSE_BUCKET_SIZE
+from app.services import expense_search
+from app.services.balance_table import BalanceTable, expense_shares
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+STORAGE_BUCKETED = "bucketed"
+
+# Groups only ever move to bucketed storage, so that answer is cached for good (bounded,
+# per worker). "Flat" is cached briefly and trusted by writes only: an expense written to
+# `db.expenses` during a migration is still read (and moved by a re-run), but a read that
+# missed the switch would see the group's expenses vanish as the migration moves them.
+STORAGE_MODE_CACHE_SECONDS = 60
+STORAGE_MODE_CACHE_MAX_GROUPS = 10000
+_bucketed_groups: "OrderedDict[str, None]" = OrderedDict()
+_flat_groups: "OrderedDict[str, float]" = OrderedDict()  # group id -> checked at
+_storage_lock = threading.Lock()
+
+
+def _remember(cache: OrderedDict, group_id: str, value) -> None:
+    cache[group_id] = value
+    cache.move_to_end(group_id)
+    while len(cache) > STORAGE_MODE_CACHE_MAX_GROUPS:
+        cache.popitem(last=False)
+
+
+def bucketed_group_ids(group_ids: List[str], for_write: bool = False) -> List[str]:
+    """
+    The groups among `group_ids` that use bucketed storage, looked up in one query.
+    Pass `for_write=True` to also trust recently cached flat answers.
+    """
+    now = time.monotonic()
+    with _storage_lock:
+        unknown = []
+        for group_id in group_ids:
+            if group_id in _bucketed_groups:
+                _bucketed_groups.move_to_end(group_id)
+                continue
+            checked_at = _flat_groups.get(group_id)
+            if not (for_write and checked_at is not None and now - checked_at < STORAGE_MODE_CACHE_SECONDS):
+                unknown.append(group_id)
+
+    if unknown:
+        bucketed = {
+            str(group["_id"])
+            for group in db.groups.find(
+                {"_id": {"$in": [ObjectId(group_id) for group_id in unknown]}, "expenseStorage": STORAGE_BUCKETED},
+                {"_id": 1}
+            )
+        }
+        with _storage_lock:
+            for group_id in unknown:
+                if group_id in bucketed:
+                    _flat_groups.pop(group_id, None)
+                    _remember(_bucketed_groups, group_id, None)
+                else:
+                    _remember(_flat_groups, group_id, now)
+
+    with _storage_lock:
+        return [group_id for group_id in group_ids if group_id in _bucketed_groups]
+
+
+def is_bucketed(group_id: str, for_write: bool = False) -> bool:
+    return bool(bucketed_group_ids([group_id], for_write))
+
+
+def is_bucketed_group(group: Dict) -> bool:
+    """
+    Whether an already loaded group document uses bucketed storage.
+    """
+    return group.get("expenseStorage") == STORAGE_BUCKETED
+
+
+def _period(date: Optional[datetime]) -> str:
+    return (date or datetime.utcnow()).strftime("%Y-%m")
+
+
+# Emails contain dots, which MongoDB treats as path separators in update operators
+def _delta_key(email: str) -> str:
+    return email.replace("%", "%25").replace(".", "%2E")
+
+
+def _delta_email(key: str) -> str:
+    return key.replace("%2E", ".").replace("%25", "%")
+
+
+def _increments(expense: Dict, sign: int = 1) -> Dict[str, float]:
+    """
+    Bucket counters changed by adding (sign=1) or removing (sign=-1) one expense.
+    """
+    if expense.get("currency"):
+        return {"count": sign, "pricedCount": sign}
+
+    increments = {"count": sign, "sharedTotal": 0.0}
+    amount = expense["amount"]
+
+    payer_key = "deltas." + _delta_key(expense["paidBy"])
+    increments[payer_key] = sign * amount
+
+    if expense.get("splitType", "equal") == "equal" and expense.get("splits") is None:
+        increments["sharedTotal"] = sign * amount
+    else:
+        for member, share in expense_shares(expense, []).items():
+            key = "deltas." + _delta_key(member)
+            increments[key] = increments.get(key, 0.0) - sign * share
+    return increments
+
+
+def _merge_increments(*parts: Dict[str, float]) -> Dict[str, float]:
+    merged: Dict[str, float] = {}
+    for part in parts:
+        for key, value in part.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _append_operation(expense: Dict) -> UpdateOne:
+    # Fills the month's open bucket, or starts a new one once it holds EXPENSE_BUCKET_SIZE
+    return UpdateOne(
+        {"groupId": expense["groupId"], "period": _period(expense.get("date")), "count": {"$lt": EXPENSE_BUCKET_SIZE}},
+        {
+            "$push": {"expenses": expense},
+            "$inc": _increments(expense),
+            "$min": {"minDate": expense.get("date")},
+            "$max": {"maxDate": expense.get("date")},
+            "$setOnInsert": {"createdAt": datetime.utcnow()}
+        },
+        upsert=True
+    )
+
+
+def append_expenses(expenses: List[Dict]) -> None:
+    """
+    Append expense documents (each with its own `_id`) to their groups' buckets.
+    """
+    if expenses:
+        db.expense_buckets.bulk_write([_append_operation(expense) for expense in expenses], ordered=True)
+
+
+def append_expense_once(expense: Dict) -> bool:
+    """
+    Append one expense and return whether it was added. Both writes are conditional on
+    the expense's `_id`, so concurrent calls for the same expense add it once: the month's
+    open bucket only takes it if it doesn't hold it yet, and a new bucket is only started
+    if no bucket of the month holds it. A copy in an already full bucket isn't seen by
+    the first write, so callers skip expenses they know to be bucketed.
+    """
+    period = _period(expense.get("date"))
+    result = db.expense_buckets.update_one(
+        {
+            "groupId": expense["groupId"],
+            "period": period,
+            "count": {"$lt": EXPENSE_BUCKET_SIZE},
+            "expenses._id": {"$ne": expense["_id"]}
+        },
+        {
+            "$push": {"expenses": expense},
+            "$inc": _increments(expense),
+            "$min": {"minDate": expense.get("date")},
+            "$max": {"maxDate": expense.get("date")}
+        }
+    )
+    if result.modified_count:
+        return True
+
+    result = db.expense_buckets.update_one(
+        {"groupId": expense["groupId"], "period": period, "expenses": {"$elemMatch": {"_id": expense["_id"]}}},
+        {"$setOnInsert": {
+            **_increments(expense),
+            "expenses": [expense],
+            "minDate": expense.get("date"),
+            "maxDate": expense.get("date"),
+            "createdAt": datetime.utcnow()
+        }},
+        upsert=True
+    )
+    return result.upserted_id is not None
+
+
+def find_expense(expense_id: ObjectId) -> Optional[Dict]:
+    bucket = db.expense_buckets.find_one({"expenses._id": expense_id}, {"expenses": {"$elemMatch": {"_id": expense_id}}})
+    return bucket["expenses"][0] if bucket else None
+
+
+def _find_copies(expense_id: ObjectId, group_ids: Optional[Iterable[str]] = None) -> List[Dict]:
+    # Normally one bucket; two if a move between buckets was interrupted (see update_expense)
+    query = {"expenses._id": expense_id}
+    if group_ids is not None:
+        query["groupId"] = {"$in": list(group_ids)}
+    return list(db.expense_buckets.find(
+        query,
+        {"groupId": 1, "period": 1, "expenses": {"$elemMatch": {"_id": expense_id}}}
+    ))
+
+
+def _pull_expense(bucket: Dict) -> bool:
+    expense = bucket["expenses"][0]
+    result = db.expense_buckets.update_one(
+        {"_id": bucket["_id"], "expenses._id": expense["_id"]},
+        {"$pull": {"expenses": {"_id": expense["_id"]}}, "$inc": _increments(expense, -1)}
+    )
+    return bool(result.modified_count)
+
+
+def remove_expense(expense_id: ObjectId, group_ids: Optional[Iterable[str]] = None) -> Optional[Dict]:
+    """
+    Remove an expense from its bucket and return it, or None if it isn't bucketed
+    (or, when `group_ids` is given, isn't in one of those groups).
+    """
+    removed = None
+    for bucket in _find_copies(expense_id, group_ids):
+        if _pull_expense(bucket):
+            removed = bucket["expenses"][0]
+    return removed
+
+
+def update_expense(
+    expense_id: ObjectId,
+    update_doc: Dict,
+    group_ids: Optional[Iterable[str]] = None
+) -> Optional[Dict]:
+    """
+    Apply `update_doc` to a bucketed expense and return the expense as it was before,
+    or None if it isn't bucketed (or isn't in one of `group_ids`). An expense whose month or group changes moves to the
+    matching bucket (or back to `db.expenses` if the new group isn't bucketed).
+
+    A move writes the new copy before removing the old one, so a failure in between
+    leaves the expense twice rather than not at all. Retrying the update finds the copy
+    already at its destination, updates that one and removes the other.
+    """
+    buckets = _find_copies(expense_id, group_ids)
+    if not buckets:
+        return None
+
+    def at_destination(bucket: Dict) -> bool:
+        updated = {**bucket["expenses"][0], **update_doc}
+        return updated["groupId"] == bucket["groupId"] and _period(updated.get("date")) == bucket["period"]
+
+    buckets.sort(key=lambda bucket: not at_destination(bucket))
+    bucket, leftovers = buckets[0], buckets[1:]
+    previous = bucket["expenses"][0]
+    updated = {**previous, **update_doc}
+
+    if at_destination(bucket):
+        result = db.expense_buckets.update_one(
+            {"_id": bucket["_id"], "expenses._id": expense_id},
+            {
+                "$set": {"expenses.$": updated},
+                "$inc": _merge_increments(_increments(previous, -1), _increments(updated)),
+                "$min": {"minDate": updated.get("date")},
+                "$max": {"maxDate": updated.get("date")}
+            }
+        )
+        if not result.modified_count:
+            return None
+    else:
+        if is_bucketed(updated["groupId"], for_write=True):
+            append_expenses([updated])
+        else:
+            db.expenses.replace_one({"_id": expense_id}, updated, upsert=True)
+        leftovers.append(bucket)
+
+    for leftover in leftovers:
+        _pull_expense(leftover)
+    return previous
+
+
+def iter_group_expense_docs(group_id: str) -> Iterator[Dict]:
+    """
+    Raw expense documents of a group, whichever layout it uses. Order is not guaranteed.
+    """
+    yield from db.expenses.find({"groupId": group_id})
+    if not is_bucketed(group_id):
+        return
+
+    for bucket in db.expense_buckets.find({"groupId": group_id}, {"expenses": 1}).sort("period", ASCENDING):
+        yield from bucket["expenses"]
+
+
+def iter_user_bucket_expenses(user_email: str) -> Iterator[Dict]:
+    """
+    Bucketed expenses paid by a user, across all groups.
+    """
+    pipeline = [
+        {"$match": {"expenses.paidBy": user_email}},
+        {"$unwind": "$expenses"},
+        {"$match": {"expenses.paidBy": user_email}},
+        {"$replaceRoot": {"newRoot": "$expenses"}}
+    ]
+    yield from db.expense_buckets.aggregate(pipeline)
+
+
+def search_bucket_expenses(
+    group_ids: List[str],
+    terms: List[str],
+    excluded: List[str],
+    filters: Dict,
+    limit: int,
+    max_time_ms: int
+) -> List[Dict]:
+    """
+    Search bucketed expenses of the given groups for `terms` (see `expense_search`), best
+    matches first and scored like flat expenses. The token indexes only find matching
+    *buckets*, so expenses are matched again after unwinding. `filters` apply to the
+    expense fields (date, amount, paidBy).
+    """
+    if not group_ids or not terms:
+        return []
+
+    pipeline = [
+        {"$match": {"groupId": {"$in": group_ids}, **expense_search.match_filter(terms, [], prefix="expenses.")}},
+        {"$unwind": "$expenses"},
+        {"$replaceRoot": {"newRoot": "$expenses"}},
+        {"$match": {**expense_search.match_filter(terms, excluded), **filters}},
+        *expense_search.ranking_stages(terms, 0, limit)
+    ]
+    return list(db.expense_buckets.aggregate(pipeline, maxTimeMS=max_time_ms))
+
+
+def load_bucket_balances(
+    group_id: str,
+    as_of: Optional[datetime],
+    table: BalanceTable,
+    encode: Callable[[Dict], None]
+) -> float:
+    """
+    Add the pre-aggregated deltas of every bucket that lies entirely on or before `as_of`
+    to `table`. Expenses that have to be replayed instead are passed to `encode`: those of
+    buckets that straddle `as_of`, and those with an explicit currency. Returns the total
+    of whole-group equal splits in the loaded buckets, to be divided among the current
+    members by the caller. `as_of` must be naive UTC.
+    """
+    shared_total = 0.0
+
+    complete_query = {"groupId": group_id}
+    if as_of is not None:
+        complete_query["maxDate"] = {"$lte": as_of}
+    priced_bucket_ids = []
+    for bucket in db.expense_buckets.find(complete_query, {"deltas": 1, "sharedTotal": 1, "pricedCount": 1}):
+        for key, amount in bucket.get("deltas", {}).items():
+            table.add(_delta_email(key), amount)
+        shared_total += bucket.get("sharedTotal", 0.0)
+        if bucket.get("pricedCount"):
+            priced_bucket_ids.append(bucket["_id"])
+
+    if priced_bucket_ids:
+        pipeline = [
+            {"$match": {"_id": {"$in": priced_bucket_ids}}},
+            {"$unwind": "$expenses"},
+            {"$match": {"expenses.currency": {"$ne": None}}},
+            {"$replaceRoot": {"newRoot": "$expenses"}}
+        ]
+        for expense in db.expense_buckets.aggregate(pipeline):
+            encode(expense)
+
+    if as_of is not None:
+        partial_query = {"groupId": group_id, "minDate": {"$lte": as_of}, "maxDate": {"$gt": as_of}}
+        for bucket in db.expense_buckets.find(partial_query, {"expenses": 1}):
+            for expense in bucket["expenses"]:
+                if expense.get("date") is not None and expense["date"] <= as_of:
+                    encode(expense)
+
+    return shared_total
+
+
+def migrate_group_to_buckets(group_id: str, batch_size: int = EXPENSE_BUCKET_SIZE) -> int:
+    """
+    Move a group's expenses from `db.expenses` into buckets and switch the group to
+    bucketed storage. Safe to re-run: it picks up anything still left in `db.expenses`.
+    Returns the number of expenses moved.
+    """
+    db.groups.update_one({"_id": ObjectId(group_id)}, {"$set": {"expenseStorage": STORAGE_BUCKETED}})
+    with _storage_lock:
+        _flat_groups.pop(group_id, None)
+
+    moved = 0
+    while True:
+        batch = list(db.expenses.find({"groupId": group_id}).sort("_id", ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        batch_ids = [expense["_id"] for expense in batch]
+        # Expenses already bucketed by an interrupted earlier run are only deleted
+        already_bucketed = {
+            expense["_id"]
+            for bucket in db.expense_buckets.find({"expenses._id": {"$in": batch_ids}}, {"expenses._id": 1})
+            for expense in bucket["expenses"]
+        }
+        append_expenses([expense for expense in batch if expense["_id"] not in already_bucketed])
+        db.expenses.delete_many({"_id": {"$in": batch_ids}})
+        moved += len(batch)
+    return moved
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m app.services.expense_buckets <group_id>")
+    print(f"Moved {migrate_group_to_buckets(sys.argv[1])} expense(s) into buckets")
@@ -0,0 +1,146 @@
+"""
+Search tokens for expenses, and the query stages both storage layouts use to find and rank them.
+
+Every expense stores the lowercased words of its description and category in
+`descriptionTokens` and `categoryTokens`. The indexes on (groupId, descriptionTokens) and
+(groupId, categoryTokens) keep a search inside the caller's groups, so its cost grows with
+the matching expenses of those groups rather than with every expense in the database (a
+text index can't be narrowed by groupId first unless a query names a single group).
+
+A hit scores DESCRIPTION_WEIGHT per query word in its description and 1 per word in its
+category. The score is computed in the database the same way for flat and bucketed
+expenses, so hits from both layouts rank on one scale (see `sort_key`).
+
+Expenses written before the tokens existed are tokenized from the backend directory with:
+    python -m app.services.expense_search
+"""
+import re
+from pymongo import UpdateOne
+from app.database import db
+from typing import Dict, List, Optional, Tuple
+
+DESCRIPTION_WEIGHT = 3
+TOKEN_FIELDS = ("descriptionTokens", "categoryTokens")
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    The distinct lowercased words of `text`.
+    """
+    return sorted(set(_WORD.findall((text or "").lower())))
+
+
+def token_fields(fields: Dict) -> Dict[str, List[str]]:
+    """
+    Tokens for whichever of `description` and `category` are in `fields`, e.g. a new
+    expense document or the `$set` of an update.
+    """
+    tokens = {}
+    if "description" in fields:
+        tokens["descriptionTokens"] = tokenize(fields["description"])
+    if "category" in fields:
+        tokens["categoryTokens"] = tokenize(fields["category"])
+    return tokens
+
+
+def parse_query(query: str) -> Tuple[List[str], List[str]]:
+    """
+    Words to match and words to exclude (written as `-word`).
+    """
+    terms, excluded = set(), set()
+    for word in query.split():
+        if word.startswith("-"):
+            excluded.update(tokenize(word))
+        else:
+            terms.update(tokenize(word))
+    return sorted(terms - excluded), sorted(excluded)
+
+
+def match_filter(terms: List[str], excluded: List[str], prefix: str = "") -> Dict:
+    """
+    Filter for expenses with any of `terms` and none of `excluded`. `prefix` is the path of
+    embedded expenses, e.g. "expenses." to match buckets.
+    """
+    query = {"$or": [{prefix + field: {"$in": terms}} for field in TOKEN_FIELDS]}
+    if excluded:
+        query["$nor"] = [{prefix + field: {"$in": excluded}} for field in TOKEN_FIELDS]
+    return query
+
+
+def _matched(field: str, terms: List[str]) -> Dict:
+    return {"$size": {"$filter": {
+        "input": {"$ifNull": ["$" + field, []]},
+        "as": "token",
+        "cond": {"$in": ["$$token", terms]}
+    }}}
+
+
+def ranking_stages(terms: List[str], skip: int, limit: int) -> List[Dict]:
+    """
+    Aggregation stages that score matched expenses and return `limit` of them after
+    skipping `skip`, best first (newest first on ties). Tokens are left out of the results.
+    """
+    stages = [
+        {"$addFields": {"score": {"$add": [
+            {"$multiply": [DESCRIPTION_WEIGHT, _matched("descriptionTokens", terms)]},
+            _matched("categoryTokens", terms)
+        ]}}},
+        {"$sort": {"score": -1, "date": -1, "_id": -1}}
+    ]
+    if skip:
+        stages.append({"$skip": skip})
+    stages.append({"$limit": limit})
+    stages.append({"$project": {field: 0 for field in TOKEN_FIELDS}})
+    return stages
+
+
+def sort_key(expense: Dict):
+    """
+    The order of `ranking_stages`, for merging hits from several sources (reverse=True).
+    """
+    return expense["score"], expense["date"], expense["_id"]
+
+
+def backfill_tokens(batch_size: int = 1000) -> int:
+    """
+    Add search tokens to expenses stored without them, flat and bucketed. An expense whose
+    description or category changed since it was read is left to the write that changed
+    it. Returns the number of expenses tokenized.
+    """
+    missing = {"descriptionTokens": {"$exists": False}}
+    tokenized = 0
+    operations = []
+    for expense in db.expenses.find(missing, {"description": 1, "category": 1}):
+        operations.append(UpdateOne(
+            {"_id": expense["_id"], "description": expense.get("description"), "category": expense.get("category")},
+            {"$set": token_fields({"description": expense.get("description"), "category": expense.get("category")})}
+        ))
+        if len(operations) >= batch_size:
+            tokenized += db.expenses.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        tokenized += db.expenses.bulk_write(operations, ordered=False).modified_count
+
+    for bucket in db.expense_buckets.find({"expenses": {"$elemMatch": missing}}, {"expenses": 1}):
+        operations = [
+            UpdateOne(
+                {"_id": bucket["_id"], "expenses": {"$elemMatch": {
+                    "_id": expense["_id"], "description": expense.get("description"), "category": expense.get("category")
+                }}},
+                {"$set": {
+                    f"expenses.$.{field}": tokens
+                    for field, tokens in token_fields({
+                        "description": expense.get("description"), "category": expense.get("category")
+                    }).items()
+                }}
+            )
+            for expense in bucket["expenses"] if "descriptionTokens" not in expense
+        ]
+        tokenized += db.expense_buckets.bulk_write(operations, ordered=False).modified_count
+    return tokenized
+
+
+if __name__ == "__main__":
+    print(f"Tokenized {backfill_tokens()} expense(s)")
@@ -1,10 +1,57 @@
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app.database import db
+from app.config import DEFAULT_CURRENCY
+from app.services.balance_service import invalidate_checkpoints, to_utc_naive
+from app.services.analytics_service import record_expense_change, participants
+from app.services import membership_cache, expense_buckets, expense_search, receipt_service
 from app.models.expenses import ExpenseCreate, ExpenseBase, ExpenseUpdate
-from typing import List
+from typing import Iterable, List, Optional, Dict
+
+SEARCH_MAX_PAGE_SIZE = 50
+# Ranking has to read every row before the page, so deep pages are refused
+SEARCH_MAX_PAGE = 20
+SEARCH_MAX_TIME_MS = 2000
+
+
+def _to_expense_base(expense: Dict) -> ExpenseBase:
+    return ExpenseBase(
+        id=str(expense["_id"]),
+        amount=expense["amount"],
+        description=expense.get("description"),
+        paidBy=expense["paidBy"],
+        groupId=expense["groupId"],
+        category=expense["category"],
+        splitType=expense["splitType"],
+        splits=expense.get("splits"),
+        date=expense["date"],
+        currency=expense.get("currency"),
+        createdAt=expense["createdAt"]
+    )
+
+def _get_group(group_id: str) -> Dict:
+    # What writing an expense needs to know about its group, in one read
+    return db.groups.find_one(
+        {"_id": ObjectId(group_id)},
+        {"members": 1, "baseCurrency": 1, "expenseStorage": 1}
+    ) or {}
+
+def _stored_currency(group: Dict, currency: Optional[str]) -> Optional[str]:
+    return None if currency == group.get("baseCurrency", DEFAULT_CURRENCY) else currency
+
+def stored_currency(group_id: str, currency: Optional[str]) -> Optional[str]:
+    """
+    The currency to store for an expense of the group: None for the group's base currency,
+    so only expenses that need converting are treated as priced.
+    """
+    if currency is None:
+        return None
+    return _stored_currency(_get_group(group_id), currency)
 
 def create_expense(payload: ExpenseCreate) -> ExpenseBase:
+    group = _get_group(payload.groupId)
+    currency = _stored_currency(group, payload.currency)
     expense_doc = {
         "amount": payload.amount,
         "description": payload.description,
@@ -13,15 +60,26 @@ def create_expense(payload: ExpenseCreate) -> ExpenseBase:
         "category": payload.category,
         "splitType": payload.splitType,
         "splits": payload.splits,
-        "date": payload.date,
+        "date": to_utc_naive(payload.date),
+        "currency": currency,
+        "participants": participants(payload.splitType, payload.splits, group),
         "createdAt": datetime.utcnow(),
         "updatedAt": datetime.utcnow()
     }
+    expense_doc.update(expense_search.token_fields(expense_doc))
 
-    result = db.expenses.insert_one(expense_doc)
+    if expense_buckets.is_bucketed_group(group):
+        expense_doc["_id"] = ObjectId()
+        expense_buckets.append_expenses([expense_doc])
+        expense_id = expense_doc["_id"]
+    else:
+        expense_id = db.expenses.insert_one(expense_doc).inserted_id
+    # A backdated expense changes every balance checkpoint at or after its date
+    invalidate_checkpoints(payload.groupId, since=payload.date)
+    record_expense_change(new_expense=expense_doc, groups=[group])
 
     return ExpenseBase(
-        id=str(result.inserted_id),
+        id=str(expense_id),
         amount=payload.amount,
         description=payload.description,
         paidBy=payload.paidBy,
@@ -30,68 +88,66 @@ def create_expense(payload: ExpenseCreate) -> ExpenseBase:
         splitType=payload.splitType,
         splits=payload.splits,
         date=payload.date,
+        currency=currency,
         createdAt=expense_doc["createdAt"]
     )
 
 def get_group_expenses(group_id: str) -> List[ExpenseBase]:
-    expenses_cursor = db.expenses.find({"groupId": group_id})
+    expenses_cursor = expense_buckets.iter_group_expense_docs(group_id)
     expenses = []
     for expense in expenses_cursor:
-        expenses.append(ExpenseBase(
-            id=str(expense["_id"]),
-            amount=expense["amount"],
-            description=expense.get("description"),
-            paidBy=expense["paidBy"],
-            groupId=expense["groupId"],
-            category=expense["category"],
-            splitType=expense["splitType"],
-            splits=expense.get("splits"),
-            date=expense["date"],
-            createdAt=expense["createdAt"]
-        ))
+        expenses.append(_to_expense_base(expense))
     return expenses
 
-def delete_expense(expense_id: str) -> bool:
-    result = db.expenses.delete_one({"_id": ObjectId(expense_id)})
-    return result.deleted_count > 0
+def _expense_query(expense_id: str, group_ids: Optional[Iterable[str]]) -> Dict:
+    # Scoping a write to the caller's groups makes it its own membership check
+    query = {"_id": ObjectId(expense_id)}
+    if group_ids is not None:
+        query["groupId"] = {"$in": list(group_ids)}
+    return query
+
+def delete_expense(expense_id: str, group_ids: Optional[Iterable[str]] = None) -> bool:
+    """
+    Delete an expense. With `group_ids`, only an expense in one of those groups is deleted.
+    """
+    deleted = db.expenses.find_one_and_delete(_expense_query(expense_id, group_ids))
+    if not deleted:
+        deleted = expense_buckets.remove_expense(ObjectId(expense_id), group_ids)
+    if not deleted:
+        return False
+
+    group = invalidate_checkpoints(deleted["groupId"], since=deleted.get("date"))
+    record_expense_change(old_expense=deleted, groups=[group])
+    receipt_service.delete_expense_receipts(expense_id)
+    return True
 
 def get_user_expenses(user_email: str) -> List[ExpenseBase]:
     expenses_cursor = db.expenses.find({"paidBy": user_email})
     expenses = []
     for expense in expenses_cursor:
-        expenses.append(ExpenseBase(
-            id=str(expense["_id"]),
-            amount=expense["amount"],
-            description=expense.get("description"),
-            paidBy=expense["paidBy"],
-            groupId=expense["groupId"],
-            category=expense["category"],
-            splitType=expense["splitType"],
-            splits=expense.get("splits"),
-            date=expense["date"],
-            createdAt=expense["createdAt"]
-        ))
+        expenses.append(_to_expense_base(expense))
+    for expense in expense_buckets.iter_user_bucket_expenses(user_email):
+        expenses.append(_to_expense_base(expense))
     return expenses
 
 def get_expense_by_id(expense_id: str) -> ExpenseBase:
     expense = db.expenses.find_one({"_id": ObjectId(expense_id)})
+    if not expense:
+        expense = expense_buckets.find_expense(ObjectId(expense_id))
     if not expense:
         return None
 
-    return ExpenseBase(
-        id=str(expense["_id"]),
-        amount=expense["amount"],
-        description=expense.get("description"),
-        paidBy=expense["paidBy"],
-        groupId=expense["groupId"],
-        category=expense["category"],
-        splitType=expense["splitType"],
-        splits=expense.get("splits"),
-        date=expense["date"],
-        createdAt=expense["createdAt"]
-    )
+    return _to_expense_base(expense)
 
-def update_expense(expense_id: str, payload: ExpenseUpdate) -> ExpenseBase:
+def update_expense(
+    expense_id: str,
+    payload: ExpenseUpdate,
+    group_ids: Optional[Iterable[str]] = None
+) -> ExpenseBase:
+    """
+    Apply the provided fields to an expense. With `group_ids`, only an expense in one of
+    those groups is updated. Returns None if there's no such expense or nothing to change.
+    """
     # Build update document with only the fields that are provided (non-None)
     update_doc = {}
     
@@ -110,7 +166,25 @@ def update_expense(expense_id: str, payload: ExpenseUpdate) -> ExpenseBase:
     if payload.splits is not None:
         update_doc["splits"] = payload.splits
     if payload.date is not None:
-        update_doc["date"] = payload.date
+        update_doc["date"] = to_utc_naive(payload.date)
+    group = {}
+    resplit = payload.groupId is not None or payload.splitType is not None or payload.splits is not None
+    if payload.currency is not None or resplit:
+        group_id = payload.groupId
+        if group_id is None:
+            expense = db.expenses.find_one(_expense_query(expense_id, group_ids), {"groupId": 1})
+            if not expense:
+                expense = expense_buckets.find_expense(ObjectId(expense_id))
+                if not expense or (group_ids is not None and expense["groupId"] not in group_ids):
+                    return None
+            group_id = expense["groupId"]
+        group = _get_group(group_id)
+        if payload.currency is not None:
+            # None means "unchanged" here, so the base currency is how a currency is cleared
+            update_doc["currency"] = _stored_currency(group, payload.currency)
+        if resplit:
+            # Recorded with the current members, like a new expense (see analytics_service)
+            update_doc["participants"] = list(group.get("members", []))
     
     # Always update the updatedAt timestamp
     update_doc["updatedAt"] = datetime.utcnow()
@@ -118,13 +192,105 @@ def update_expense(expense_id: str, payload: ExpenseUpdate) -> ExpenseBase:
     # If no fields to update, return None
     if len(update_doc) == 1:  # Only updatedAt
         return None
+    update_doc.update(expense_search.token_fields(update_doc))
 
-    result = db.expenses.update_one(
-        {"_id": ObjectId(expense_id)},
-        {"$set": update_doc}
+    previous = db.expenses.find_one_and_update(
+        _expense_query(expense_id, group_ids),
+        {"$set": update_doc},
+        return_document=ReturnDocument.BEFORE
     )
+    if not previous:
+        previous = expense_buckets.update_expense(ObjectId(expense_id), update_doc, group_ids)
 
-    if result.modified_count == 0:
+    if not previous:
         return None
 
-    return get_expense_by_id(expense_id)
\ No newline at end of file
+    # Checkpoints from the earlier of the old and new dates onwards may include this expense
+    since = previous.get("date")
+    new_date = update_doc.get("date")
+    if new_date is not None and (since is None or new_date < since):
+        since = new_date
+    groups = [group, invalidate_checkpoints(previous["groupId"], since=since)]
+    if payload.groupId is not None and payload.groupId != previous["groupId"]:
+        groups.append(invalidate_checkpoints(payload.groupId, since=since))
+        receipt_service.move_expense_receipts(expense_id, payload.groupId)
+    # The update is a plain $set, so applying it to the previous document yields the stored
+    # one without reading it back. The previous version is needed for rollups and checkpoints.
+    updated = {**previous, **update_doc}
+    record_expense_change(old_expense=previous, new_expense=updated, groups=groups)
+
+    return _to_expense_base(updated)
+
+def search_expenses(
+    user_email: str,
+    query: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    paid_by: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20
+) -> Dict:
+    """
+    Word search over description and category, limited to the user's groups.
+    Results are ranked by relevance (newest first on ties; see `expense_search`). Uses the
+    group-scoped token indexes, fetches one extra row to report `hasMore` instead of
+    counting all matches, and is capped by SEARCH_MAX_TIME_MS on the server. Hits from
+    groups with bucketed storage are scored the same way and merged in.
+    """
+    page_size = min(page_size, SEARCH_MAX_PAGE_SIZE)
+    group_ids = list(membership_cache.get_user_group_ids(user_email))
+    terms, excluded = expense_search.parse_query(query)
+    if not group_ids or not terms:
+        return {"items": [], "page": page, "pageSize": page_size, "hasMore": False}
+
+    filters = {}
+    date_filter = {}
+    if start_date is not None:
+        date_filter["$gte"] = start_date
+    if end_date is not None:
+        date_filter["$lte"] = end_date
+    if date_filter:
+        filters["date"] = date_filter
+
+    amount_filter = {}
+    if min_amount is not None:
+        amount_filter["$gte"] = min_amount
+    if max_amount is not None:
+        amount_filter["$lte"] = max_amount
+    if amount_filter:
+        filters["amount"] = amount_filter
+
+    if paid_by:
+        filters["paidBy"] = paid_by
+
+    skip = (page - 1) * page_size
+    bucketed_ids = expense_buckets.bucketed_group_ids(group_ids)
+    if bucketed_ids:
+        # Both sources are ranked separately, so each must supply every row up to this page
+        skip, limit = 0, page * page_size + 1
+    else:
+        limit = page_size + 1
+
+    search_query = {"groupId": {"$in": group_ids}, **expense_search.match_filter(terms, excluded), **filters}
+    pipeline = [{"$match": search_query}, *expense_search.ranking_stages(terms, skip, limit)]
+    hits = list(db.expenses.aggregate(pipeline, maxTimeMS=SEARCH_MAX_TIME_MS))
+
+    if bucketed_ids:
+        hits.extend(expense_buckets.search_bucket_expenses(
+            bucketed_ids, terms, excluded, filters, limit, SEARCH_MAX_TIME_MS
+        ))
+        hits.sort(key=expense_search.sort_key, reverse=True)
+        hits = hits[(page - 1) * page_size:]
+
+    items = []
+    for expense in hits[:page_size + 1]:
+        items.append({**_to_expense_base(expense).model_dump(), "score": expense["score"]})
+
+    return {
+        "items": items[:page_size],
+        "page": page,
+        "pageSize": page_size,
+        "hasMore": len(items) > page_size
+    }
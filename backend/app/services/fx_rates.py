@@ -0,0 +1,264 @@
+"""
+Exchange rates for multi-currency groups.
+
+`db.fx_rates` holds one document per currency and day: {currency, date, rate}, where `rate`
+is the value of one unit of `currency` in FX_REFERENCE_CURRENCY (whose own rate is always 1).
+An amount is converted with the latest rate on or before its date, or the earliest known
+rate for dates before the series starts.
+
+Rates are served from an in-memory table that keeps each currency's series as two sorted
+arrays (days and rates), evicts the least recently used currencies beyond
+FX_CACHE_MAX_CURRENCIES and reloads a series after FX_CACHE_TTL_SECONDS.
+
+Every load of rates bumps a version counter kept in `db.fx_rates` under the _id
+RATES_VERSION_ID. Each worker re-reads it at most every FX_VERSION_CHECK_SECONDS and drops
+its cached series when it changed. Balance checkpoints that depend on rates are stamped
+with the version they were computed with, and only those of the current version are used.
+
+Load a CSV file with `date,currency,rate` rows (e.g. `2024-03-01,EUR,1.0843`) from the
+backend directory with:
+    python -m app.services.fx_rates <rates.csv>
+Running servers pick the new rates up within FX_VERSION_CHECK_SECONDS.
+"""
+import csv
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from pymongo import UpdateOne
+from app.database import db
+from app.config import (
+    FX_REFERENCE_CURRENCY,
+    FX_CACHE_MAX_CURRENCIES,
+    FX_CACHE_TTL_SECONDS,
+    FX_VERSION_CHECK_SECONDS
+)
+from app.services.balance_table import ExpenseColumns, scale_expenses
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LOAD_BATCH_SIZE = 1000
+RATES_VERSION_ID = "ratesVersion"
+
+
+class MissingExchangeRate(Exception):
+    """
+    Raised when an amount has to be converted from or to a currency without any rates.
+    Mapped to 422 in main.py.
+    """
+    def __init__(self, currency: str):
+        super().__init__(currency)
+        self.currency = currency
+
+
+class RateSeries:
+    """
+    One currency's rates as parallel arrays of day ordinals and rates, sorted by day.
+    """
+    __slots__ = ("days", "rates", "version", "loaded_at")
+
+    def __init__(self, points: Iterable[Tuple[datetime, float]], version: int = 0):
+        self.days = array("l")
+        self.rates = array("d")
+        for date, rate in points:
+            self.days.append(date.toordinal())
+            self.rates.append(rate)
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def rate_on(self, day: int) -> float:
+        index = bisect_right(self.days, day) - 1
+        return self.rates[max(index, 0)]
+
+
+def _load_series(currency: str) -> List[Tuple[datetime, float]]:
+    cursor = db.fx_rates.find({"currency": currency}, {"_id": 0, "date": 1, "rate": 1}).sort("date", 1)
+    return [(doc["date"], doc["rate"]) for doc in cursor]
+
+
+def _load_version() -> int:
+    doc = db.fx_rates.find_one({"_id": RATES_VERSION_ID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+
+class FxRateTable:
+    """
+    Date-indexed exchange rates with LRU eviction over currencies. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], List[Tuple[datetime, float]]] = _load_series,
+        max_currencies: int = FX_CACHE_MAX_CURRENCIES,
+        ttl_seconds: float = FX_CACHE_TTL_SECONDS,
+        reference_currency: str = FX_REFERENCE_CURRENCY,
+        load_version: Callable[[], int] = _load_version,
+        version_check_seconds: float = FX_VERSION_CHECK_SECONDS
+    ):
+        self._load = load
+        self._max_currencies = max_currencies
+        self._ttl_seconds = ttl_seconds
+        self._reference_currency = reference_currency
+        self._load_version = load_version
+        self._version_check_seconds = version_check_seconds
+        self._version = 0
+        self._version_checked_at = float("-inf")
+        self._series: "OrderedDict[str, RateSeries]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        """
+        The version of the rates this table serves, re-read at most every
+        `version_check_seconds`. Cached series of an older version are dropped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._version_checked_at < self._version_check_seconds:
+                return self._version
+        version = self._load_version()
+        with self._lock:
+            if version != self._version:
+                self._series.clear()
+                self._version = version
+            self._version_checked_at = now
+        return version
+
+    def _get_series(self, currency: str) -> Optional[RateSeries]:
+        """
+        The series for `currency`, or None for the reference currency.
+        """
+        if currency == self._reference_currency:
+            return None
+        version = self.version()
+        with self._lock:
+            series = self._series.get(currency)
+            if series and series.version == version and time.monotonic() - series.loaded_at < self._ttl_seconds:
+                self._series.move_to_end(currency)
+                return series
+
+        points = self._load(currency)
+        if not points:
+            raise MissingExchangeRate(currency)
+        series = RateSeries(points, version)
+        with self._lock:
+            self._series[currency] = series
+            self._series.move_to_end(currency)
+            while len(self._series) > self._max_currencies:
+                self._series.popitem(last=False)
+        return series
+
+    def is_known(self, currency: str) -> bool:
+        try:
+            self._get_series(currency)
+        except MissingExchangeRate:
+            return False
+        return True
+
+    def factors(self, currency: str, target: str, dates: Sequence[datetime]) -> array:
+        """
+        Conversion factors from `currency` to `target` for each of `dates`, with both
+        series looked up once for the whole batch.
+        """
+        source_series = self._get_series(currency)
+        target_series = self._get_series(target)
+        factors = array("d")
+        for date in dates:
+            day = date.toordinal()
+            source_rate = source_series.rate_on(day) if source_series else 1.0
+            target_rate = target_series.rate_on(day) if target_series else 1.0
+            factors.append(source_rate / target_rate)
+        return factors
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._series.clear()
+            self._version_checked_at = float("-inf")
+
+
+rate_table = FxRateTable()
+
+
+def is_known_currency(currency: str) -> bool:
+    return rate_table.is_known(currency)
+
+
+def convert_columns(
+    columns: ExpenseColumns,
+    priced: List[Tuple[int, str, datetime]],
+    target: str,
+    table: FxRateTable = rate_table
+) -> None:
+    """
+    Convert encoded expenses to `target` in place. `priced` lists (expense index, currency,
+    date) for every expense not already in `target`; they are converted one currency at a
+    time, so a whole group costs one series lookup per currency.
+    """
+    by_currency: Dict[str, List[Tuple[int, datetime]]] = defaultdict(list)
+    for index, currency, date in priced:
+        by_currency[currency].append((index, date))
+
+    for currency, entries in by_currency.items():
+        factors = table.factors(currency, target, [date for _, date in entries])
+        scale_expenses(columns, [index for index, _ in entries], factors)
+
+
+def to_currency(expense: Dict, target: str) -> Dict:
+    """
+    A copy of an expense document with its amount (and exact split amounts) in `target`.
+    """
+    currency = expense.get("currency")
+    if not currency or currency == target:
+        return expense
+
+    factor = rate_table.factors(currency, target, [expense.get("date") or datetime.utcnow()])[0]
+    converted = {**expense, "amount": expense["amount"] * factor}
+    if expense.get("splitType") == "unequal" and expense.get("splits"):
+        converted["splits"] = {member: value * factor for member, value in expense["splits"].items()}
+    return converted
+
+
+def load_rates_file(path: str) -> int:
+    """
+    Upsert the rates of a `date,currency,rate` CSV file and bump the rates version.
+    Returns the number of rows loaded. Balance checkpoints computed with rates are dropped
+    whatever their date, since expenses dated before a currency's first rate use that rate.
+    """
+    operations = []
+    loaded = 0
+    with open(path, newline="") as rates_file:
+        for row in csv.reader(rates_file):
+            if not row or row[0].strip().lower() == "date":
+                continue
+            date = datetime.strptime(row[0].strip(), "%Y-%m-%d")
+            currency = row[1].strip().upper()
+            operations.append(UpdateOne(
+                {"currency": currency, "date": date},
+                {"$set": {"rate": float(row[2])}},
+                upsert=True
+            ))
+            if len(operations) == LOAD_BATCH_SIZE:
+                db.fx_rates.bulk_write(operations, ordered=False)
+                loaded += len(operations)
+                operations = []
+    if operations:
+        db.fx_rates.bulk_write(operations, ordered=False)
+        loaded += len(operations)
+
+    if loaded:
+        db.fx_rates.update_one(
+            {"_id": RATES_VERSION_ID},
+            {"$inc": {"version": 1}, "$set": {"updatedAt": datetime.utcnow()}},
+            upsert=True
+        )
+        # Checkpoints of older versions are ignored anyway; this only frees their space
+        db.balance_checkpoints.delete_many({"ratesVersion": {"$exists": True}})
+    rate_table.invalidate()
+    return loaded
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m app.services.fx_rates <rates.csv>")
+    print(f"Loaded {load_rates_file(sys.argv[1])} rate(s)")
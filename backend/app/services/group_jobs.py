@@ -0,0 +1,371 @@
+"""
+Background jobs that delete or archive a group together with everything that belongs to it.
+
+Starting a job detaches the group from its members straight away (they are kept in
+`formerMembers`), so it disappears from their group lists and membership checks. A worker
+thread then removes the group's documents collection by collection in batches of
+GROUP_JOB_BATCH_SIZE, pausing between batches so a large group never turns into one long
+`delete_many` on the primary. Archiving copies recurring templates, receipts, expenses,
+buckets, settlements and the group itself into `archived_<collection>` before deleting
+them; derived data (thumbnails, checkpoints, rollups) is only deleted.
+
+Jobs live in `db.group_jobs` and record the current step and per-collection progress after
+every batch. Every batch is safe to repeat, so a job interrupted by a restart or crash is
+resumed by whichever worker next claims it once its lease has expired.
+
+A job that fails for good (MAX_ATTEMPTS errors) gives the group back to its members, with
+whatever the job had not removed yet, so the creator can see it and start a new job.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+from app.database import db
+from app.config import (
+    EXPENSE_BUCKET_SIZE,
+    GROUP_JOB_BATCH_SIZE,
+    GROUP_JOB_BATCH_PAUSE_SECONDS,
+    GROUP_JOB_LEASE_SECONDS,
+    MEMBERSHIP_CACHE_TTL_SECONDS,
+    RECEIPT_CHUNK_SIZE,
+    RECEIPT_MAX_BYTES
+)
+from app.services import membership_cache, receipt_service
+from app.services.analytics_service import rebuild_group_rollups
+from app.services.balance_service import invalidate_checkpoints
+from typing import Dict, List, Optional
+
+ACTION_DELETE = "delete"
+ACTION_ARCHIVE = "archive"
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+# (collection, copied when archiving) in processing order. The group document goes last,
+# so a partly processed group can still be found and its job resumed.
+STEPS = [
+    ("recurring_expenses", True),
+    ("receipt_thumbnails", False),
+    (receipt_service.BUCKET_NAME, True),
+    ("expenses", True),
+    ("expense_buckets", True),
+    ("settlements", True),
+    ("balance_checkpoints", False),
+    ("expense_rollups", False),
+    ("groups", True)
+]
+ARCHIVE_PREFIX = "archived_"
+
+# A bucket holds up to EXPENSE_BUCKET_SIZE expenses and a receipt up to this many chunks,
+# so fewer of them fit in a batch
+RECEIPT_MAX_CHUNKS = RECEIPT_MAX_BYTES // RECEIPT_CHUNK_SIZE + 1
+BATCH_SIZES = {
+    "expense_buckets": max(1, GROUP_JOB_BATCH_SIZE // EXPENSE_BUCKET_SIZE),
+    receipt_service.BUCKET_NAME: max(1, GROUP_JOB_BATCH_SIZE // RECEIPT_MAX_CHUNKS)
+}
+
+MAX_ATTEMPTS = 5
+POLL_SECONDS = 5
+
+WORKER_ID = uuid.uuid4().hex
+_stop = threading.Event()
+_wake = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _to_job_response(job: Dict) -> Dict:
+    step_index = job["stepIndex"]
+    return {
+        "id": str(job["_id"]),
+        "groupId": job["groupId"],
+        "action": job["action"],
+        "status": job["status"],
+        "step": STEPS[step_index][0] if step_index < len(STEPS) else None,
+        "progress": job.get("progress", {}),
+        "error": job.get("error"),
+        "createdAt": job["createdAt"],
+        "updatedAt": job["updatedAt"],
+        "finishedAt": job.get("finishedAt")
+    }
+
+
+def _detach_group(job: Dict) -> Optional[Dict]:
+    """
+    Mark the group as being removed by `job` and move its members aside.
+    Repeating it for the same job is a no-op; returns None if the group can't be claimed.
+    """
+    return db.groups.find_one_and_update(
+        {
+            "_id": ObjectId(job["groupId"]),
+            "createdBy": job["requestedBy"],
+            "$or": [{"removalJobId": {"$exists": False}}, {"removalJobId": job["_id"]}]
+        },
+        [{"$set": {
+            "formerMembers": {"$ifNull": ["$formerMembers", "$members"]},
+            "members": {"$literal": []},
+            "removalJobId": job["_id"],
+            "updatedAt": job["createdAt"]
+        }}],
+        projection={"formerMembers": 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _restore_group(job: Dict) -> None:
+    """
+    Give a group held by a failed job back to its members. Expenses the job removed are
+    gone, so the group's checkpoints are dropped and its rollups rebuilt.
+    """
+    held = {"_id": ObjectId(job["groupId"]), "removalJobId": job["_id"]}
+    # The members are only moved aside while the job holds the group, so this read is current
+    group = db.groups.find_one(held, {"formerMembers": 1})
+    if not group:
+        return  # held by another job, or already removed
+
+    members = group.get("formerMembers", [])
+    group = db.groups.find_one_and_update(
+        held,
+        {
+            "$set": {"members": members, "updatedAt": datetime.utcnow()},
+            "$unset": {"formerMembers": "", "removalJobId": ""},
+            "$inc": {"checkpointEpoch": 1}
+        },
+        projection={"lastCheckpointAt": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not group:
+        return
+
+    invalidate_checkpoints(job["groupId"], group=group)
+    rebuild_group_rollups(job["groupId"])
+    membership_cache.invalidate(*members)
+
+
+def _fail_job(job: Dict, update: Dict) -> bool:
+    """
+    Mark a job as failed with `update`, after giving its group back.
+    """
+    _restore_group(job)
+    update.setdefault("$set", {}).update({
+        "status": STATUS_FAILED,
+        "finishedAt": datetime.utcnow(),
+        "leaseUntil": None
+    })
+    return _update_job(job, update)
+
+
+def start_group_job(group_id: str, action: str, requested_by: str) -> Optional[Dict]:
+    """
+    Queue a job that deletes or archives a group. Only the group's creator can do this.
+    Returns the job, or None if the group doesn't exist, wasn't created by `requested_by`
+    or is already being removed.
+    """
+    now = datetime.utcnow()
+    job = {
+        "_id": ObjectId(),
+        "groupId": group_id,
+        "action": action,
+        "requestedBy": requested_by,
+        "status": STATUS_PENDING,
+        "stepIndex": 0,
+        "progress": {},
+        "attempts": 0,
+        # Other workers may still treat the members as such until their cached
+        # memberships expire, so removal waits until no new expenses can arrive
+        "notBefore": now + timedelta(seconds=MEMBERSHIP_CACHE_TTL_SECONDS),
+        "leaseUntil": None,
+        "createdAt": now,
+        "updatedAt": now
+    }
+    # The job is stored first: if the process dies before the group is detached, the
+    # job still runs and detaches it itself
+    db.group_jobs.insert_one(job)
+
+    group = _detach_group(job)
+    if not group:
+        db.group_jobs.delete_one({"_id": job["_id"]})
+        return None
+
+    membership_cache.invalidate(*group.get("formerMembers", []))
+    _wake.set()
+    return _to_job_response(job)
+
+
+def get_group_job(job_id: str, requested_by: str) -> Optional[Dict]:
+    job = db.group_jobs.find_one({"_id": ObjectId(job_id), "requestedBy": requested_by})
+    return _to_job_response(job) if job else None
+
+
+def _claim_job() -> Optional[Dict]:
+    now = datetime.utcnow()
+    return db.group_jobs.find_one_and_update(
+        {
+            "status": {"$in": [STATUS_PENDING, STATUS_RUNNING]},
+            "notBefore": {"$lte": now},
+            "$or": [{"leaseUntil": None}, {"leaseUntil": {"$lt": now}}]
+        },
+        {"$set": {
+            "status": STATUS_RUNNING,
+            "worker": WORKER_ID,
+            "leaseUntil": now + timedelta(seconds=GROUP_JOB_LEASE_SECONDS),
+            "updatedAt": now
+        }},
+        sort=[("createdAt", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _update_job(job: Dict, update: Dict) -> bool:
+    """
+    Update a job this worker holds, renewing its lease. Returns False if the lease was lost.
+    """
+    now = datetime.utcnow()
+    update.setdefault("$set", {}).update({
+        "leaseUntil": now + timedelta(seconds=GROUP_JOB_LEASE_SECONDS),
+        "updatedAt": now
+    })
+    result = db.group_jobs.update_one({"_id": job["_id"], "worker": WORKER_ID}, update)
+    return result.matched_count > 0
+
+
+def _archive(collection: str, docs: List[Dict]) -> None:
+    try:
+        db[ARCHIVE_PREFIX + collection].insert_many(docs, ordered=False)
+    except BulkWriteError as exc:
+        # Copies left by an interrupted batch are already archived
+        if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+            raise
+
+
+def _remove_receipt_batch(job: Dict, copy: bool) -> int:
+    """
+    Delete (after archiving, if requested) one batch of the group's receipt files together
+    with their GridFS chunks. Returns the number of files removed.
+    """
+    files = f"{receipt_service.BUCKET_NAME}.files"
+    chunks = f"{receipt_service.BUCKET_NAME}.chunks"
+    batch_size = BATCH_SIZES[receipt_service.BUCKET_NAME]
+    docs = list(db[files].find({"metadata.groupId": job["groupId"]}).limit(batch_size))
+    if not docs:
+        return 0
+
+    file_ids = [doc["_id"] for doc in docs]
+    if copy:
+        _archive(files, docs)
+        # Chunks are copied on the server, so a batch never loads file contents
+        db[chunks].aggregate([
+            {"$match": {"files_id": {"$in": file_ids}}},
+            {"$merge": {"into": ARCHIVE_PREFIX + chunks, "whenMatched": "keepExisting"}}
+        ])
+    # Chunks first: a file whose chunks are gone is still found by a retried batch
+    db[chunks].delete_many({"files_id": {"$in": file_ids}})
+    db[files].delete_many({"_id": {"$in": file_ids}})
+    return len(docs)
+
+
+def _remove_batch(job: Dict, collection: str, archived: bool) -> int:
+    """
+    Delete (after archiving, if requested) one batch of the group's documents in
+    `collection`. Returns the number of documents removed.
+    """
+    copy = archived and job["action"] == ACTION_ARCHIVE
+    if collection == receipt_service.BUCKET_NAME:
+        return _remove_receipt_batch(job, copy)
+
+    if collection == "groups":
+        query = {"_id": ObjectId(job["groupId"])}
+    else:
+        query = {"groupId": job["groupId"]}
+
+    batch_size = BATCH_SIZES.get(collection, GROUP_JOB_BATCH_SIZE)
+    docs = list(db[collection].find(query, None if copy else {"_id": 1}).limit(batch_size))
+    if not docs:
+        return 0
+
+    if copy:
+        _archive(collection, docs)
+    db[collection].delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+    return len(docs)
+
+
+def _run_job(job: Dict) -> None:
+    try:
+        if not _detach_group(job) and db.groups.find_one({"_id": ObjectId(job["groupId"])}, {"_id": 1}):
+            _fail_job(job, {"$set": {"error": "The group is not removable by this job"}})
+            return
+
+        step_index = job["stepIndex"]
+        while step_index < len(STEPS):
+            if _stop.is_set():
+                # Let the next worker (or this one after a restart) pick it up right away
+                db.group_jobs.update_one({"_id": job["_id"], "worker": WORKER_ID}, {"$set": {"leaseUntil": None}})
+                return
+
+            collection, archived = STEPS[step_index]
+            started = time.monotonic()
+            removed = _remove_batch(job, collection, archived)
+            if removed:
+                update = {"$inc": {f"progress.{collection}": removed}}
+            else:
+                step_index += 1
+                update = {"$set": {"stepIndex": step_index}}
+            if not _update_job(job, update):
+                return  # lease expired and another worker took over
+
+            if removed:
+                # Sleep at least as long as the batch took, so the job never uses more than
+                # about half of the database time it competes for
+                _stop.wait(max(GROUP_JOB_BATCH_PAUSE_SECONDS, time.monotonic() - started))
+
+        _update_job(job, {"$set": {
+            "status": STATUS_COMPLETED,
+            "finishedAt": datetime.utcnow(),
+            "leaseUntil": None
+        }})
+    except Exception as exc:
+        attempts = job.get("attempts", 0) + 1
+        update = {"$set": {"attempts": attempts, "error": str(exc)}}
+        if attempts >= MAX_ATTEMPTS:
+            _fail_job(job, update)
+        else:
+            # The renewed lease delays the retry by GROUP_JOB_LEASE_SECONDS
+            _update_job(job, update)
+
+
+def _worker_loop() -> None:
+    while not _stop.is_set():
+        try:
+            job = _claim_job()
+            if job is not None:
+                _run_job(job)
+                continue
+        except Exception:
+            pass  # database unavailable: try again after the poll interval
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+
+
+def start_worker() -> None:
+    """
+    Start this process's job worker thread. Unfinished jobs from earlier runs are resumed.
+    """
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _stop.clear()
+        _thread = threading.Thread(target=_worker_loop, name="group-jobs", daemon=True)
+        _thread.start()
+
+
+def stop_worker() -> None:
+    """
+    Stop the worker thread after its current batch.
+    """
+    _stop.set()
+    _wake.set()
+    if _thread is not None:
+        _thread.join(timeout=GROUP_JOB_LEASE_SECONDS)
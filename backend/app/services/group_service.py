@@ -1,90 +1,135 @@
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app.database import db
+from app.config import DEFAULT_CURRENCY
 from app.models.group import GroupCreate, GroupBase
 from app.models.user import UserBase
-from typing import List, Dict, Any
+from app.services.balance_service import invalidate_checkpoints
+from app.services import membership_cache
+from typing import List, Dict, Any, Optional
 
-def _get_member_details(member_emails: List[str]) -> List[Dict[str, Any]]:
+def _get_member_names(member_emails: List[str]) -> Dict[str, str]:
+    """Fetch user names for a list of emails in a single query"""
+    if not member_emails:
+        return {}
+    users = db.users.find({"email": {"$in": list(set(member_emails))}}, {"_id": 0, "email": 1, "name": 1})
+    return {user["email"]: user["name"] for user in users if user.get("name")}
+
+def _get_member_details(member_emails: List[str], names: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
     """Fetch user details (name and email) for a list of emails"""
-    members_data = []
-    for email in member_emails:
-        user = db.users.find_one({"email": email})
-        if user:
-            members_data.append({
-                "name": user.get("name", email.split("@")[0]),
-                "email": email
-            })
-        else:
-            # Fallback if user not found
-            members_data.append({
-                "name": email.split("@")[0],
-                "email": email
-            })
-    return members_data
+    if names is None:
+        names = _get_member_names(member_emails)
+    # Fallback to the email's local part if user not found
+    return [{"name": names.get(email, email.split("@")[0]), "email": email} for email in member_emails]
 
-def create_group(payload: GroupCreate) -> GroupBase:
+def create_group(payload: GroupCreate, known_names: Optional[Dict[str, str]] = None) -> GroupBase:
+    """
+    Create a group. Member names already known to the caller (e.g. the creator's) are
+    passed in `known_names` so only the remaining members are looked up.
+    """
     group_doc = {
         "name": payload.name,
         "description": payload.description,
         "members": payload.members,
+        "baseCurrency": payload.baseCurrency or DEFAULT_CURRENCY,
         "createdBy": payload.createdBy,
         "createdAt": datetime.utcnow(),
         "updatedAt": datetime.utcnow()
     }
 
     result = db.groups.insert_one(group_doc)
+    membership_cache.invalidate(*payload.members)
     
-    # Fetch member details with names
-    members_data = _get_member_details(payload.members)
+    names = dict(known_names or {})
+    unknown = [email for email in payload.members if email not in names]
+    if unknown:
+        names.update(_get_member_names(unknown))
+    members_data = _get_member_details(payload.members, names)
 
     return GroupBase(
         id=str(result.inserted_id),
         name=payload.name,
         description=payload.description,
         members=members_data,
+        baseCurrency=group_doc["baseCurrency"],
         createdBy=payload.createdBy,
         createdAt=group_doc["createdAt"]
     )
 
 def get_user_groups(user_email: str) -> List[GroupBase]:
-    groups_cursor = db.groups.find({"members": user_email})
+    group_docs = list(db.groups.find({"members": user_email}))
+    # One user lookup for the members of all groups
+    names = _get_member_names([email for group in group_docs for email in group["members"]])
     groups = []
-    for group in groups_cursor:
-        # Fetch member details with names
-        members_data = _get_member_details(group["members"])
+    for group in group_docs:
+        members_data = _get_member_details(group["members"], names)
         
         groups.append(GroupBase(
             id=str(group["_id"]),
             name=group["name"],
             description=group.get("description"),
             members=members_data,
+            baseCurrency=group.get("baseCurrency", DEFAULT_CURRENCY),
             createdBy=group["createdBy"],
             createdAt=group["createdAt"]
         ))
     return groups
 
-def add_member_to_group(group_id: str, member_email: str) -> bool:
-    result = db.groups.update_one(
-        {"_id": ObjectId(group_id)},
-        {"$addToSet": {"members": member_email}, "$set": {"updatedAt": datetime.utcnow()}}
+def _update_members(group_filter: Dict[str, Any], update: Dict[str, Any], changed_emails: List[str]) -> Optional[List[str]]:
+    """
+    Apply a membership update and return the new member list, or None if nothing changed.
+    `group_filter` only matches when the update would change the group, so one
+    find_one_and_update both checks and writes.
+    """
+    update.setdefault("$set", {})["updatedAt"] = datetime.utcnow()
+    # Bumps the checkpoint epoch in the same write (see invalidate_checkpoints)
+    update["$inc"] = {"checkpointEpoch": 1}
+    group = db.groups.find_one_and_update(
+        group_filter,
+        update,
+        projection={"members": 1, "lastCheckpointAt": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not group:
+        return None
+
+    invalidate_checkpoints(str(group_filter["_id"]), group=group)
+    membership_cache.invalidate(*changed_emails)
+    return group["members"]
+
+def add_member_to_group(group_id: str, member_email: str) -> Optional[List[str]]:
+    """
+    Add a member to a group. Returns the updated member list, or None if the group
+    doesn't exist or already has the member.
+    """
+    return _update_members(
+        {"_id": ObjectId(group_id), "members": {"$ne": member_email}},
+        {"$push": {"members": member_email}},
+        [member_email]
     )
-    return result.modified_count > 0
 
-def add_multiple_members_to_group(group_id: str, member_emails: List[str]) -> bool:
+def add_multiple_members_to_group(group_id: str, member_emails: List[str]) -> Optional[List[str]]:
     """
     Add multiple members to a group at once.
+    Returns the updated member list, or None if all of them were already members.
     """
-    result = db.groups.update_one(
-        {"_id": ObjectId(group_id)},
-        {"$addToSet": {"members": {"$each": member_emails}}, "$set": {"updatedAt": datetime.utcnow()}}
+    return _update_members(
+        {"_id": ObjectId(group_id), "members": {"$not": {"$all": member_emails}}},
+        {"$addToSet": {"members": {"$each": member_emails}}},
+        member_emails
     )
-    return result.modified_count > 0
 
-def remove_member_from_group(group_id: str, member_email: str) -> bool:
-    result = db.groups.update_one(
-        {"_id": ObjectId(group_id)},
-        {"$pull": {"members": member_email}, "$set": {"updatedAt": datetime.utcnow()}}
+def remove_member_from_group(group_id: str, member_email: str) -> Optional[List[str]]:
+    """
+    Remove a member from a group. Returns the updated member list, or None if the
+    group doesn't exist or the email isn't a member.
+    """
+    return _update_members(
+        {"_id": ObjectId(group_id), "members": member_email},
+        {"$pull": {"members": member_email}},
+        [member_email]
     )
-    return result.modified_count > 0
 
+def is_group_creator(group_id: str, user_email: str) -> bool:
+    return ObjectId.is_valid(group_id) and db.groups.count_documents({"_id": ObjectId(group_id), "createdBy": user_email}, limit=1) > 0
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from app.database import db
+from app.config import (
+    MEMBERSHIP_CACHE_TTL_SECONDS,
+    MEMBERSHIP_CACHE_NEGATIVE_TTL_SECONDS,
+    MEMBERSHIP_CACHE_MAX_USERS
+)
+from typing import FrozenSet, Optional, Tuple
+
+# email -> (loaded at, group ids), least recently used first
+_cache: "OrderedDict[str, Tuple[float, FrozenSet[str]]]" = OrderedDict()
+_lock = threading.Lock()
+# Bumped by every invalidate(); users are recorded with the generation that last
+# invalidated them, so a load that overlapped an invalidation isn't cached
+_generation = 0
+_invalidated: "OrderedDict[str, int]" = OrderedDict()
+_forgotten_generation = 0  # newest generation trimmed from _invalidated
+
+
+def _load(user_email: str) -> FrozenSet[str]:
+    with _lock:
+        started = _generation
+    group_ids = frozenset(
+        str(group["_id"]) for group in db.groups.find({"members": user_email}, {"_id": 1})
+    )
+    with _lock:
+        if _invalidated.get(user_email, _forgotten_generation) > started:
+            # Invalidated while reading: the result may predate the change
+            return group_ids
+        _cache[user_email] = (time.monotonic(), group_ids)
+        _cache.move_to_end(user_email)
+        while len(_cache) > MEMBERSHIP_CACHE_MAX_USERS:
+            _cache.popitem(last=False)
+    return group_ids
+
+
+def _cached(user_email: str, max_age: float = MEMBERSHIP_CACHE_TTL_SECONDS) -> Optional[FrozenSet[str]]:
+    with _lock:
+        entry = _cache.get(user_email)
+        if entry and time.monotonic() - entry[0] < min(max_age, MEMBERSHIP_CACHE_TTL_SECONDS):
+            _cache.move_to_end(user_email)
+            return entry[1]
+    return None
+
+
+def get_user_group_ids(user_email: str) -> FrozenSet[str]:
+    """
+    Ids of the groups a user belongs to, served from the per-worker cache when fresh.
+    """
+    group_ids = _cached(user_email)
+    return group_ids if group_ids is not None else _load(user_email)
+
+
+def is_member(user_email: str, group_id: str) -> bool:
+    """
+    Whether the user belongs to the group. A cache hit costs no database round trip.
+    A negative answer is only trusted for MEMBERSHIP_CACHE_NEGATIVE_TTL_SECONDS, then
+    re-checked against the database, so a user added through another worker isn't locked
+    out until the entry expires, and repeated requests for another group's data don't each
+    cost a read.
+    """
+    group_ids = _cached(user_email)
+    if group_ids is not None and group_id in group_ids:
+        return True
+    if group_ids is not None and _cached(user_email, MEMBERSHIP_CACHE_NEGATIVE_TTL_SECONDS) is not None:
+        return False
+    return group_id in _load(user_email)
+
+
+def invalidate(*user_emails: str) -> None:
+    """
+    Forget cached memberships, e.g. after users are added to or removed from a group.
+    """
+    global _generation, _forgotten_generation
+    with _lock:
+        _generation += 1
+        for user_email in user_emails:
+            _cache.pop(user_email, None)
+            _invalidated[user_email] = _generation
+            _invalidated.move_to_end(user_email)
+        while len(_invalidated) > MEMBERSHIP_CACHE_MAX_USERS:
+            _forgotten_generation = _invalidated.popitem(last=False)[1]
@@ -0,0 +1,290 @@
+"""
+Opt-in request profiling for finding out why an endpoint is slow in production.
+
+A request is profiled when the X-Profile header carries PROFILE_HEADER_TOKEN, or at random
+for a PROFILE_SAMPLE_RATE fraction of requests (adjustable per worker through the admin
+endpoints). While it runs, a sampler thread records the stack of every thread executing
+the request's endpoint each PROFILE_INTERVAL_SECONDS, and the database round trips made by
+the request are counted.
+
+Every profile is written to PROFILE_DIR as `<id>.folded` (one `frame;frame;... count` line
+per distinct stack, the input of flamegraph.pl, speedscope and similar tools) next to
+`<id>.json` with its metadata: route, status, duration, number of samples, database round
+trips and, for group routes, the group's size. Only the newest PROFILE_MAX_FILES profiles
+are kept.
+
+Routers opt in with `APIRouter(..., route_class=ProfiledRoute)`.
+"""
+import asyncio
+import functools
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from app.database import db, count_commands
+from app.config import (
+    PROFILE_SAMPLE_RATE,
+    PROFILE_HEADER_TOKEN,
+    PROFILE_INTERVAL_SECONDS,
+    PROFILE_DIR,
+    PROFILE_MAX_FILES
+)
+from typing import Callable, Dict, Iterator, List, Optional
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_PATTERN = re.compile(r"^\d{13}-[0-9a-f]{8}$")
+
+_sample_rate = PROFILE_SAMPLE_RATE
+_active: ContextVar[Optional["RequestProfile"]] = ContextVar("active_profile", default=None)
+
+
+def get_sample_rate() -> float:
+    return _sample_rate
+
+
+def set_sample_rate(rate: float) -> None:
+    """
+    Change the fraction of requests profiled by this worker until it restarts.
+    """
+    global _sample_rate
+    _sample_rate = rate
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class RequestProfile:
+    """
+    Stack samples of the threads running one request's endpoint.
+    """
+
+    def __init__(self, method: str, route: str):
+        self.id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.route = route
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._threads: Dict[int, int] = {}  # thread ident -> nesting depth
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+        self._started = 0.0
+        self.duration = 0.0
+
+    @contextmanager
+    def attached(self) -> Iterator[None]:
+        """
+        Sample the calling thread for the duration of the block.
+        """
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def _sample_loop(self) -> None:
+        while not self._done.wait(PROFILE_INTERVAL_SECONDS):
+            with self._lock:
+                idents = list(self._threads)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[_fold(frame)] += 1
+                    self.samples += 1
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self.duration = time.perf_counter() - self._started
+        self._done.set()
+        self._sampler.join()
+
+
+def _group_size(group_id: Optional[str]) -> Optional[int]:
+    if not group_id:
+        return None
+    try:
+        group = db.groups.find_one({"_id": ObjectId(group_id)}, {"members": 1})
+    except InvalidId:
+        return None
+    return len(group.get("members", [])) if group else None
+
+
+def _trim_profiles() -> None:
+    names = sorted(name[:-len(".json")] for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for profile_id in names[:max(0, len(names) - PROFILE_MAX_FILES)]:
+        for suffix in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + suffix))
+            except FileNotFoundError:
+                pass  # trimmed concurrently by another worker
+
+
+def _save_profile(profile: RequestProfile, path: str, group_id: Optional[str], status_code: int, round_trips: int) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile.id)
+    with open(base + ".folded", "w") as folded:
+        for stack, count in profile.stacks.most_common():
+            folded.write(f"{stack} {count}\n")
+
+    summary = {
+        "id": profile.id,
+        "method": profile.method,
+        "route": profile.route,
+        "path": path,
+        "statusCode": status_code,
+        "durationMs": round(profile.duration * 1000, 2),
+        "samples": profile.samples,
+        "dbRoundTrips": round_trips,
+        "groupId": group_id,
+        "groupSize": _group_size(group_id),
+        "createdAt": datetime.utcnow().isoformat()
+    }
+    # The metadata is written last, so listed profiles always have their stacks
+    with open(base + ".json", "w") as metadata:
+        json.dump(summary, metadata)
+    _trim_profiles()
+
+
+def list_profiles(limit: int) -> List[Dict]:
+    """
+    Metadata of the newest `limit` stored profiles, newest first.
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith(".json")), reverse=True)
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as metadata:
+                profiles.append(json.load(metadata))
+        except (FileNotFoundError, ValueError):
+            continue  # trimmed or still being written
+    return profiles
+
+
+def read_folded_stacks(profile_id: str) -> Optional[str]:
+    """
+    The folded stacks of a stored profile, or None if there is no such profile.
+    """
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, profile_id + ".folded")) as folded:
+            return folded.read()
+    except FileNotFoundError:
+        return None
+
+
+def _should_profile(request: Request) -> bool:
+    token = request.headers.get(PROFILE_HEADER)
+    if token and PROFILE_HEADER_TOKEN and hmac.compare_digest(token, PROFILE_HEADER_TOKEN):
+        return True
+    return _sample_rate > 0 and random.random() < _sample_rate
+
+
+def _attach_to_profile(endpoint: Callable) -> Callable:
+    """
+    Wrap an endpoint so the thread running it is sampled while its request is profiled.
+    Sync endpoints run in the threadpool, which copies the request's context.
+    """
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def profiled_async_endpoint(*args, **kwargs):
+            profile = _active.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            with profile.attached():
+                return await endpoint(*args, **kwargs)
+        return profiled_async_endpoint
+
+    @functools.wraps(endpoint)
+    def profiled_endpoint(*args, **kwargs):
+        profile = _active.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        with profile.attached():
+            return endpoint(*args, **kwargs)
+    return profiled_endpoint
+
+
+class ProfiledRoute(APIRoute):
+    """
+    An APIRoute whose requests can be profiled. Requests made inside a profiled request
+    (e.g. the sub-requests of POST /batch) are recorded in the outer profile.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _attach_to_profile(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        route = self.path_format
+
+        async def profiled_handler(request: Request):
+            if _active.get() is not None or not _should_profile(request):
+                return await handler(request)
+
+            profile = RequestProfile(request.method, route)
+            token = _active.set(profile)
+            status_code = 500
+            profile.start()
+            try:
+                with count_commands() as round_trips:
+                    response = await handler(request)
+                status_code = response.status_code
+                return response
+            except HTTPException as exc:
+                status_code = exc.status_code
+                raise
+            except RequestValidationError:
+                status_code = 422
+                raise
+            finally:
+                profile.stop()
+                _active.reset(token)
+                try:
+                    await run_in_threadpool(
+                        _save_profile,
+                        profile,
+                        request.url.path,
+                        request.path_params.get("group_id"),
+                        status_code,
+                        round_trips[0]
+                    )
+                except OSError:
+                    pass  # a full or unwritable profile directory must not fail the request
+
+        return profiled_handler
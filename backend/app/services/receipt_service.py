@@ -0,0 +1,251 @@
+"""
+Receipt attachments for expenses, stored in GridFS.
+
+Uploads are streamed into the `receipts` GridFS bucket in RECEIPT_CHUNK_SIZE chunks and
+downloads are read back the same way, so a worker holds about one chunk per transfer
+whatever the file size. Each file's metadata records its expense and group; an expense
+keeps only its latest receipt.
+
+Thumbnails are made on first request with Pillow (optional; without it thumbnails are
+unavailable) and cached in `db.receipt_thumbnails` under the receipt's file id. At most
+RECEIPT_THUMBNAIL_CONCURRENCY are generated at once per worker, and images larger than
+RECEIPT_THUMBNAIL_MAX_PIXELS are refused, which bounds the memory decoding takes.
+"""
+import io
+import threading
+from datetime import datetime
+from bson import Binary, ObjectId
+from gridfs import GridFSBucket
+from app.database import db
+from app.config import (
+    RECEIPT_CHUNK_SIZE,
+    RECEIPT_MAX_BYTES,
+    RECEIPT_THUMBNAIL_SIZE,
+    RECEIPT_THUMBNAIL_MAX_PIXELS,
+    RECEIPT_THUMBNAIL_CONCURRENCY
+)
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    from PIL import Image, UnidentifiedImageError
+except ImportError:  # Pillow is optional; only thumbnails need it
+    Image = None
+
+BUCKET_NAME = "receipts"
+ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "application/pdf"}
+THUMBNAIL_CONTENT_TYPE = "image/jpeg"
+
+_bucket = GridFSBucket(db, bucket_name=BUCKET_NAME, chunk_size_bytes=RECEIPT_CHUNK_SIZE)
+_files = db[BUCKET_NAME + ".files"]
+_chunks = db[BUCKET_NAME + ".chunks"]
+_thumbnail_slots = threading.BoundedSemaphore(RECEIPT_THUMBNAIL_CONCURRENCY)
+
+
+class ReceiptTooLarge(Exception):
+    """Raised when an upload exceeds RECEIPT_MAX_BYTES. Mapped to 413 by the router."""
+
+
+class ReceiptReplaced(Exception):
+    """Raised when a newer upload replaced this one before it finished. Mapped to 409 by the router."""
+
+
+class ThumbnailUnavailable(Exception):
+    """Raised when a receipt can't be thumbnailed (not a supported or sane image)."""
+
+
+class ThumbnailFailed(Exception):
+    """Raised when an image receipt turns out to be corrupt while it is decoded. Mapped to 422."""
+
+
+def _to_receipt_info(receipt: Dict) -> Dict:
+    metadata = receipt["metadata"]
+    return {
+        "id": str(receipt["_id"]),
+        "expenseId": metadata["expenseId"],
+        "contentType": metadata["contentType"],
+        "size": receipt["length"],
+        "uploadedBy": metadata["uploadedBy"],
+        "uploadedAt": receipt["uploadDate"]
+    }
+
+
+class ReceiptUpload:
+    """
+    Streams one receipt into GridFS. GridFS writes every full chunk as it fills up, so
+    only the current chunk is held in memory. Call `complete()` at the end of the body,
+    or `abort()` to drop what was written.
+    """
+
+    def __init__(self, expense_id: str, group_id: str, content_type: str, uploaded_by: str):
+        self.expense_id = expense_id
+        self.size = 0
+        self._stream = _bucket.open_upload_stream(
+            expense_id,
+            metadata={
+                "expenseId": expense_id,
+                "groupId": group_id,
+                "contentType": content_type,
+                "uploadedBy": uploaded_by
+            }
+        )
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > RECEIPT_MAX_BYTES:
+            raise ReceiptTooLarge()
+        self._stream.write(data)
+
+    def complete(self) -> Dict:
+        """
+        Finish the upload and drop every receipt of the expense but the newest. Concurrent
+        uploads all keep the same one, so they can't delete each other's files.
+        Returns this upload's receipt, or raises ReceiptReplaced if a newer one was kept.
+        """
+        self._stream.close()
+        receipts = list(_files.find({"metadata.expenseId": self.expense_id}).sort([("uploadDate", -1), ("_id", -1)]))
+        _delete_files([receipt["_id"] for receipt in receipts[1:]])
+        if receipts[0]["_id"] != self._stream._id:
+            raise ReceiptReplaced()
+        return _to_receipt_info(receipts[0])
+
+    def abort(self) -> None:
+        self._stream.abort()
+
+
+def get_receipt(expense_id: str) -> Optional[Dict]:
+    """
+    The GridFS file document of an expense's receipt, or None.
+    """
+    return _files.find_one({"metadata.expenseId": expense_id}, sort=[("uploadDate", -1), ("_id", -1)])
+
+
+def get_receipt_info(expense_id: str) -> Optional[Dict]:
+    receipt = get_receipt(expense_id)
+    return _to_receipt_info(receipt) if receipt else None
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The inclusive byte range requested by a `Range: bytes=...` header, or None to send the
+    whole file (no header, or one this endpoint ignores: malformed or multiple ranges).
+    Raises ValueError if the range lies outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, separator, end_text = header[len("bytes="):].strip().partition("-")
+    if not separator or not (start_text or end_text):
+        return None
+    if not all(text.isdigit() for text in (start_text, end_text) if text):
+        return None
+
+    if not start_text:
+        # Suffix range: the last N bytes
+        length = int(end_text)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if end_text and end < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def iter_receipt(receipt: Dict, start: int, end: int) -> Iterator[bytes]:
+    """
+    Yield bytes `start` to `end` (inclusive) of a receipt, one chunk at a time.
+    """
+    stream = _bucket.open_download_stream(receipt["_id"])
+    try:
+        stream.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = stream.read(min(RECEIPT_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        stream.close()
+
+
+def thumbnails_supported() -> bool:
+    return Image is not None
+
+
+def _make_thumbnail(receipt: Dict) -> bytes:
+    with _thumbnail_slots, _bucket.open_download_stream(receipt["_id"]) as source:
+        try:
+            image = Image.open(source)  # reads the header only
+        except UnidentifiedImageError:
+            raise ThumbnailUnavailable("The receipt is not an image") from None
+        except Image.DecompressionBombError:
+            raise ThumbnailUnavailable("The receipt image is too large for a thumbnail") from None
+        if image.width * image.height > RECEIPT_THUMBNAIL_MAX_PIXELS:
+            raise ThumbnailUnavailable("The receipt image is too large for a thumbnail")
+        try:
+            # JPEGs are decoded at the smallest scale that still covers the thumbnail
+            image.draft("RGB", (RECEIPT_THUMBNAIL_SIZE, RECEIPT_THUMBNAIL_SIZE))
+            image.thumbnail((RECEIPT_THUMBNAIL_SIZE, RECEIPT_THUMBNAIL_SIZE))
+            output = io.BytesIO()
+            image.convert("RGB").save(output, "JPEG", quality=80)
+        except (OSError, Image.DecompressionBombError):
+            # Truncated or corrupt image data, found only once it is decoded
+            raise ThumbnailFailed("The receipt image can't be read") from None
+    return output.getvalue()
+
+
+def get_thumbnail(receipt: Dict) -> bytes:
+    """
+    A JPEG thumbnail of an image receipt, generated on first use and cached.
+    Raises ThumbnailUnavailable for receipts that aren't images and ThumbnailFailed for
+    corrupt ones.
+    """
+    cached = db.receipt_thumbnails.find_one({"_id": receipt["_id"]}, {"data": 1})
+    if cached:
+        return bytes(cached["data"])
+    if not receipt["metadata"]["contentType"].startswith("image/"):
+        raise ThumbnailUnavailable("The receipt is not an image")
+
+    data = _make_thumbnail(receipt)
+    db.receipt_thumbnails.update_one(
+        {"_id": receipt["_id"]},
+        {"$setOnInsert": {
+            "groupId": receipt["metadata"]["groupId"],
+            "data": Binary(data),
+            "createdAt": datetime.utcnow()
+        }},
+        upsert=True
+    )
+    return data
+
+
+def _delete_files(file_ids: List[ObjectId]) -> None:
+    if not file_ids:
+        return
+    # Chunks first: an interrupted delete leaves a file document that is found again
+    _chunks.delete_many({"files_id": {"$in": file_ids}})
+    _files.delete_many({"_id": {"$in": file_ids}})
+    db.receipt_thumbnails.delete_many({"_id": {"$in": file_ids}})
+
+
+def delete_expense_receipts(expense_id: str) -> bool:
+    """
+    Delete an expense's receipt. Returns False if it had none.
+    """
+    file_ids = [receipt["_id"] for receipt in _files.find({"metadata.expenseId": expense_id}, {"_id": 1})]
+    _delete_files(file_ids)
+    return bool(file_ids)
+
+
+def move_expense_receipts(expense_id: str, group_id: str) -> None:
+    """
+    Record that an expense moved to another group, so the group's removal finds its receipt.
+    """
+    result = _files.update_many({"metadata.expenseId": expense_id}, {"$set": {"metadata.groupId": group_id}})
+    if result.matched_count:
+        file_ids = [receipt["_id"] for receipt in _files.find({"metadata.expenseId": expense_id}, {"_id": 1})]
+        db.receipt_thumbnails.update_many({"_id": {"$in": file_ids}}, {"$set": {"groupId": group_id}})
@@ -0,0 +1,257 @@
+"""
+Recurring expense templates and the in-process scheduler that materializes them.
+
+A template in `db.recurring_expenses` holds the fields of an expense plus a cron schedule
+(see `app.services.cron`, UTC). `nextRunAt` is the next occurrence still to be created and
+`materializedThrough` the last one created: the per-template high-water mark.
+
+Every worker runs a scheduler thread. It claims due templates with a short lease, creates
+all occurrences up to now with one `insert_many` per RECURRING_BATCH_SIZE occurrences, and
+then advances the high-water mark. Each occurrence gets an `_id` derived from the template
+and occurrence time, so an occurrence inserted before a crash (but not yet recorded in the
+high-water mark) is skipped as a duplicate when the batch is retried. After downtime the
+missed occurrences are created in the same batched way, dated when they were due.
+"""
+import hashlib
+import threading
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+from app.database import db
+from app.config import RECURRING_BATCH_SIZE, RECURRING_POLL_SECONDS
+from app.models.recurring import RecurringExpenseCreate, RecurringExpenseBase
+from app.services import expense_buckets, expense_search
+from app.services.analytics_service import participants, record_expenses_created
+from app.services.balance_service import invalidate_checkpoints, to_utc_naive
+from app.services.cron import CronSchedule
+from app.services.expense_service import stored_currency
+from typing import Dict, List, Optional
+
+LEASE_SECONDS = 60
+
+WORKER_ID = uuid.uuid4().hex
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _to_template_base(template: Dict) -> RecurringExpenseBase:
+    return RecurringExpenseBase(
+        id=str(template["_id"]),
+        amount=template["amount"],
+        description=template.get("description"),
+        paidBy=template["paidBy"],
+        groupId=template["groupId"],
+        category=template["category"],
+        splitType=template["splitType"],
+        splits=template.get("splits"),
+        currency=template.get("currency"),
+        schedule=template["schedule"],
+        startAt=template["startAt"],
+        endAt=template.get("endAt"),
+        nextRunAt=template.get("nextRunAt"),
+        materializedThrough=template.get("materializedThrough"),
+        createdBy=template["createdBy"],
+        createdAt=template["createdAt"]
+    )
+
+
+def create_template(payload: RecurringExpenseCreate, created_by: str) -> RecurringExpenseBase:
+    start_at = to_utc_naive(payload.startAt)
+    end_at = to_utc_naive(payload.endAt)
+    next_run_at = CronSchedule(payload.schedule).first_at_or_after(start_at)
+    if next_run_at is not None and end_at is not None and next_run_at > end_at:
+        next_run_at = None
+
+    template = {
+        "amount": payload.amount,
+        "description": payload.description,
+        "paidBy": payload.paidBy,
+        "groupId": payload.groupId,
+        "category": payload.category,
+        "splitType": payload.splitType,
+        "splits": payload.splits,
+        "currency": stored_currency(payload.groupId, payload.currency),
+        "schedule": payload.schedule,
+        "startAt": start_at,
+        "endAt": end_at,
+        "nextRunAt": next_run_at,
+        "materializedThrough": None,
+        "lockedUntil": None,
+        "createdBy": created_by,
+        "createdAt": datetime.utcnow(),
+        "updatedAt": datetime.utcnow()
+    }
+    template["_id"] = db.recurring_expenses.insert_one(template).inserted_id
+    return _to_template_base(template)
+
+
+def get_group_templates(group_id: str) -> List[RecurringExpenseBase]:
+    return [_to_template_base(template) for template in db.recurring_expenses.find({"groupId": group_id})]
+
+
+def get_template(template_id: str) -> Optional[Dict]:
+    return db.recurring_expenses.find_one({"_id": ObjectId(template_id)})
+
+
+def delete_template(template_id: str) -> bool:
+    """
+    Stop a template. Expenses it already created are kept.
+    """
+    result = db.recurring_expenses.delete_one({"_id": ObjectId(template_id)})
+    return result.deleted_count > 0
+
+
+def _occurrence_id(template_id: ObjectId, occurrence: datetime) -> ObjectId:
+    # Deterministic, so re-inserting the same occurrence is a duplicate key
+    key = f"{template_id}:{occurrence.isoformat()}".encode()
+    return ObjectId(hashlib.sha1(key).digest()[:12])
+
+
+def _insert_occurrences(group_id: str, expenses: List[Dict]) -> List[Dict]:
+    """
+    Insert materialized expenses, skipping any that already exist. Returns the new ones.
+    Bucketed groups take one conditional append per occurrence, so a worker whose lease
+    ran out can't add an occurrence a second time alongside the one that took it over.
+    """
+    if expense_buckets.is_bucketed(group_id, for_write=True):
+        # Occurrences from an interrupted earlier batch, possibly in an already full bucket
+        existing = {
+            expense["_id"]
+            for bucket in db.expense_buckets.find(
+                {"expenses._id": {"$in": [expense["_id"] for expense in expenses]}},
+                {"expenses._id": 1}
+            )
+            for expense in bucket["expenses"]
+        }
+        return [
+            expense for expense in expenses
+            if expense["_id"] not in existing and expense_buckets.append_expense_once(expense)
+        ]
+
+    try:
+        db.expenses.insert_many(expenses, ordered=False)
+    except BulkWriteError as exc:
+        errors = exc.details["writeErrors"]
+        if any(error["code"] != 11000 for error in errors):
+            raise
+        duplicates = {error["index"] for error in errors}
+        return [expense for index, expense in enumerate(expenses) if index not in duplicates]
+    return expenses
+
+
+def _materialize(template: Dict, now: datetime) -> None:
+    """
+    Create up to RECURRING_BATCH_SIZE due occurrences of a claimed template and advance
+    its high-water mark.
+    """
+    group_id = template["groupId"]
+    group = db.groups.find_one({"_id": ObjectId(group_id)}, {"removalJobId": 1, "members": 1, "baseCurrency": 1})
+    if not group:
+        db.recurring_expenses.update_one({"_id": template["_id"]}, {"$set": {"nextRunAt": None, "lockedUntil": None}})
+        return
+    if "removalJobId" in group:
+        # The removal also removes the template, unless it fails and gives the group back;
+        # the lease is kept, so it is looked at again once that runs out
+        return
+
+    schedule = CronSchedule(template["schedule"])
+    until = now if template.get("endAt") is None else min(now, template["endAt"])
+    occurrences = []
+    next_run_at = template["nextRunAt"]
+    while next_run_at is not None and next_run_at <= until and len(occurrences) < RECURRING_BATCH_SIZE:
+        occurrences.append(next_run_at)
+        next_run_at = schedule.next_after(next_run_at)
+    if next_run_at is not None and template.get("endAt") is not None and next_run_at > template["endAt"]:
+        next_run_at = None
+
+    expenses = [
+        {
+            "_id": _occurrence_id(template["_id"], occurrence),
+            "amount": template["amount"],
+            "description": template.get("description"),
+            "paidBy": template["paidBy"],
+            "groupId": group_id,
+            "category": template["category"],
+            "splitType": template["splitType"],
+            "splits": template.get("splits"),
+            "currency": template.get("currency"),
+            "participants": participants(template["splitType"], template.get("splits"), group),
+            "date": occurrence,
+            "recurringId": str(template["_id"]),
+            **expense_search.token_fields(template),
+            "createdAt": now,
+            "updatedAt": now
+        }
+        for occurrence in occurrences
+    ]
+    if expenses:
+        created = _insert_occurrences(group_id, expenses)
+        if created:
+            invalidate_checkpoints(group_id, since=occurrences[0])
+            record_expenses_created(created, groups=[group])
+
+    db.recurring_expenses.update_one(
+        {"_id": template["_id"], "lockedBy": WORKER_ID},
+        {"$set": {
+            "materializedThrough": occurrences[-1] if occurrences else template.get("materializedThrough"),
+            "nextRunAt": next_run_at,
+            "lockedUntil": None,
+            "updatedAt": now
+        }}
+    )
+
+
+def _claim_due_template(now: datetime) -> Optional[Dict]:
+    return db.recurring_expenses.find_one_and_update(
+        {
+            "nextRunAt": {"$lte": now},
+            "$or": [{"lockedUntil": None}, {"lockedUntil": {"$lt": now}}]
+        },
+        {"$set": {"lockedBy": WORKER_ID, "lockedUntil": now + timedelta(seconds=LEASE_SECONDS)}},
+        sort=[("nextRunAt", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def run_due_templates() -> int:
+    """
+    Materialize everything that is due. Returns the number of template batches processed.
+    """
+    processed = 0
+    while not _stop.is_set():
+        now = datetime.utcnow()
+        template = _claim_due_template(now)
+        if template is None:
+            break
+        _materialize(template, now)
+        processed += 1
+    return processed
+
+
+def _scheduler_loop() -> None:
+    while not _stop.is_set():
+        try:
+            run_due_templates()
+        except Exception:
+            pass  # retried on the next tick; a claimed template's lease expires
+        _stop.wait(RECURRING_POLL_SECONDS)
+
+
+def start_scheduler() -> None:
+    """
+    Start this process's scheduler thread. Occurrences missed while no worker was
+    running are created on its first tick.
+    """
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _stop.clear()
+        _thread = threading.Thread(target=_scheduler_loop, name="recurring-expenses", daemon=True)
+        _thread.start()
+
+
+def stop_scheduler() -> None:
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=LEASE_SECONDS)
@@ -1,10 +1,10 @@
 from datetime import datetime
-from bson import ObjectId
 from app.database import db
-from typing import List, Dict
+from app.services.balance_service import get_group_balance_table
+from typing import List, Dict, Optional
 
 
-def settle_group_expenses(group_id: str) -> List[Dict]:
+def settle_group_expenses(group_id: str, as_of: Optional[datetime] = None) -> List[Dict]:
     """
     Compute minimal settlement transactions for a given group.
     Each expense has fields: amount, paidBy, splitType, splits
@@ -18,100 +18,28 @@ def settle_group_expenses(group_id: str) -> List[Dict]:
     
     For percentage split:
     - splits = {email: percentage, email: percentage, ...}: each member owes the specified percentage
-    """
-
-    group = db.groups.find_one({"_id": ObjectId(group_id)})
-    all_group_members = group.get("members", []) if group else []
-
-    expenses_cursor = db.expenses.find({"groupId": group_id})
-    balances = {}
-
-    # STEP 1️⃣ — Calculate net balance for each member
-    for expense in expenses_cursor:
-        paid_by = expense["paidBy"]
-        amount = expense["amount"]
-        split_type = expense.get("splitType", "equal")
-        splits = expense.get("splits")  # can be None or dict
-        
-        # 1. CREDIT the payer with the full amount
-        balances[paid_by] = balances.get(paid_by, 0.0) + amount
-
-        # 2. DEBIT participants for their share
-        if split_type == "equal":
-            if splits is None:
-                # No splits provided = divide equally among ALL group members
-                if all_group_members: 
-                    split_amount = amount / len(all_group_members)
-                    for member in all_group_members:
-                        balances[member] = balances.get(member, 0.0) - split_amount
-            else:
-                # Splits provided with value 1 = divide equally among ONLY participating members
-                participating_members = list(splits.keys())
-                if participating_members:
-                    split_amount = amount / len(participating_members)
-                    for member in participating_members:
-                        balances[member] = balances.get(member, 0.0) - split_amount
-                    
-        elif split_type == "unequal" and splits:
-            # Subtract each member's exact amount
-            for member, split_amount in splits.items():
-                balances[member] = balances.get(member, 0.0) - split_amount
-        
-        elif split_type == "percentage" and splits:
-            # Subtract each member's percentage share
-            for member, percentage in splits.items():
-                split_amount = (amount * percentage) / 100
-                balances[member] = balances.get(member, 0.0) - split_amount
-        else:
-            # Invalid split configuration - skip this expense
-            continue
-
-    # STEP 2️⃣ — Separate creditors and debtors
-    debtors = []  # users who owe money (negative balance)
-    creditors = [] # users who should receive money (positive balance)
 
-    for user, balance in balances.items():
-        if abs(balance) < 1e-6:  # ignore near-zero balances
-            continue
-        if balance < 0:
-            debtors.append({"user": user, "amount": -balance})
-        else:
-            creditors.append({"user": user, "amount": balance})
+    When `as_of` is given, only expenses dated on or before it are considered.
+    """
 
-    # Sort for algorithm stability
-    debtors.sort(key=lambda x: x["amount"], reverse=True)
-    creditors.sort(key=lambda x: x["amount"], reverse=True)
+    # STEP 1️⃣ — Calculate net balance for each member (from the nearest checkpoint)
+    # STEP 2️⃣ & 3️⃣ — Match debtors to creditors (greedy algorithm for minimal transactions)
+    # Both run in a worker process for large groups
+    table, transfers = get_group_balance_table(group_id, as_of, match=True)
 
-    # STEP 3️⃣ — Match debtors to creditors (greedy algorithm for minimal transactions)
     settlements = []
-    i, j = 0, 0
-    
-    while i < len(debtors) and j < len(creditors):
-        debtor = debtors[i]
-        creditor = creditors[j]
-
-        # Transfer the minimum of what debtor owes and creditor is owed
-        amount = min(debtor["amount"], creditor["amount"])
-        
+    now = datetime.utcnow()
+    for debtor_id, creditor_id, amount in transfers:
+        # Map interned member ids back to emails only here, at the output boundary
         settlements.append({
-            "paidBy": debtor["user"],
-            "paidTo": creditor["user"],
+            "paidBy": table.members[debtor_id],
+            "paidTo": table.members[creditor_id],
             "amount": round(amount, 2),
             "groupId": group_id,
-            "date": datetime.utcnow(),
-            "createdAt": datetime.utcnow()
+            "date": now,
+            "createdAt": now
         })
 
-        # Update remaining amounts
-        debtor["amount"] -= amount
-        creditor["amount"] -= amount
-
-        # Move to next debtor/creditor if current one is settled
-        if abs(debtor["amount"]) < 1e-6:
-            i += 1
-        if abs(creditor["amount"]) < 1e-6:
-            j += 1
-
     return settlements
 
 
@@ -0,0 +1,104 @@
+"""
+Flat vs bucketed expense storage benchmark against a live MongoDB.
+
+Loads the same synthetic group into both layouts in a scratch database and times the
+read patterns that grow with group size: listing every expense and computing balances.
+Also reports document and index sizes. Needs MONGO_URL to point at a MongoDB server;
+the scratch database is dropped afterwards.
+
+Run from the backend directory:
+    python -m benchmarks.bucket_benchmark [--members 200] [--expenses 100000]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app.database import client
+from app.services import balance_service, expense_buckets
+from benchmarks.settlement_benchmark import generate_expenses
+
+BENCH_DATABASE = "expense_splitter_bucket_benchmark"
+
+
+def load_group(db, members, expenses):
+    group_id = str(db.groups.insert_one({"name": "benchmark", "members": members}).inserted_id)
+    bucketed_id = str(db.groups.insert_one({"name": "benchmark (bucketed)", "members": members}).inserted_id)
+
+    start = datetime(2020, 1, 1)
+    flat_docs = []
+    for i, expense in enumerate(expenses):
+        flat_docs.append({
+            **expense,
+            "_id": ObjectId(),
+            "groupId": group_id,
+            "category": "general",
+            "description": "benchmark expense",
+            "date": start + timedelta(minutes=30 * i),
+            "createdAt": start
+        })
+    db.expenses.insert_many(flat_docs)
+    db.expenses.insert_many([{**doc, "_id": ObjectId(), "groupId": bucketed_id} for doc in flat_docs])
+
+    started = time.perf_counter()
+    expense_buckets.migrate_group_to_buckets(bucketed_id)
+    print(f"{'migration':<26} took {time.perf_counter() - started:9.2f} s")
+    return group_id, bucketed_id
+
+
+def measure(label, fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    print(f"{label:<26} best {min(timings) * 1000:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--expenses", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db = client[BENCH_DATABASE]
+    client.drop_database(BENCH_DATABASE)
+    # Point the services at the scratch database
+    balance_service.db = expense_buckets.db = db
+    db.expenses.create_index([("groupId", 1), ("date", 1)])
+    db.expense_buckets.create_index([("groupId", 1), ("period", 1), ("count", 1)])
+    db.expense_buckets.create_index([("groupId", 1), ("maxDate", 1)])
+    db.expense_buckets.create_index("expenses._id")
+
+    try:
+        members, expenses = generate_expenses(args.members, args.expenses)
+        print(f"{args.members} members, {args.expenses} expenses")
+        group_id, bucketed_id = load_group(db, members, expenses)
+
+        measure("list flat", lambda: list(expense_buckets.iter_group_expense_docs(group_id)), args.repeat)
+        measure("list bucketed", lambda: list(expense_buckets.iter_group_expense_docs(bucketed_id)), args.repeat)
+
+        # Checkpoints would hide the replay after the first run, so drop them each time
+        def flat_balances():
+            balance_service.invalidate_checkpoints(group_id)
+            return balance_service.get_group_balances(group_id)
+
+        measure("balances flat (replay)", flat_balances, args.repeat)
+        measure("balances bucketed", lambda: balance_service.get_group_balances(bucketed_id), args.repeat)
+
+        flat = balance_service.get_group_balances(group_id)
+        bucketed = balance_service.get_group_balances(bucketed_id)
+        assert all(abs(flat[member] - bucketed.get(member, 0.0)) < 0.01 for member in flat)
+
+        for name in ("expenses", "expense_buckets"):
+            stats = db.command("collStats", name)
+            print(
+                f"{name:<16} {stats['count']:8d} docs   data {stats['size'] / 1024 ** 2:8.1f} MiB"
+                f"   indexes {stats['totalIndexSize'] / 1024 ** 2:8.1f} MiB"
+            )
+    finally:
+        client.drop_database(BENCH_DATABASE)
+
+
+if __name__ == "__main__":
+    main()
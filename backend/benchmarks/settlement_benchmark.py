@@ -0,0 +1,169 @@
+"""
+Time and memory benchmark for the settlement engine on a synthetic group.
+
+Compares the original dict-based computation (email-keyed balances and per-user
+debtor/creditor dicts) with the interned BalanceTable, both replayed from encoded columns
+(as offloaded to the worker pool) and straight from the documents (as done inline).
+No database is needed.
+
+Run from the backend directory:
+    python -m benchmarks.settlement_benchmark [--members 200] [--expenses 100000]
+"""
+import argparse
+import pickle
+import random
+import time
+import tracemalloc
+from app.services.balance_table import (
+    BalanceTable,
+    ExpenseColumns,
+    apply_expense,
+    replay_columns,
+    match_settlements
+)
+
+
+def generate_expenses(member_count: int, expense_count: int, seed: int = 42):
+    rng = random.Random(seed)
+    members = [f"member{i}@example.com" for i in range(member_count)]
+    expenses = []
+    for _ in range(expense_count):
+        amount = round(rng.uniform(5, 500), 2)
+        kind = rng.random()
+        if kind < 0.5:
+            split_type, splits = "equal", None
+        elif kind < 0.75:
+            split_type = "equal"
+            splits = {member: 1 for member in rng.sample(members, rng.randint(2, 8))}
+        elif kind < 0.9:
+            split_type = "unequal"
+            participants = rng.sample(members, rng.randint(2, 6))
+            splits = {member: amount / len(participants) for member in participants}
+        else:
+            split_type = "percentage"
+            participants = rng.sample(members, 4)
+            splits = {member: 25 for member in participants}
+        expenses.append({
+            "amount": amount,
+            "paidBy": rng.choice(members),
+            "splitType": split_type,
+            "splits": splits
+        })
+    return members, expenses
+
+
+def settle_with_dicts(members, expenses):
+    """The original settle_group_expenses algorithm, without the database."""
+    balances = {}
+    for expense in expenses:
+        paid_by = expense["paidBy"]
+        amount = expense["amount"]
+        split_type = expense.get("splitType", "equal")
+        splits = expense.get("splits")
+        balances[paid_by] = balances.get(paid_by, 0.0) + amount
+        if split_type == "equal":
+            participants = members if splits is None else list(splits.keys())
+            if participants:
+                split_amount = amount / len(participants)
+                for member in participants:
+                    balances[member] = balances.get(member, 0.0) - split_amount
+        elif split_type == "unequal" and splits:
+            for member, split_amount in splits.items():
+                balances[member] = balances.get(member, 0.0) - split_amount
+        elif split_type == "percentage" and splits:
+            for member, percentage in splits.items():
+                balances[member] = balances.get(member, 0.0) - (amount * percentage) / 100
+
+    debtors, creditors = [], []
+    for user, balance in balances.items():
+        if abs(balance) < 1e-6:
+            continue
+        if balance < 0:
+            debtors.append({"user": user, "amount": -balance})
+        else:
+            creditors.append({"user": user, "amount": balance})
+    debtors.sort(key=lambda x: x["amount"], reverse=True)
+    creditors.sort(key=lambda x: x["amount"], reverse=True)
+
+    settlements = []
+    i, j = 0, 0
+    while i < len(debtors) and j < len(creditors):
+        amount = min(debtors[i]["amount"], creditors[j]["amount"])
+        settlements.append((debtors[i]["user"], creditors[j]["user"], round(amount, 2)))
+        debtors[i]["amount"] -= amount
+        creditors[j]["amount"] -= amount
+        if abs(debtors[i]["amount"]) < 1e-6:
+            i += 1
+        if abs(creditors[j]["amount"]) < 1e-6:
+            j += 1
+    return settlements
+
+
+def settle_with_table(members, expenses):
+    table = BalanceTable(members)
+    columns = ExpenseColumns()
+    for expense in expenses:
+        columns.append(expense, table)
+    values, _ = replay_columns(table.values, table.group_ids, columns)
+    return [
+        (table.members[debtor_id], table.members[creditor_id], round(amount, 2))
+        for debtor_id, creditor_id, amount in match_settlements(values)
+    ]
+
+
+def settle_from_documents(members, expenses):
+    table = BalanceTable(members)
+    shared = 0.0
+    for expense in expenses:
+        shared += apply_expense(table, expense)
+    for member_id in table.group_ids:
+        table.values[member_id] -= shared
+    return [
+        (table.members[debtor_id], table.members[creditor_id], round(amount, 2))
+        for debtor_id, creditor_id, amount in match_settlements(table.values)
+    ]
+
+
+def measure(label, settle, members, expenses, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        settle(members, expenses)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = settle(members, expenses)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<12} best {min(timings) * 1000:9.1f} ms   peak {peak / 1024:9.1f} KiB   {len(result)} transfers")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--expenses", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    members, expenses = generate_expenses(args.members, args.expenses)
+    print(f"{args.members} members, {args.expenses} expenses")
+
+    legacy = measure("dicts", settle_with_dicts, members, expenses, args.repeat)
+    interned = measure("interned", settle_with_table, members, expenses, args.repeat)
+    documents = measure("documents", settle_from_documents, members, expenses, args.repeat)
+
+    table = BalanceTable(members)
+    columns = ExpenseColumns()
+    for expense in expenses:
+        columns.append(expense, table)
+    print(f"worker payload: {len(pickle.dumps(columns)) / 1024:.1f} KiB of columns")
+
+    # Transfers may be ordered differently on ties, but must move the same totals
+    assert abs(sum(t[2] for t in legacy) - sum(t[2] for t in interned)) < 0.01 * max(len(legacy), 1)
+    assert documents == interned
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Test fixtures: the app running against an in-memory mongomock database.
+
+mongomock doesn't emit pymongo's command monitoring events, so `database.count_commands()`
+is fed by wrapping the collection methods instead: each call the app makes counts the
+commands pymongo would send for it. A bulk write counts one command per run of inserts,
+updates or deletes (per kind when unordered), like pymongo batches them. Calls mongomock
+makes internally are not counted.
+
+Run from the backend directory with:
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+import os
+import tempfile
+
+os.environ["MONGO_URL"] = "mongodb://localhost:27017"
+os.environ["JWT_SECRET"] = "test-secret"
+os.environ["PROFILE_DIR"] = tempfile.mkdtemp(prefix="expense_splitter_test_profiles_")
+# Keep the recurring expense scheduler from polling during tests
+os.environ["RECURRING_POLL_SECONDS"] = "3600"
+# Small receipt chunks, so reads and ranges cross chunk boundaries
+os.environ["RECEIPT_CHUNK_SIZE"] = "1024"
+
+import threading
+from datetime import datetime
+import mongomock
+import mongomock.gridfs
+import pymongo
+import pytest
+from mongomock.collection import Collection
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult
+
+mongomock.gridfs.enable_gridfs_integration()
+_MongoClient = pymongo.MongoClient
+pymongo.MongoClient = mongomock.MongoClient
+try:
+    from app import database
+finally:
+    pymongo.MongoClient = _MongoClient
+
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services import auth_service, expense_buckets, fx_rates, membership_cache
+
+COUNTED_METHODS = (
+    "find", "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "find_one_and_update", "find_one_and_delete",
+    "find_one_and_replace", "count_documents", "aggregate", "distinct"
+)
+_BULK_KINDS = {InsertOne: "insert", UpdateOne: "update", UpdateMany: "update", ReplaceOne: "update",
+               DeleteOne: "delete", DeleteMany: "delete"}
+
+_inside = threading.local()
+
+
+def _count(commands: int) -> None:
+    count = database._command_count.get()
+    if count is not None:
+        count[0] += commands
+
+
+def _counted(method):
+    def wrapper(self, *args, **kwargs):
+        if getattr(_inside, "active", False):
+            return method(self, *args, **kwargs)
+        _count(1)
+        _inside.active = True
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _inside.active = False
+    return wrapper
+
+
+def _bulk_write(self, requests, ordered=True, **kwargs):
+    # mongomock's own bulk_write doesn't accept the operations of current pymongo versions
+    kinds = [_BULK_KINDS[type(request)] for request in requests]
+    if ordered:
+        _count(sum(1 for index, kind in enumerate(kinds) if index == 0 or kinds[index - 1] != kind))
+    else:
+        _count(len(set(kinds)))
+
+    totals = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0, "upserted": []}
+    _inside.active = True
+    try:
+        for request in requests:
+            if isinstance(request, InsertOne):
+                self.insert_one(request._doc)
+                totals["nInserted"] += 1
+                continue
+            if isinstance(request, UpdateOne):
+                result = self.update_one(request._filter, request._doc, upsert=request._upsert)
+            elif isinstance(request, UpdateMany):
+                result = self.update_many(request._filter, request._doc, upsert=request._upsert)
+            elif isinstance(request, ReplaceOne):
+                result = self.replace_one(request._filter, request._doc, upsert=request._upsert)
+            elif isinstance(request, DeleteOne):
+                totals["nRemoved"] += self.delete_one(request._filter).deleted_count
+                continue
+            else:
+                totals["nRemoved"] += self.delete_many(request._filter).deleted_count
+                continue
+            totals["nMatched"] += result.matched_count
+            totals["nModified"] += result.modified_count
+            totals["nUpserted"] += result.upserted_id is not None
+    finally:
+        _inside.active = False
+    return BulkWriteResult(totals, True)
+
+
+for _name in COUNTED_METHODS:
+    setattr(Collection, _name, _counted(getattr(Collection, _name)))
+Collection.bulk_write = _bulk_write
+
+
+@pytest.fixture
+def db():
+    yield database.db
+    for name in database.db.list_collection_names():
+        database.db.drop_collection(name)
+    membership_cache._cache.clear()
+    expense_buckets._bucketed_groups.clear()
+    expense_buckets._flat_groups.clear()
+    fx_rates.rate_table.invalidate()
+
+
+@pytest.fixture
+def client(db):
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def make_user(db):
+    """
+    Create a user and return the Authorization headers of a session for them.
+    """
+    def make(email: str, name: str = "Test User", **fields) -> dict:
+        user_id = db.users.insert_one({
+            "name": name,
+            "email": email,
+            "passwordHash": "unused",
+            "createdAt": datetime.utcnow(),
+            **fields
+        }).inserted_id
+        token = auth_service.create_access_token({"user_id": str(user_id), "email": email})
+        return {"Authorization": f"Bearer {token}"}
+    return make
@@ -0,0 +1,81 @@
+"""
+Spending rollups stay consistent when the members of a group change between writes.
+"""
+import pytest
+
+
+@pytest.fixture
+def alice(make_user):
+    make_user("bob@example.com", "Bob")
+    return make_user("alice@example.com", "Alice")
+
+
+@pytest.fixture
+def group_id(client, alice):
+    return client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+
+
+def _add_member(client, alice, group_id):
+    response = client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    assert response.status_code == 200, response.text
+
+
+def _add_expense(client, alice, group_id, amount=30):
+    response = client.post("/expenses/", json={
+        "groupId": group_id, "amount": amount, "paidBy": "alice@example.com", "category": "food",
+        "date": "2024-03-01T12:00:00"
+    }, headers=alice)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _by_member(client, alice, group_id):
+    response = client.get(f"/analytics/group/{group_id}", headers=alice)
+    assert response.status_code == 200, response.text
+    return response.json()["byMember"]
+
+
+def test_delete_after_a_member_joined(client, alice, group_id):
+    expense_id = _add_expense(client, alice, group_id)
+    _add_member(client, alice, group_id)
+    assert client.delete(f"/expenses/{expense_id}", headers=alice).status_code == 200
+
+    by_member = _by_member(client, alice, group_id)
+    assert all(totals == {"paid": 0, "share": 0} for totals in by_member.values())
+
+
+def test_update_after_a_member_joined(client, alice, group_id):
+    expense_id = _add_expense(client, alice, group_id)
+    _add_member(client, alice, group_id)
+    assert client.put(f"/expenses/{expense_id}", json={"amount": 40}, headers=alice).status_code == 200
+
+    # Still shared among the members it was recorded with
+    assert _by_member(client, alice, group_id) == {"alice@example.com": {"paid": 40, "share": 40}}
+
+
+def test_resplit_after_a_member_joined(client, alice, group_id):
+    expense_id = _add_expense(client, alice, group_id)
+    _add_member(client, alice, group_id)
+    response = client.put(f"/expenses/{expense_id}", json={"splitType": "equal"}, headers=alice)
+    assert response.status_code == 200, response.text
+
+    assert _by_member(client, alice, group_id) == {
+        "alice@example.com": {"paid": 30, "share": 15},
+        "bob@example.com": {"paid": 0, "share": 15}
+    }
+    assert client.delete(f"/expenses/{expense_id}", headers=alice).status_code == 200
+    assert all(totals == {"paid": 0, "share": 0} for totals in _by_member(client, alice, group_id).values())
+
+
+def test_rebuild_matches_incremental_rollups(client, alice, group_id):
+    _add_expense(client, alice, group_id, 30)
+    _add_member(client, alice, group_id)
+    _add_expense(client, alice, group_id, 10)
+    incremental = _by_member(client, alice, group_id)
+
+    assert client.post(f"/analytics/group/{group_id}/rebuild", headers=alice).status_code == 200
+    assert _by_member(client, alice, group_id) == incremental
+    assert incremental == {
+        "alice@example.com": {"paid": 40, "share": 35},
+        "bob@example.com": {"paid": 0, "share": 5}
+    }
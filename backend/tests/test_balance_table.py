@@ -0,0 +1,59 @@
+"""
+The interned balance table against the original dict-based settlement, including how ties
+between equal balances are broken.
+"""
+import pytest
+from benchmarks.settlement_benchmark import (
+    generate_expenses,
+    settle_from_documents,
+    settle_with_dicts,
+    settle_with_table
+)
+
+MEMBERS = ["alice@example.com", "bob@example.com", "carol@example.com", "dave@example.com"]
+
+
+def _same_transfers(actual, expected):
+    assert [(debtor, creditor) for debtor, creditor, _ in actual] == [
+        (debtor, creditor) for debtor, creditor, _ in expected
+    ]
+    # Sums are added up in another order, which can move a rounded amount by a cent
+    assert [amount for _, _, amount in actual] == pytest.approx(
+        [amount for _, _, amount in expected], abs=0.011
+    )
+
+
+@pytest.mark.parametrize("settle", [settle_with_table, settle_from_documents])
+@pytest.mark.parametrize("seed", range(20))
+def test_same_transfers_as_the_dict_version(settle, seed):
+    members, expenses = generate_expenses(12, 200, seed)
+    _same_transfers(settle(members, expenses), settle_with_dicts(members, expenses))
+
+
+@pytest.mark.parametrize("settle", [settle_with_table, settle_from_documents])
+def test_ties_in_member_order_match_the_dict_version(settle):
+    # Whole-group splits leave bob and carol owing exactly the same
+    expenses = [
+        {"amount": 40, "paidBy": "dave@example.com", "splitType": "equal", "splits": None},
+        {"amount": 30, "paidBy": "alice@example.com", "splitType": "equal", "splits": None},
+    ]
+    transfers = settle(MEMBERS, expenses)
+
+    assert transfers == settle_with_dicts(MEMBERS, expenses)
+    assert [debtor for debtor, _, _ in transfers] == ["bob@example.com", "carol@example.com", "carol@example.com"]
+
+
+@pytest.mark.parametrize("settle", [settle_with_table, settle_from_documents])
+def test_ties_follow_the_member_list(settle):
+    # bob appears in the expenses before alice, but alice is listed first in the group
+    expenses = [
+        {"amount": 20, "paidBy": "carol@example.com", "splitType": "unequal",
+         "splits": {"bob@example.com": 10, "alice@example.com": 10}},
+    ]
+
+    assert settle(MEMBERS, expenses) == [
+        ("alice@example.com", "carol@example.com", 10),
+        ("bob@example.com", "carol@example.com", 10),
+    ]
+    # The dict version took bob first
+    assert settle_with_dicts(MEMBERS, expenses)[0][0] == "bob@example.com"
@@ -0,0 +1,189 @@
+"""
+Balances served from checkpoints stay equal to a full replay when expenses change, and
+long tails are replayed in the worker pool with the same results.
+"""
+from datetime import datetime
+import pytest
+from app.config import SETTLEMENT_RETRY_AFTER_SECONDS
+from app.models.expenses import ExpenseCreate
+from app.services import balance_service, compute_pool, expense_service
+
+
+@pytest.fixture
+def users(make_user):
+    return make_user("alice@example.com", "Alice"), make_user("bob@example.com", "Bob")
+
+
+@pytest.fixture
+def group_id(client, users, monkeypatch):
+    monkeypatch.setattr(balance_service, "BALANCE_CHECKPOINT_INTERVAL", 2)
+    alice, _ = users
+    group_id = client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    return group_id
+
+
+def _add_expense(client, headers, group_id, amount, day):
+    response = client.post("/expenses/", json={
+        "groupId": group_id, "amount": amount, "category": "food",
+        "paidBy": "alice@example.com", "date": f"2024-03-{day:02d}T12:00:00"
+    }, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _balances(client, headers, group_id):
+    response = client.get(f"/settlements/balances/{group_id}", headers=headers)
+    assert response.status_code == 200, response.text
+    return {entry["userEmail"]: entry["netBalance"] for entry in response.json()["balances"]}
+
+
+def _replayed_balances(db, group_id):
+    db.balance_checkpoints.delete_many({"groupId": group_id})
+    return {user: round(balance, 2) for user, balance in balance_service.get_group_balances(group_id).items()}
+
+
+@pytest.fixture
+def checkpointed(db, client, users, group_id):
+    alice, bob = users
+    ids = [_add_expense(client, alice if day % 2 else bob, group_id, 10 * day, day) for day in range(2, 10)]
+    _balances(client, alice, group_id)
+    assert db.balance_checkpoints.count_documents({"groupId": group_id}) >= 2
+    return ids
+
+
+def test_backdated_create(db, client, users, group_id, checkpointed):
+    alice, _ = users
+    _add_expense(client, alice, group_id, 7, 1)
+    assert _balances(client, alice, group_id) == _replayed_balances(db, group_id)
+
+
+def test_backdated_update(db, client, users, group_id, checkpointed):
+    alice, bob = users
+    # An expense of bob's moves before every checkpoint and changes its amount
+    response = client.put(f"/expenses/{checkpointed[-2]}", json={"amount": 3, "date": "2024-03-01T00:00:00"}, headers=bob)
+    assert response.status_code == 200, response.text
+    assert _balances(client, alice, group_id) == _replayed_balances(db, group_id)
+
+
+def test_backdated_delete(db, client, users, group_id, checkpointed):
+    alice, _ = users
+    assert client.delete(f"/expenses/{checkpointed[0]}", headers=alice).status_code == 200
+    assert _balances(client, alice, group_id) == _replayed_balances(db, group_id)
+
+
+def test_member_change(db, client, users, group_id, checkpointed, make_user):
+    alice, _ = users
+    make_user("carol@example.com", "Carol")
+    client.post(f"/groups/{group_id}/add-member?member_email=carol@example.com", headers=alice)
+    assert _balances(client, alice, group_id) == _replayed_balances(db, group_id)
+
+
+def test_expense_written_during_a_replay(db, client, users, group_id, checkpointed, monkeypatch):
+    alice, _ = users
+    db.balance_checkpoints.delete_many({"groupId": group_id})
+    save_checkpoints = balance_service._save_checkpoints
+
+    def save_after_a_concurrent_write(*args):
+        # The replay has read the expenses; a backdated one is written before it saves
+        expense_service.create_expense(ExpenseCreate(
+            groupId=group_id, amount=50, category="food", paidBy="alice@example.com", date="2024-03-01T00:00:00"
+        ))
+        save_checkpoints(*args)
+
+    monkeypatch.setattr(balance_service, "_save_checkpoints", save_after_a_concurrent_write)
+    balance_service.get_group_balances(group_id)
+    monkeypatch.setattr(balance_service, "_save_checkpoints", save_checkpoints)
+
+    assert db.balance_checkpoints.count_documents({"groupId": group_id}) == 0
+    assert _balances(client, alice, group_id) == _replayed_balances(db, group_id)
+
+
+def test_new_expenses_leave_earlier_checkpoints(db, client, users, group_id, checkpointed):
+    alice, _ = users
+    checkpoints = db.balance_checkpoints.count_documents({"groupId": group_id})
+    _add_expense(client, alice, group_id, 5, 20)
+    assert db.balance_checkpoints.count_documents({"groupId": group_id}) == checkpoints
+    assert _balances(client, alice, group_id) == _replayed_balances(db, group_id)
+
+
+@pytest.fixture
+def offloaded(monkeypatch):
+    # Runs offloaded work in this process, recording what was offloaded
+    calls = []
+
+    def run(fn, *args):
+        calls.append(fn.__name__)
+        return fn(*args)
+
+    monkeypatch.setattr(balance_service, "SETTLEMENT_OFFLOAD_THRESHOLD", 4)
+    monkeypatch.setattr(compute_pool, "is_enabled", lambda: True)
+    monkeypatch.setattr(compute_pool, "run", run)
+    return calls
+
+
+def _insert_mixed_expenses(db, group_id, count):
+    splits = [
+        ("equal", None),
+        ("equal", {"alice@example.com": 1, "carol@example.com": 1}),
+        ("unequal", {"bob@example.com": 7.5, "alice@example.com": 2.5}),
+        ("percentage", {"alice@example.com": 30, "bob@example.com": 70}),
+    ]
+    db.expenses.insert_many([
+        {
+            "groupId": group_id, "amount": 10.0 + day, "paidBy": "bob@example.com" if day % 3 else "alice@example.com",
+            "splitType": splits[day % 4][0], "splits": splits[day % 4][1], "category": "food",
+            "date": datetime(2024, 3, day + 1, 12), "currency": None
+        }
+        for day in range(count)
+    ])
+
+
+@pytest.mark.parametrize("count, offloaded_calls", [(3, []), (4, ["_replay_expenses"]), (9, ["_replay_expenses"])])
+def test_offload_threshold(db, group_id, offloaded, count, offloaded_calls):
+    _insert_mixed_expenses(db, group_id, count)
+    balance_service.get_group_balance_table(group_id)
+    assert offloaded == offloaded_calls
+
+
+def _checkpoints(db, group_id):
+    checkpoints = list(db.balance_checkpoints.find({"groupId": group_id}).sort("asOf", 1))
+    db.balance_checkpoints.delete_many({"groupId": group_id})
+    return [(checkpoint["asOf"], [entry["user"] for entry in checkpoint["balances"]]) for checkpoint in checkpoints], [
+        entry["amount"] for checkpoint in checkpoints for entry in checkpoint["balances"]
+    ]
+
+
+def test_inline_and_offloaded_replays_agree(db, group_id, offloaded, monkeypatch):
+    _insert_mixed_expenses(db, group_id, 9)
+    pooled_table, pooled_transfers = balance_service.get_group_balance_table(group_id, match=True)
+    pooled_checkpoints, pooled_amounts = _checkpoints(db, group_id)
+
+    monkeypatch.setattr(balance_service, "SETTLEMENT_OFFLOAD_THRESHOLD", 100)
+    table, transfers = balance_service.get_group_balance_table(group_id, match=True)
+    checkpoints, amounts = _checkpoints(db, group_id)
+
+    assert offloaded == ["_replay_expenses"]
+    assert table.members == pooled_table.members
+    assert list(table.values) == pytest.approx(list(pooled_table.values))
+    assert [(debtor, creditor) for debtor, creditor, _ in transfers] == [(debtor, creditor) for debtor, creditor, _ in pooled_transfers]
+    assert [amount for _, _, amount in transfers] == pytest.approx([amount for _, _, amount in pooled_transfers])
+    assert len(checkpoints) == 4
+    assert checkpoints == pooled_checkpoints
+    assert amounts == pytest.approx(pooled_amounts)
+
+
+def test_busy_pool_returns_503(db, client, users, group_id, monkeypatch):
+    alice, _ = users
+    _insert_mixed_expenses(db, group_id, 4)
+
+    def busy(fn, *args):
+        raise compute_pool.ComputationUnavailable()
+
+    monkeypatch.setattr(balance_service, "SETTLEMENT_OFFLOAD_THRESHOLD", 4)
+    monkeypatch.setattr(compute_pool, "is_enabled", lambda: True)
+    monkeypatch.setattr(compute_pool, "run", busy)
+    response = client.get(f"/settlements/balances/{group_id}", headers=alice)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(SETTLEMENT_RETRY_AFTER_SECONDS)
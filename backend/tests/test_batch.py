@@ -0,0 +1,124 @@
+"""
+Batched sub-requests: ordering, per-item results and authentication.
+"""
+from app.config import BATCH_MAX_REQUESTS
+from app.services import receipt_service
+
+
+def _batch(client, headers, *requests):
+    response = client.post("/batch/", json={"requests": list(requests)}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["responses"]
+
+
+def _group(client, headers):
+    return client.post("/groups/", json={"name": "Trip"}, headers=headers).json()["id"]
+
+
+def test_writes_run_in_order(client, make_user):
+    alice = make_user("alice@example.com", "Alice")
+    group_id = _group(client, alice)
+    expense = {"groupId": group_id, "amount": 30, "paidBy": "alice@example.com", "category": "food"}
+
+    responses = _batch(
+        client, alice,
+        {"id": "before", "method": "GET", "path": f"/expenses/group/{group_id}"},
+        {"id": "first", "method": "POST", "path": "/expenses/", "body": {**expense, "description": "first"}},
+        {"id": "second", "method": "POST", "path": "/expenses/", "body": {**expense, "description": "second"}},
+        {"id": "after", "method": "GET", "path": f"/expenses/group/{group_id}"},
+        {"id": "balances", "method": "GET", "path": f"/settlements/balances/{group_id}"},
+    )
+
+    assert [item["id"] for item in responses] == ["before", "first", "second", "after", "balances"]
+    assert responses[0]["body"] == []
+    first, second = responses[1]["body"], responses[2]["body"]
+    assert {expense["id"] for expense in responses[3]["body"]} == {first["id"], second["id"]}
+    assert responses[4]["status"] == 200
+
+
+def test_each_item_has_its_own_status(client, make_user):
+    alice = make_user("alice@example.com", "Alice")
+    bob = make_user("bob@example.com", "Bob")
+    alices_group = _group(client, alice)
+    bobs_group = _group(client, bob)
+
+    responses = _batch(
+        client, alice,
+        {"id": "mine", "method": "GET", "path": f"/settlements/balances/{alices_group}"},
+        {"id": "theirs", "method": "GET", "path": f"/settlements/balances/{bobs_group}"},
+        {"id": "missing", "method": "GET", "path": "/expenses/000000000000000000000000"},
+        {"id": "invalid", "method": "POST", "path": "/expenses/", "body": {"groupId": alices_group}},
+    )
+
+    assert [(item["id"], item["status"]) for item in responses] == [
+        ("mine", 200), ("theirs", 403), ("missing", 404), ("invalid", 422)
+    ]
+
+
+def test_nested_batch_is_rejected(client, make_user):
+    alice = make_user("alice@example.com", "Alice")
+
+    responses = _batch(
+        client, alice,
+        {"id": "nested", "method": "POST", "path": "/batch", "body": {"requests": []}},
+        {"id": "nested-slash", "method": "POST", "path": "/batch/", "body": {"requests": []}},
+        {"id": "relative", "method": "GET", "path": "groups/"},
+    )
+
+    assert [item["status"] for item in responses] == [400, 400, 400]
+
+
+def test_too_many_requests(client, make_user):
+    alice = make_user("alice@example.com", "Alice")
+    requests = [{"id": str(i), "method": "GET", "path": "/groups/"} for i in range(BATCH_MAX_REQUESTS + 1)]
+
+    response = client.post("/batch/", json={"requests": requests}, headers=alice)
+
+    assert response.status_code == 400
+
+
+def test_requires_authentication(client, make_user):
+    make_user("alice@example.com", "Alice")
+    requests = [{"id": "groups", "method": "GET", "path": "/groups/"}]
+
+    assert client.post("/batch/", json={"requests": requests}).status_code == 401
+    bad_token = {"Authorization": "Bearer not-a-token"}
+    assert client.post("/batch/", json={"requests": requests}, headers=bad_token).status_code == 401
+
+
+def test_sub_requests_run_as_the_caller(client, make_user):
+    alice = make_user("alice@example.com", "Alice")
+    bob = make_user("bob@example.com", "Bob")
+    group_id = _group(client, alice)
+
+    responses = _batch(
+        client, bob,
+        {"id": "groups", "method": "GET", "path": "/groups/"},
+        {"id": "expense", "method": "POST", "path": "/expenses/", "body": {
+            "groupId": group_id, "amount": 30, "paidBy": "alice@example.com", "category": "food"
+        }},
+    )
+
+    assert responses[0]["body"] == []
+    assert responses[1]["status"] == 403
+
+
+def test_file_responses_are_rejected(client, make_user):
+    alice = make_user("alice@example.com", "Alice")
+    group_id = _group(client, alice)
+    expense = client.post("/expenses/", json={
+        "groupId": group_id, "amount": 30, "paidBy": "alice@example.com", "category": "food"
+    }, headers=alice).json()
+    upload = receipt_service.ReceiptUpload(expense["id"], group_id, "application/pdf", "alice@example.com")
+    upload.write(bytes(range(256)))
+    upload.complete()
+
+    responses = _batch(
+        client, alice,
+        {"id": "receipt", "method": "GET", "path": f"/expenses/{expense['id']}/receipt"},
+        {"id": "expense", "method": "GET", "path": f"/expenses/{expense['id']}"},
+    )
+
+    assert responses[0]["status"] == 400
+    assert "directly" in responses[0]["body"]["detail"]
+    assert responses[1]["status"] == 200
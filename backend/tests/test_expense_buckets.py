@@ -0,0 +1,160 @@
+"""
+Bucketed storage: balances from bucket deltas match a replay of the expenses, migration
+moves a group without changing what it reads, and search ranks both layouts together.
+"""
+from collections import defaultdict
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from app.services import balance_service, expense_buckets
+from app.services.balance_table import expense_shares
+
+MEMBERS = ["alice@example.com", "bob@example.com", "carol@example.com"]
+
+
+@pytest.fixture
+def alice(make_user):
+    make_user("bob@example.com", "Bob")
+    make_user("carol@example.com", "Carol")
+    return make_user("alice@example.com", "Alice")
+
+
+def _group(client, alice, name="Trip"):
+    group_id = client.post("/groups/", json={"name": name}, headers=alice).json()["id"]
+    client.post(f"/groups/{group_id}/add-members", json={"member_emails": MEMBERS[1:]}, headers=alice)
+    return group_id
+
+
+def _add(client, alice, group_id, amount, date, description="Dinner", **fields):
+    response = client.post("/expenses/", json={
+        "groupId": group_id, "amount": amount, "description": description, "category": "food",
+        "paidBy": "alice@example.com", "date": date, **fields
+    }, headers=alice)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _add_mixed(client, alice, group_id):
+    return [
+        _add(client, alice, group_id, 30, "2024-01-05T12:00:00"),
+        _add(client, alice, group_id, 20, "2024-01-20T12:00:00", splitType="equal", splits={MEMBERS[1]: 1, MEMBERS[2]: 1}),
+        _add(client, alice, group_id, 50, "2024-02-03T12:00:00", splitType="unequal", splits={MEMBERS[1]: 35, MEMBERS[0]: 15}),
+        _add(client, alice, group_id, 80, "2024-02-28T12:00:00", splitType="percentage", splits={MEMBERS[2]: 25, MEMBERS[1]: 75}),
+        _add(client, alice, group_id, 12, "2024-03-10T12:00:00"),
+    ]
+
+
+def _replayed(group_id, as_of=None):
+    # Reference: every expense's shares, without bucket deltas or checkpoints
+    balances = defaultdict(float)
+    for expense in expense_buckets.iter_group_expense_docs(group_id):
+        if as_of is not None and expense["date"] > as_of:
+            continue
+        balances[expense["paidBy"]] += expense["amount"]
+        for member, share in expense_shares(expense, MEMBERS).items():
+            balances[member] -= share
+    return {member: round(balance, 6) for member, balance in balances.items() if round(balance, 6)}
+
+
+def _balances(group_id, as_of=None):
+    balances = balance_service.get_group_balances(group_id, as_of)
+    return {member: round(balance, 6) for member, balance in balances.items() if round(balance, 6)}
+
+
+@pytest.fixture
+def bucketed(client, alice):
+    group_id = _group(client, alice)
+    expense_buckets.migrate_group_to_buckets(group_id)
+    ids = _add_mixed(client, alice, group_id)
+    assert expense_buckets.is_bucketed(group_id)
+    return group_id, ids
+
+
+@pytest.mark.parametrize("as_of", [None, datetime(2024, 1, 31), datetime(2024, 2, 10), datetime(2023, 1, 1)])
+def test_bucket_balances_match_a_replay(db, bucketed, as_of):
+    group_id, _ = bucketed
+    assert db.expenses.count_documents({"groupId": group_id}) == 0
+    assert _balances(group_id, as_of) == _replayed(group_id, as_of)
+
+
+@pytest.mark.parametrize("change", [
+    {"amount": 45},
+    {"date": "2024-03-15T09:00:00"},  # moves to another month's bucket
+    {"splitType": "unequal", "splits": {"bob@example.com": 10, "carol@example.com": 10}},
+    {"paidBy": "carol@example.com"},
+])
+def test_bucket_balances_after_an_update(db, client, alice, bucketed, change):
+    group_id, ids = bucketed
+    response = client.put(f"/expenses/{ids[1]}", json=change, headers=alice)
+    assert response.status_code == 200, response.text
+
+    assert _balances(group_id) == _replayed(group_id)
+    assert _balances(group_id, datetime(2024, 2, 10)) == _replayed(group_id, datetime(2024, 2, 10))
+    assert sum(bucket["count"] for bucket in db.expense_buckets.find({"groupId": group_id})) == len(ids)
+
+
+def test_bucket_balances_after_a_delete(db, client, alice, bucketed):
+    group_id, ids = bucketed
+    for expense_id in ids[::2]:
+        assert client.delete(f"/expenses/{expense_id}", headers=alice).status_code == 200
+
+    assert _balances(group_id) == _replayed(group_id)
+    assert sorted(expense["_id"] for expense in expense_buckets.iter_group_expense_docs(group_id)) == sorted(
+        ObjectId(expense_id) for expense_id in ids[1::2]
+    )
+
+
+def test_migration(db, client, alice):
+    group_id = _group(client, alice)
+    ids = _add_mixed(client, alice, group_id)
+    listed = client.get(f"/expenses/group/{group_id}", headers=alice).json()
+    before = _balances(group_id)
+
+    assert expense_buckets.migrate_group_to_buckets(group_id) == len(ids)
+
+    assert db.expenses.count_documents({"groupId": group_id}) == 0
+    assert sorted(bucket["period"] for bucket in db.expense_buckets.find({"groupId": group_id})) == ["2024-01", "2024-02", "2024-03"]
+    assert _balances(group_id) == before == _replayed(group_id)
+    migrated = client.get(f"/expenses/group/{group_id}", headers=alice).json()
+    assert sorted(migrated, key=lambda expense: expense["id"]) == sorted(listed, key=lambda expense: expense["id"])
+    assert expense_buckets.migrate_group_to_buckets(group_id) == 0
+
+
+def test_migration_picks_up_stragglers(db, client, alice):
+    group_id = _group(client, alice)
+    _add_mixed(client, alice, group_id)
+    expense_buckets.migrate_group_to_buckets(group_id)
+    # Written by a worker that still saw the group as flat
+    straggler = db.expenses.insert_one({
+        "groupId": group_id, "amount": 9, "description": "Taxi", "category": "transport",
+        "paidBy": "bob@example.com", "splitType": "equal", "splits": None,
+        "date": datetime(2024, 3, 20), "createdAt": datetime(2024, 3, 20)
+    }).inserted_id
+
+    assert _balances(group_id) == _replayed(group_id)
+    assert expense_buckets.migrate_group_to_buckets(group_id) == 1
+    assert db.expenses.count_documents({"groupId": group_id}) == 0
+    assert expense_buckets.find_expense(straggler)["amount"] == 9
+    assert _balances(group_id) == _replayed(group_id)
+
+
+def test_search_ranks_flat_and_bucketed_hits_together(client, alice):
+    flat_group = _group(client, alice, "Flat")
+    bucketed_group = _group(client, alice, "Bucketed")
+    expense_buckets.migrate_group_to_buckets(bucketed_group)
+    expected = [
+        _add(client, alice, bucketed_group, 10, "2024-01-01T12:00:00", description="Team dinner party"),
+        _add(client, alice, flat_group, 10, "2024-01-02T12:00:00", description="Team dinner"),
+        _add(client, alice, bucketed_group, 10, "2024-01-03T12:00:00", description="Dinner"),
+        _add(client, alice, flat_group, 10, "2024-01-02T12:00:00", description="Dinner"),
+        _add(client, alice, bucketed_group, 10, "2024-01-01T12:00:00", description="Dinner"),
+    ]
+
+    pages = [
+        client.get("/expenses/search", params={"q": "team dinner party", "page": page, "page_size": 2}, headers=alice).json()
+        for page in (1, 2, 3)
+    ]
+
+    assert [item["id"] for page in pages for item in page["items"]] == expected
+    assert [item["score"] for page in pages for item in page["items"]] == [9, 6, 3, 3, 3]
+    assert [page["hasMore"] for page in pages] == [True, True, False]
@@ -0,0 +1,152 @@
+"""
+Exchange rate lookups and the conversion of expenses into a group's base currency.
+"""
+from datetime import datetime
+import pytest
+from app.services import balance_service, fx_rates
+from app.services.balance_table import BalanceTable, ExpenseColumns
+
+EUR = [(datetime(2024, 1, 1), 1.1), (datetime(2024, 6, 1), 1.2)]
+GBP = [(datetime(2024, 1, 1), 1.25)]
+
+
+def _table(series, **kwargs):
+    loads = []
+
+    def load(currency):
+        loads.append(currency)
+        return series.get(currency, [])
+
+    return fx_rates.FxRateTable(load=load, load_version=lambda: 0, **kwargs), loads
+
+
+def test_factors_use_the_latest_rate_on_or_before_each_date():
+    table, _ = _table({"EUR": EUR})
+    dates = [datetime(2023, 5, 1), datetime(2024, 1, 1), datetime(2024, 5, 31), datetime(2024, 6, 1), datetime(2025, 1, 1)]
+
+    # Dates before the series starts use its earliest rate
+    assert list(table.factors("EUR", "USD", dates)) == [1.1, 1.1, 1.1, 1.2, 1.2]
+    assert list(table.factors("USD", "EUR", dates[:1])) == [pytest.approx(1 / 1.1)]
+
+
+def test_factors_between_two_non_reference_currencies():
+    table, _ = _table({"EUR": EUR, "GBP": GBP})
+    assert list(table.factors("GBP", "EUR", [datetime(2024, 7, 1)])) == [pytest.approx(1.25 / 1.2)]
+
+
+def test_missing_currency():
+    table, _ = _table({"EUR": EUR})
+    assert not table.is_known("XYZ")
+    assert table.is_known("USD")
+    with pytest.raises(fx_rates.MissingExchangeRate) as exc_info:
+        table.factors("XYZ", "USD", [datetime(2024, 1, 1)])
+    assert exc_info.value.currency == "XYZ"
+
+
+def test_series_are_cached_and_evicted_least_recently_used_first():
+    table, loads = _table({"EUR": EUR, "GBP": GBP, "CHF": GBP}, max_currencies=2)
+    for currency in ("EUR", "GBP", "EUR", "CHF", "EUR", "GBP"):
+        table.is_known(currency)
+    assert loads == ["EUR", "GBP", "CHF", "GBP"]
+
+
+def test_a_new_rates_version_drops_cached_series():
+    version = [1]
+    loads = []
+    table = fx_rates.FxRateTable(
+        load=lambda currency: loads.append(currency) or EUR,
+        load_version=lambda: version[0],
+        version_check_seconds=0
+    )
+    table.is_known("EUR")
+    table.is_known("EUR")
+    version[0] = 2
+    table.is_known("EUR")
+
+    assert loads == ["EUR", "EUR"]
+    assert table.version() == 2
+
+
+def test_convert_columns_scales_amounts_and_exact_splits():
+    table, loads = _table({"EUR": EUR, "GBP": GBP})
+    balances = BalanceTable(["a@example.com", "b@example.com"])
+    columns = ExpenseColumns()
+    expenses = [
+        {"amount": 10.0, "paidBy": "a@example.com", "splitType": "equal"},
+        {"amount": 10.0, "paidBy": "a@example.com", "splitType": "unequal",
+         "splits": {"a@example.com": 4.0, "b@example.com": 6.0}},
+        {"amount": 10.0, "paidBy": "b@example.com", "splitType": "equal"},
+        {"amount": 10.0, "paidBy": "b@example.com", "splitType": "equal"},
+    ]
+    for expense in expenses:
+        columns.append(expense, balances)
+
+    priced = [(1, "EUR", datetime(2024, 7, 1)), (2, "GBP", datetime(2024, 7, 1)), (3, "EUR", datetime(2024, 2, 1))]
+    fx_rates.convert_columns(columns, priced, "USD", table)
+
+    assert list(columns.amount) == pytest.approx([10.0, 12.0, 12.5, 11.0])
+    assert list(columns.split_value) == pytest.approx([4.8, 7.2])
+    # One series lookup per currency for the whole batch
+    assert sorted(loads) == ["EUR", "GBP"]
+
+
+@pytest.fixture
+def load_rates(db, tmp_path):
+    def load(rows):
+        path = tmp_path / "rates.csv"
+        path.write_text("date,currency,rate\n" + "".join(f"{row}\n" for row in rows))
+        return fx_rates.load_rates_file(str(path))
+    return load
+
+
+def test_to_currency(load_rates):
+    load_rates(["2024-01-01,EUR,1.1"])
+    expense = {"amount": 10.0, "currency": "EUR", "date": datetime(2024, 3, 1),
+               "splitType": "unequal", "splits": {"a@example.com": 10.0}}
+
+    converted = fx_rates.to_currency(expense, "USD")
+    assert converted["amount"] == pytest.approx(11.0)
+    assert converted["splits"] == {"a@example.com": pytest.approx(11.0)}
+    assert fx_rates.to_currency({**expense, "currency": None}, "USD")["amount"] == 10.0
+
+
+def test_group_balances_follow_newly_loaded_rates(db, client, make_user, load_rates, monkeypatch):
+    # Store a checkpoint after every expense, so stale converted checkpoints would show
+    monkeypatch.setattr(balance_service, "BALANCE_CHECKPOINT_INTERVAL", 1)
+    assert load_rates(["2024-01-01,EUR,1.1"]) == 1
+    alice = make_user("alice@example.com", "Alice")
+    make_user("bob@example.com", "Bob")
+    group_id = client.post("/groups/", json={"name": "Trip", "baseCurrency": "USD"}, headers=alice).json()["id"]
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+
+    def add_expense(amount, currency, day):
+        response = client.post("/expenses/", json={
+            "groupId": group_id, "amount": amount, "currency": currency, "paidBy": "alice@example.com",
+            "category": "food", "date": f"2024-03-{day:02d}T12:00:00"
+        }, headers=alice)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    assert add_expense(100, "USD", 1)["currency"] is None  # the base currency is stored as unpriced
+    add_expense(100, "EUR", 2)
+    add_expense(100, "USD", 3)
+
+    def alice_balance():
+        response = client.get(f"/settlements/balances/{group_id}", headers=alice)
+        return {entry["userEmail"]: entry["netBalance"] for entry in response.json()["balances"]}["alice@example.com"]
+
+    assert alice_balance() == pytest.approx(50 + 55 + 50)
+    assert db.balance_checkpoints.count_documents({"ratesVersion": 1}) > 0
+
+    load_rates(["2024-01-01,EUR,1.5"])
+    assert alice_balance() == pytest.approx(50 + 75 + 50)
+
+
+def test_unknown_expense_currency_is_rejected(client, make_user, load_rates):
+    load_rates(["2024-01-01,EUR,1.1"])
+    alice = make_user("alice@example.com", "Alice")
+    group_id = client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+    response = client.post("/expenses/", json={
+        "groupId": group_id, "amount": 10, "currency": "XYZ", "paidBy": "alice@example.com", "category": "food"
+    }, headers=alice)
+    assert response.status_code == 422
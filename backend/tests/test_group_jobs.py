@@ -0,0 +1,147 @@
+"""
+Background group removal: completion, resuming after a lost lease, and failure.
+"""
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from app.services import group_jobs
+
+
+@pytest.fixture
+def worker(client, monkeypatch):
+    # Jobs are run by the tests themselves rather than the app's worker thread
+    group_jobs.stop_worker()
+    group_jobs._stop.clear()
+    monkeypatch.setattr(group_jobs, "GROUP_JOB_BATCH_PAUSE_SECONDS", 0)
+
+
+@pytest.fixture
+def alice(make_user):
+    make_user("bob@example.com", "Bob")
+    return make_user("alice@example.com", "Alice")
+
+
+@pytest.fixture
+def group_id(client, alice):
+    group_id = client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    for amount in (10, 20):
+        client.post("/expenses/", json={
+            "groupId": group_id, "amount": amount, "paidBy": "alice@example.com", "category": "food"
+        }, headers=alice)
+    return group_id
+
+
+def _start(client, alice, group_id, action="delete"):
+    if action == "delete":
+        response = client.delete(f"/groups/{group_id}", headers=alice)
+    else:
+        response = client.post(f"/groups/{group_id}/{action}", headers=alice)
+    assert response.status_code == 202, response.text
+    job_id = response.json()["id"]
+    # Skip the wait for other workers' cached memberships to expire
+    group_jobs.db.group_jobs.update_one({"_id": ObjectId(job_id)}, {"$set": {"notBefore": datetime.utcnow()}})
+    return job_id
+
+
+def _run_next_job():
+    job = group_jobs._claim_job()
+    assert job is not None
+    group_jobs._run_job(job)
+
+
+def _job(client, alice, job_id):
+    return client.get(f"/groups/jobs/{job_id}", headers=alice).json()
+
+
+def test_delete_group(db, client, alice, group_id, worker):
+    job_id = _start(client, alice, group_id)
+    assert client.get("/groups/", headers=alice).json() == []
+
+    _run_next_job()
+
+    job = _job(client, alice, job_id)
+    assert job["status"] == "completed"
+    assert job["progress"]["expenses"] == 2
+    assert db.groups.count_documents({}) == 0
+    assert db.expenses.count_documents({"groupId": group_id}) == 0
+    assert db.expense_rollups.count_documents({"groupId": group_id}) == 0
+
+
+def test_a_job_whose_lease_ran_out_is_resumed(db, client, alice, group_id, worker, monkeypatch):
+    monkeypatch.setitem(group_jobs.BATCH_SIZES, "expenses", 1)
+    job_id = _start(client, alice, group_id)
+    job = group_jobs._claim_job()
+
+    # The worker removes one batch of expenses and then stalls until its lease runs out
+    assert group_jobs._remove_batch(job, "expenses", False) == 1
+    assert group_jobs._update_job(job, {"$set": {"stepIndex": 3}, "$inc": {"progress.expenses": 1}})
+    db.group_jobs.update_one(
+        {"_id": job["_id"]},
+        {"$set": {"leaseUntil": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+    assert group_jobs._claim_job()["progress"] == {"expenses": 1}
+    # Taken over: the stalled worker can no longer record progress
+    db.group_jobs.update_one({"_id": job["_id"]}, {"$set": {"worker": "another-worker", "leaseUntil": None}})
+    assert not group_jobs._update_job(job, {"$set": {"stepIndex": 4}})
+
+    _run_next_job()
+
+    job = _job(client, alice, job_id)
+    assert job["status"] == "completed"
+    assert job["progress"]["expenses"] == 2
+    assert db.groups.count_documents({}) == 0
+    assert db.expenses.count_documents({"groupId": group_id}) == 0
+
+
+def test_a_failed_job_gives_the_group_back(db, client, alice, group_id, worker, monkeypatch):
+    remove_batch = group_jobs._remove_batch
+
+    def fail_after_the_expenses(job, collection, archived):
+        if collection == "settlements":
+            raise RuntimeError("database unavailable")
+        return remove_batch(job, collection, archived)
+
+    monkeypatch.setattr(group_jobs, "_remove_batch", fail_after_the_expenses)
+    job_id = _start(client, alice, group_id)
+    for attempt in range(group_jobs.MAX_ATTEMPTS):
+        db.group_jobs.update_one({"_id": ObjectId(job_id)}, {"$set": {"leaseUntil": None}})
+        _run_next_job()
+
+    job = _job(client, alice, job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "database unavailable"
+
+    groups = client.get("/groups/", headers=alice).json()
+    assert [group["id"] for group in groups] == [group_id]
+    assert sorted(member["email"] for member in groups[0]["members"]) == ["alice@example.com", "bob@example.com"]
+    group = db.groups.find_one({"_id": ObjectId(group_id)})
+    assert "removalJobId" not in group and "formerMembers" not in group
+    # The removed expenses are gone from the derived data too
+    balances = client.get(f"/settlements/balances/{group_id}", headers=alice).json()["balances"]
+    assert all(entry["netBalance"] == 0 for entry in balances)
+    assert client.get(f"/analytics/group/{group_id}", headers=alice).json()["rollups"] == []
+
+    monkeypatch.setattr(group_jobs, "_remove_batch", remove_batch)
+    _start(client, alice, group_id)
+    _run_next_job()
+    assert db.groups.count_documents({}) == 0
+
+
+def test_a_job_that_cannot_take_the_group_leaves_it_alone(db, client, alice, group_id, worker):
+    job_id = _start(client, alice, group_id)
+    other_job = {
+        "_id": ObjectId(), "groupId": group_id, "action": "delete", "requestedBy": "alice@example.com",
+        "status": "pending", "stepIndex": 0, "progress": {}, "attempts": 0,
+        "notBefore": datetime.utcnow(), "leaseUntil": None,
+        "createdAt": datetime.utcnow() + timedelta(seconds=1), "updatedAt": datetime.utcnow()
+    }
+    db.group_jobs.insert_one(other_job)
+    db.group_jobs.update_one({"_id": ObjectId(job_id)}, {"$set": {"notBefore": datetime.utcnow() + timedelta(hours=1)}})
+
+    _run_next_job()
+
+    assert db.group_jobs.find_one({"_id": other_job["_id"]})["status"] == "failed"
+    group = db.groups.find_one({"_id": ObjectId(group_id)})
+    assert group["removalJobId"] == ObjectId(job_id)
+    assert group["members"] == []
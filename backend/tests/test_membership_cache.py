@@ -0,0 +1,119 @@
+"""
+Membership checks: 403 for non-members, invalidation on member changes, and expiry of
+entries that other workers may have made stale.
+"""
+import pytest
+from app.database import count_commands
+from app.services import membership_cache
+
+
+@pytest.fixture
+def alice(make_user):
+    return make_user("alice@example.com", "Alice")
+
+
+@pytest.fixture
+def bob(make_user):
+    return make_user("bob@example.com", "Bob")
+
+
+@pytest.fixture
+def group_id(client, alice):
+    return client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+
+
+def _age(user_email, seconds):
+    # As if the entry had been loaded `seconds` ago
+    loaded_at, group_ids = membership_cache._cache[user_email]
+    membership_cache._cache[user_email] = (loaded_at - seconds, group_ids)
+
+
+@pytest.mark.parametrize("method, path", [
+    ("get", "/expenses/group/{group_id}"),
+    ("get", "/settlements/balances/{group_id}"),
+    ("get", "/analytics/group/{group_id}"),
+    ("post", "/groups/{group_id}/add-member?member_email=bob@example.com"),
+])
+def test_non_members_are_refused(client, alice, bob, group_id, method, path):
+    response = getattr(client, method)(path.format(group_id=group_id), headers=bob)
+    assert response.status_code == 403
+    assert getattr(client, method)(path.format(group_id=group_id), headers=alice).status_code == 200
+
+
+def test_non_members_cant_add_expenses(client, bob, group_id):
+    response = client.post("/expenses/", json={
+        "groupId": group_id, "amount": 10, "category": "food", "paidBy": "bob@example.com"
+    }, headers=bob)
+    assert response.status_code == 403
+
+
+def test_cache_hits_cost_no_round_trip(client, alice, group_id):
+    assert membership_cache.is_member("alice@example.com", group_id)
+    with count_commands() as count:
+        assert membership_cache.is_member("alice@example.com", group_id)
+    assert count[0] == 0
+
+
+def test_adding_a_member_takes_effect_at_once(client, alice, bob, group_id):
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 403
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 200
+
+
+def test_removing_a_member_takes_effect_at_once(client, alice, bob, group_id):
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 200
+    client.post(f"/groups/{group_id}/remove-member?member_email=bob@example.com", headers=alice)
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 403
+
+
+def test_removal_by_another_worker_expires(client, db, alice, bob, group_id):
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 200
+    db.groups.update_one({}, {"$pull": {"members": "bob@example.com"}})
+
+    # Until the entry expires this worker still trusts it
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 200
+    _age("bob@example.com", membership_cache.MEMBERSHIP_CACHE_TTL_SECONDS)
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 403
+
+
+def test_addition_by_another_worker_is_seen_after_the_negative_ttl(client, db, alice, bob, group_id):
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 403
+    db.groups.update_one({}, {"$push": {"members": "bob@example.com"}})
+
+    # A recent "not a member" answer is trusted without another read
+    with count_commands() as count:
+        assert not membership_cache.is_member("bob@example.com", group_id)
+    assert count[0] == 0
+    _age("bob@example.com", membership_cache.MEMBERSHIP_CACHE_NEGATIVE_TTL_SECONDS)
+    assert client.get(f"/expenses/group/{group_id}", headers=bob).status_code == 200
+
+
+def test_load_overlapping_an_invalidation_isnt_cached(client, db, alice, group_id, monkeypatch):
+    find = type(db.groups).find
+
+    def find_then_invalidate(self, *args, **kwargs):
+        # Another request changes alice's memberships while this load is reading
+        cursor = find(self, *args, **kwargs)
+        membership_cache.invalidate("alice@example.com")
+        return cursor
+
+    membership_cache.invalidate("alice@example.com")
+    monkeypatch.setattr(type(db.groups), "find", find_then_invalidate)
+    assert membership_cache.is_member("alice@example.com", group_id)
+    monkeypatch.setattr(type(db.groups), "find", find)
+
+    assert "alice@example.com" not in membership_cache._cache
+    assert membership_cache.is_member("alice@example.com", group_id)
+    assert "alice@example.com" in membership_cache._cache
+
+
+def test_least_recently_used_users_are_evicted(client, monkeypatch):
+    monkeypatch.setattr(membership_cache, "MEMBERSHIP_CACHE_MAX_USERS", 2)
+    for email in ("a@example.com", "b@example.com"):
+        membership_cache.get_user_group_ids(email)
+    membership_cache.get_user_group_ids("a@example.com")
+    membership_cache.get_user_group_ids("c@example.com")
+
+    assert list(membership_cache._cache) == ["a@example.com", "c@example.com"]
@@ -0,0 +1,94 @@
+"""
+Turning request profiling on and off, and the profiles it stores.
+"""
+import os
+import shutil
+import pytest
+from app.services import profiling
+
+
+@pytest.fixture(autouse=True)
+def profiles():
+    yield
+    profiling.set_sample_rate(0)
+    shutil.rmtree(profiling.PROFILE_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def admin(make_user):
+    return make_user("admin@example.com", "Admin", isAdmin=True)
+
+
+@pytest.fixture
+def alice(make_user):
+    return make_user("alice@example.com", "Alice")
+
+
+@pytest.fixture
+def group_id(client, alice):
+    return client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+
+
+def _balances(client, headers, group_id):
+    response = client.get(f"/settlements/balances/{group_id}", headers=headers)
+    assert response.status_code == 200, response.text
+
+
+def test_only_admins_change_the_sample_rate(client, admin, alice):
+    assert client.put("/admin/profiling", json={"sampleRate": 1}, headers=alice).status_code == 403
+    assert client.put("/admin/profiling", json={"sampleRate": 1.5}, headers=admin).status_code == 422
+
+    response = client.put("/admin/profiling", json={"sampleRate": 0.25}, headers=admin)
+    assert response.status_code == 200
+    assert client.get("/admin/profiling", headers=admin).json() == {"sampleRate": 0.25}
+    assert profiling.get_sample_rate() == 0.25
+
+
+def test_sampled_requests_are_profiled(client, admin, alice, group_id):
+    _balances(client, alice, group_id)
+    assert client.get("/admin/profiles", headers=admin).json() == []
+
+    client.put("/admin/profiling", json={"sampleRate": 1}, headers=admin)
+    _balances(client, alice, group_id)
+    client.put("/admin/profiling", json={"sampleRate": 0}, headers=admin)
+    _balances(client, alice, group_id)
+
+    summaries = client.get("/admin/profiles", headers=admin).json()
+    assert len(summaries) == 1
+    summary = summaries[0]
+    assert summary["route"] == "/settlements/balances/{group_id}"
+    assert summary["path"] == f"/settlements/balances/{group_id}"
+    assert summary["statusCode"] == 200
+    assert summary["groupId"] == group_id
+    assert summary["groupSize"] == 1
+    assert summary["dbRoundTrips"] > 0
+
+    response = client.get(f"/admin/profiles/{summary['id']}", headers=admin)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+
+def test_profile_header_token(client, admin, alice, group_id, monkeypatch):
+    _balances(client, {**alice, "X-Profile": "secret"}, group_id)  # no token configured
+    monkeypatch.setattr(profiling, "PROFILE_HEADER_TOKEN", "secret")
+    _balances(client, {**alice, "X-Profile": "wrong"}, group_id)
+    assert client.get("/admin/profiles", headers=admin).json() == []
+
+    _balances(client, {**alice, "X-Profile": "secret"}, group_id)
+    assert len(client.get("/admin/profiles", headers=admin).json()) == 1
+
+
+def test_only_the_newest_profiles_are_kept(client, admin, alice, group_id, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MAX_FILES", 2)
+    profiling.set_sample_rate(1)
+    for _ in range(3):
+        _balances(client, alice, group_id)
+    profiling.set_sample_rate(0)
+
+    assert len(client.get("/admin/profiles", headers=admin).json()) == 2
+    assert len(os.listdir(profiling.PROFILE_DIR)) == 4  # .json and .folded of each
+
+
+def test_profile_ids_are_checked(client, admin):
+    assert client.get("/admin/profiles/0000000000000-00000000", headers=admin).status_code == 404
+    assert profiling.read_folded_stacks("../../etc/passwd") is None
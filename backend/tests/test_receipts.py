@@ -0,0 +1,208 @@
+"""
+Receipt ranges and streaming, and the removal of receipts with their group.
+"""
+import io
+import os
+import pytest
+import pymongo
+from bson import ObjectId
+from app.config import RECEIPT_CHUNK_SIZE, RECEIPT_THUMBNAIL_SIZE
+from app.services import group_jobs, receipt_service
+
+RECEIPT = bytes(range(256)) * 10  # 2560 bytes, three chunks
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 2559)),
+    ("bytes=2000-9999", (2000, 2559)),
+    ("bytes=-100", (2460, 2559)),
+    ("bytes=-9999", (0, 2559)),
+    ("bytes=0-99,200-299", None),  # multiple ranges: the whole file is sent
+    ("bytes=99-0", None),
+    ("bytes=abc-", None),
+    ("bytes=-", None),
+    ("items=0-99", None),
+])
+def test_parse_range(header, expected):
+    assert receipt_service.parse_range(header, len(RECEIPT)) == expected
+
+
+@pytest.mark.parametrize("header, size", [("bytes=2560-", 2560), ("bytes=-0", 2560), ("bytes=-10", 0)])
+def test_parse_range_outside_the_file(header, size):
+    with pytest.raises(ValueError):
+        receipt_service.parse_range(header, size)
+
+
+def _upload(expense_id: str, data: bytes, group_id: str = "group") -> dict:
+    upload = receipt_service.ReceiptUpload(expense_id, group_id, "application/pdf", "alice@example.com")
+    for start in range(0, len(data), 1000):
+        upload.write(data[start:start + 1000])
+    return upload.complete()
+
+
+@pytest.mark.parametrize("start, end", [(0, 2559), (0, 0), (1000, 1100), (1023, 1024), (2048, 2559), (10, 2100)])
+def test_iter_receipt(db, start, end):
+    _upload("expense", RECEIPT)
+    chunks = list(receipt_service.iter_receipt(receipt_service.get_receipt("expense"), start, end))
+
+    assert b"".join(chunks) == RECEIPT[start:end + 1]
+    assert all(len(chunk) <= RECEIPT_CHUNK_SIZE for chunk in chunks)
+
+
+def test_upload_keeps_only_the_newest_receipt(db):
+    _upload("expense", b"old")
+    info = _upload("expense", b"new")
+
+    receipts = list(db["receipts.files"].find({"metadata.expenseId": "expense"}))
+    assert [str(receipt["_id"]) for receipt in receipts] == [info["id"]]
+    assert db["receipts.chunks"].count_documents({}) == 1
+    receipt = receipt_service.get_receipt("expense")
+    assert b"".join(receipt_service.iter_receipt(receipt, 0, receipt["length"] - 1)) == b"new"
+
+
+def test_upload_replaced_while_finishing(db):
+    first = receipt_service.ReceiptUpload("expense", "group", "application/pdf", "alice@example.com")
+    second = receipt_service.ReceiptUpload("expense", "group", "application/pdf", "alice@example.com")
+    first.write(b"first")
+    second.write(b"second")
+    close = first._stream.close
+
+    def close_then_finish_second():
+        # The second upload finishes between the first one's close and its cleanup
+        close()
+        assert second.complete()["id"] == str(second._stream._id)
+
+    first._stream.close = close_then_finish_second
+    with pytest.raises(receipt_service.ReceiptReplaced):
+        first.complete()
+
+    assert [receipt["_id"] for receipt in db["receipts.files"].find()] == [second._stream._id]
+    receipt = receipt_service.get_receipt("expense")
+    assert b"".join(receipt_service.iter_receipt(receipt, 0, receipt["length"] - 1)) == b"second"
+
+
+def test_download_range(client, make_user):
+    alice = make_user("alice@example.com", "Alice")
+    group_id = client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+    expense_id = client.post("/expenses/", json={
+        "groupId": group_id, "amount": 30, "paidBy": "alice@example.com", "category": "food"
+    }, headers=alice).json()["id"]
+    response = client.put(
+        f"/expenses/{expense_id}/receipt", content=RECEIPT, headers={**alice, "Content-Type": "application/pdf"}
+    )
+    assert response.status_code == 201, response.text
+
+    response = client.get(f"/expenses/{expense_id}/receipt", headers={**alice, "Range": "bytes=1000-2099"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 1000-2099/2560"
+    assert response.content == RECEIPT[1000:2100]
+
+    response = client.get(f"/expenses/{expense_id}/receipt", headers=alice)
+    assert response.status_code == 200
+    assert response.content == RECEIPT
+
+    response = client.get(f"/expenses/{expense_id}/receipt", headers={**alice, "Range": "bytes=3000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */2560"
+
+
+def _image(size=(300, 300)) -> bytes:
+    Image = pytest.importorskip("PIL.Image")
+    output = io.BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(output, "JPEG")
+    return output.getvalue()
+
+
+@pytest.fixture
+def image_expense(client, make_user):
+    alice = make_user("alice@example.com", "Alice")
+    group_id = client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+    expense_id = client.post("/expenses/", json={
+        "groupId": group_id, "amount": 30, "paidBy": "alice@example.com", "category": "food"
+    }, headers=alice).json()["id"]
+
+    def upload(data):
+        response = client.put(
+            f"/expenses/{expense_id}/receipt", content=data, headers={**alice, "Content-Type": "image/jpeg"}
+        )
+        assert response.status_code == 201, response.text
+        return client.get(f"/expenses/{expense_id}/receipt/thumbnail", headers=alice)
+
+    return upload
+
+
+def test_thumbnail(image_expense):
+    Image = pytest.importorskip("PIL.Image")
+    response = image_expense(_image())
+
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.content)).size == (RECEIPT_THUMBNAIL_SIZE, RECEIPT_THUMBNAIL_SIZE)
+
+
+def test_thumbnail_of_a_corrupt_image(image_expense):
+    data = _image()
+    assert image_expense(data[:len(data) // 2]).status_code == 422
+    assert image_expense(b"\xff\xd8\xff" + bytes(100)).status_code == 415  # JPEG magic, no image
+
+
+def test_thumbnail_of_a_decompression_bomb(image_expense, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    # Pillow refuses images over twice its limit as soon as it reads their size
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)
+    assert image_expense(_image()).status_code == 415
+
+
+def _receipt_docs(group_id: str, count: int):
+    files, chunks = [], []
+    for index in range(count):
+        file_id = ObjectId()
+        files.append({"_id": file_id, "length": 2, "metadata": {"groupId": group_id, "expenseId": str(index)}})
+        chunks += [{"_id": ObjectId(), "files_id": file_id, "n": n, "data": b"ab"} for n in range(2)]
+    return files, chunks
+
+
+def test_remove_receipt_batch_deletes_files_and_chunks(db):
+    files, chunks = _receipt_docs("group", 2)
+    db["receipts.files"].insert_many(files + _receipt_docs("other", 1)[0])
+    db["receipts.chunks"].insert_many(chunks)
+
+    assert group_jobs._remove_receipt_batch({"groupId": "group"}, copy=False) == 1
+    assert group_jobs._remove_receipt_batch({"groupId": "group"}, copy=False) == 1
+    assert group_jobs._remove_receipt_batch({"groupId": "group"}, copy=False) == 0
+    assert db["receipts.files"].count_documents({}) == 1
+    assert db["receipts.chunks"].count_documents({}) == 0
+
+
+@pytest.fixture
+def real_db(monkeypatch):
+    # mongomock has no $merge, so archiving needs a real server
+    url = os.getenv("MONGO_TEST_URL")
+    if not url:
+        pytest.skip("set MONGO_TEST_URL to a disposable MongoDB server to run this test")
+    client = pymongo.MongoClient(url)
+    database = client[f"expense_splitter_test_{ObjectId()}"]
+    monkeypatch.setattr(group_jobs, "db", database)
+    yield database
+    client.drop_database(database.name)
+    client.close()
+
+
+def test_archive_receipt_batch_copies_chunks_on_the_server(real_db):
+    files, chunks = _receipt_docs("group", 3)
+    real_db["receipts.files"].insert_many(files)
+    real_db["receipts.chunks"].insert_many(chunks)
+    # A copy left by an interrupted earlier batch is kept, not duplicated
+    real_db[group_jobs.ARCHIVE_PREFIX + "receipts.chunks"].insert_one(chunks[0])
+
+    while group_jobs._remove_receipt_batch({"groupId": "group"}, copy=True):
+        pass
+
+    archived_files = real_db[group_jobs.ARCHIVE_PREFIX + "receipts.files"]
+    archived_chunks = real_db[group_jobs.ARCHIVE_PREFIX + "receipts.chunks"]
+    assert sorted(doc["_id"] for doc in archived_files.find()) == sorted(doc["_id"] for doc in files)
+    assert sorted(doc["_id"] for doc in archived_chunks.find()) == sorted(doc["_id"] for doc in chunks)
+    assert real_db["receipts.files"].count_documents({}) == 0
+    assert real_db["receipts.chunks"].count_documents({}) == 0
@@ -0,0 +1,148 @@
+"""
+Cron schedules, catching up on missed occurrences, and re-running an interrupted batch.
+"""
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from app.services import expense_buckets, recurring_service
+from app.services.cron import CronSchedule
+
+
+@pytest.mark.parametrize("expression, after, expected", [
+    ("* * * * *", datetime(2024, 1, 1, 10, 0, 30), datetime(2024, 1, 1, 10, 1)),
+    ("0 9 1 * *", datetime(2024, 1, 1, 9, 0), datetime(2024, 2, 1, 9, 0)),
+    ("0 9 1 * *", datetime(2024, 1, 1, 8, 59), datetime(2024, 1, 1, 9, 0)),
+    ("*/15 * * * *", datetime(2024, 1, 1, 10, 16), datetime(2024, 1, 1, 10, 30)),
+    ("0 9-17/4 * * *", datetime(2024, 1, 1, 13, 0), datetime(2024, 1, 1, 17, 0)),
+    ("30 18 * * 5", datetime(2024, 1, 1), datetime(2024, 1, 5, 18, 30)),  # a Friday
+    ("0 0 * * 7", datetime(2024, 1, 1), datetime(2024, 1, 7)),  # 7 is Sunday too
+    ("0 0 * * 0", datetime(2024, 1, 1), datetime(2024, 1, 7)),
+    ("0 0 1,15 * 1", datetime(2024, 1, 2), datetime(2024, 1, 8)),  # either day field matches
+    ("0 0 29 2 *", datetime(2024, 3, 1), datetime(2028, 2, 29)),
+    ("59 23 31 12 *", datetime(2024, 12, 31, 23, 59), datetime(2025, 12, 31, 23, 59)),
+])
+def test_next_after(expression, after, expected):
+    assert CronSchedule(expression).next_after(after) == expected
+
+
+def test_first_at_or_after_includes_the_moment():
+    schedule = CronSchedule("0 9 * * *")
+    assert schedule.first_at_or_after(datetime(2024, 1, 1, 9, 0)) == datetime(2024, 1, 1, 9, 0)
+    assert schedule.first_at_or_after(datetime(2024, 1, 1, 9, 0, 1)) == datetime(2024, 1, 2, 9, 0)
+
+
+def test_schedule_that_never_occurs():
+    assert CronSchedule("0 0 31 2 *").next_after(datetime(2024, 1, 1)) is None
+
+
+@pytest.mark.parametrize("expression", [
+    "", "* * * *", "* * * * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *",
+    "* * * * 8", "*/0 * * * *", "5-1 * * * *", "a * * * *", "1- * * * *",
+])
+def test_invalid_schedules(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+@pytest.fixture
+def scheduler(client):
+    # Templates are run by the tests themselves rather than the app's scheduler thread
+    recurring_service.stop_scheduler()
+    recurring_service._stop.clear()
+
+
+@pytest.fixture
+def alice(make_user):
+    make_user("bob@example.com", "Bob")
+    return make_user("alice@example.com", "Alice")
+
+
+@pytest.fixture
+def group_id(client, alice):
+    group_id = client.post("/groups/", json={"name": "Flat"}, headers=alice).json()["id"]
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    return group_id
+
+
+def _create(client, alice, group_id, **fields):
+    response = client.post("/recurring/", json={
+        "amount": 20, "paidBy": "alice@example.com", "groupId": group_id, "category": "rent",
+        "schedule": "0 9 * * *", **fields
+    }, headers=alice)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _balances(client, headers, group_id):
+    response = client.get(f"/settlements/balances/{group_id}", headers=headers)
+    return {entry["userEmail"]: entry["netBalance"] for entry in response.json()["balances"]}
+
+
+def test_start_at_defaults_to_now(scheduler, client, alice, group_id):
+    before = datetime.utcnow()
+    template = _create(client, alice, group_id)
+
+    assert before <= datetime.fromisoformat(template["startAt"]) <= datetime.utcnow()
+    assert datetime.fromisoformat(template["nextRunAt"]) > before
+
+
+def test_null_start_at_is_rejected(scheduler, client, alice, group_id):
+    response = client.post("/recurring/", json={
+        "amount": 20, "paidBy": "alice@example.com", "groupId": group_id, "category": "rent",
+        "schedule": "0 9 * * *", "startAt": None
+    }, headers=alice)
+
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("batch_size", [500, 2])
+def test_missed_occurrences_are_caught_up(scheduler, client, db, alice, group_id, monkeypatch, batch_size):
+    monkeypatch.setattr(recurring_service, "RECURRING_BATCH_SIZE", batch_size)
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=5)
+    template = _create(client, alice, group_id, startAt=start.isoformat())
+
+    recurring_service.run_due_templates()
+
+    dates = sorted(expense["date"] for expense in db.expenses.find({"recurringId": template["id"]}))
+    due = [start + timedelta(days=day, hours=9) for day in range(6)]
+    assert dates == [date for date in due if date <= datetime.utcnow()]
+    stored = db.recurring_expenses.find_one()
+    assert stored["materializedThrough"] == dates[-1]
+    assert stored["nextRunAt"] == dates[-1] + timedelta(days=1)
+    assert _balances(client, alice, group_id)["alice@example.com"] == pytest.approx(10 * len(dates))
+
+
+def test_schedule_ends_at_end_at(scheduler, client, db, alice, group_id):
+    start = datetime(2024, 1, 1)
+    template = _create(client, alice, group_id, startAt=start.isoformat(), endAt=datetime(2024, 1, 3, 12).isoformat())
+
+    recurring_service.run_due_templates()
+
+    assert db.expenses.count_documents({"recurringId": template["id"]}) == 3
+    assert db.recurring_expenses.find_one()["nextRunAt"] is None
+
+
+def test_occurrence_ids_are_deterministic():
+    template_id, occurrence = ObjectId(), datetime(2024, 1, 1, 9)
+    occurrence_id = recurring_service._occurrence_id(template_id, occurrence)
+
+    assert recurring_service._occurrence_id(ObjectId(str(template_id)), occurrence) == occurrence_id
+    assert recurring_service._occurrence_id(template_id, occurrence + timedelta(days=1)) != occurrence_id
+    assert recurring_service._occurrence_id(ObjectId(), occurrence) != occurrence_id
+
+
+@pytest.mark.parametrize("bucketed", [False, True])
+def test_interrupted_batch_is_not_duplicated(scheduler, client, db, alice, group_id, bucketed):
+    if bucketed:
+        expense_buckets.migrate_group_to_buckets(group_id)
+    template = _create(client, alice, group_id, startAt=datetime(2024, 1, 1).isoformat(), endAt=datetime(2024, 1, 4).isoformat())
+    recurring_service.run_due_templates()
+    # A worker that inserted the occurrences but died before advancing the high-water mark
+    db.recurring_expenses.update_one({}, {"$set": {"nextRunAt": datetime(2024, 1, 1, 9), "materializedThrough": None}})
+
+    recurring_service.run_due_templates()
+
+    expenses = list(expense_buckets.iter_group_expense_docs(group_id))
+    assert sorted(expense["date"] for expense in expenses) == [datetime(2024, 1, day, 9) for day in (1, 2, 3)]
+    assert all(expense["recurringId"] == template["id"] for expense in expenses)
+    assert _balances(client, alice, group_id)["alice@example.com"] == pytest.approx(30)
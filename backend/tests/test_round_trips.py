@@ -0,0 +1,122 @@
+"""
+Database round trips per mutating endpoint. Every request also makes one users lookup to
+authenticate. Writes that touch balances bump the group's checkpoint epoch, and delete
+checkpoints only if the group has some the change may affect (none in these tests); expense
+writes update the analytics rollups as well (one unordered bulk write, with the members from
+the group read or epoch bump the write already made).
+"""
+import pytest
+from app.database import count_commands
+from app.services import membership_cache
+
+
+def _round_trips(request):
+    with count_commands() as count:
+        response = request()
+    assert response.status_code == 200, response.text
+    return response, count[0]
+
+
+@pytest.fixture
+def alice(make_user):
+    headers = make_user("alice@example.com", "Alice")
+    make_user("bob@example.com", "Bob")
+    make_user("carol@example.com", "Carol")
+    return headers
+
+
+@pytest.fixture
+def group_id(client, alice):
+    response = client.post("/groups/", json={"name": "Trip"}, headers=alice)
+    return response.json()["id"]
+
+
+@pytest.fixture
+def expense_id(client, alice, group_id):
+    response = client.post("/expenses/", json={
+        "groupId": group_id, "amount": 30, "paidBy": "alice@example.com", "category": "food"
+    }, headers=alice)
+    return response.json()["id"]
+
+
+def test_create_group(client, alice):
+    # auth + insert; the creator's name comes from the authenticated user
+    _, round_trips = _round_trips(lambda: client.post("/groups/", json={"name": "Trip"}, headers=alice))
+    assert round_trips == 2
+
+
+def test_add_member(client, alice, group_id):
+    # auth + membership check + find_one_and_update (no checkpoints to delete yet)
+    response, round_trips = _round_trips(
+        lambda: client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    )
+    assert round_trips == 3
+    assert "bob@example.com" in response.json()["members"]
+
+
+def test_add_members(client, alice, group_id):
+    # Caches alice's membership
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    # auth + find_one_and_update
+    _, round_trips = _round_trips(
+        lambda: client.post(f"/groups/{group_id}/add-members", json={"member_emails": ["carol@example.com"]}, headers=alice)
+    )
+    assert round_trips == 2
+
+
+def test_remove_member(client, alice, group_id):
+    client.post(f"/groups/{group_id}/add-member?member_email=carol@example.com", headers=alice)
+    # auth + find_one_and_update (membership is cached by now)
+    response, round_trips = _round_trips(
+        lambda: client.post(f"/groups/{group_id}/remove-member?member_email=carol@example.com", headers=alice)
+    )
+    assert round_trips == 2
+    assert "carol@example.com" not in response.json()["members"]
+
+
+def test_create_expense(client, alice, group_id):
+    client.post(f"/groups/{group_id}/add-member?member_email=bob@example.com", headers=alice)
+    # auth + group (storage mode, currency, members) + insert + checkpoint epoch + rollups
+    _, round_trips = _round_trips(lambda: client.post("/expenses/", json={
+        "groupId": group_id, "amount": 30, "paidBy": "alice@example.com", "category": "food"
+    }, headers=alice))
+    assert round_trips == 5
+
+
+def test_update_expense(client, alice, expense_id):
+    # auth + find_one_and_update scoped to the caller's cached groups (no read back)
+    # + checkpoint epoch, which returns the members for the rollups + rollups
+    response, round_trips = _round_trips(lambda: client.put(f"/expenses/{expense_id}", json={"amount": 45}, headers=alice))
+    assert round_trips == 4
+    assert response.json()["amount"] == 45
+
+
+def test_delete_expense(client, alice, expense_id):
+    # auth + find_one_and_delete scoped to the caller's cached groups + checkpoint epoch
+    # + rollups + receipts lookup
+    _, round_trips = _round_trips(lambda: client.delete(f"/expenses/{expense_id}", headers=alice))
+    assert round_trips == 5
+
+
+@pytest.mark.parametrize("method", ["put", "delete"])
+def test_expense_writes_check_membership(client, alice, make_user, expense_id, method):
+    dave = make_user("dave@example.com", "Dave")
+    missing = "000000000000000000000000"
+    kwargs = {"json": {"amount": 45}} if method == "put" else {}
+
+    assert getattr(client, method)(f"/expenses/{expense_id}", headers=dave, **kwargs).status_code == 403
+    assert getattr(client, method)(f"/expenses/{missing}", headers=alice, **kwargs).status_code == 404
+    assert client.get(f"/expenses/{expense_id}", headers=alice).json()["amount"] == 30
+
+
+@pytest.mark.parametrize("method", ["put", "delete"])
+def test_expense_writes_reload_stale_memberships(client, db, alice, make_user, group_id, expense_id, method, monkeypatch):
+    # Past the window in which "not a member" is trusted without a database read
+    monkeypatch.setattr(membership_cache, "MEMBERSHIP_CACHE_NEGATIVE_TTL_SECONDS", 0)
+    dave = make_user("dave@example.com", "Dave")
+    membership_cache.get_user_group_ids("dave@example.com")
+    # Added by another worker: this one's cache still says dave has no groups
+    db.groups.update_one({}, {"$push": {"members": "dave@example.com"}})
+    kwargs = {"json": {"amount": 45}} if method == "put" else {}
+
+    assert getattr(client, method)(f"/expenses/{expense_id}", headers=dave, **kwargs).status_code == 200
@@ -0,0 +1,150 @@
+"""
+Expense search: scoping to the caller's groups, ranking, filters, pagination and its limits.
+"""
+from datetime import datetime
+import pytest
+from pymongo.errors import ExecutionTimeout
+from app.services import expense_buckets, expense_search, expense_service
+
+
+@pytest.fixture
+def alice(make_user):
+    return make_user("alice@example.com", "Alice")
+
+
+@pytest.fixture
+def group_id(client, alice):
+    return client.post("/groups/", json={"name": "Trip"}, headers=alice).json()["id"]
+
+
+def _add(client, headers, group_id, description, category="food", amount=10, day=1):
+    response = client.post("/expenses/", json={
+        "groupId": group_id, "amount": amount, "description": description, "category": category,
+        "paidBy": "alice@example.com", "date": f"2024-03-{day:02d}T12:00:00"
+    }, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _search(client, headers, q, **params):
+    response = client.get("/expenses/search", params={"q": q, **params}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _ids(results):
+    return [item["id"] for item in results["items"]]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Dinner", (["dinner"], [])),
+    ("team-dinner", (["dinner", "team"], [])),
+    ("dinner -pizza", (["dinner"], ["pizza"])),
+    ('"Dinner" dinner', (["dinner"], [])),
+    ("-dinner", ([], ["dinner"])),
+])
+def test_parse_query(query, expected):
+    assert expense_search.parse_query(query) == expected
+
+
+def test_only_the_callers_groups_are_searched(client, make_user, alice, group_id):
+    bob = make_user("bob@example.com", "Bob")
+    bobs_group = client.post("/groups/", json={"name": "Home"}, headers=bob).json()["id"]
+    mine = _add(client, alice, group_id, "Team dinner")
+    response = client.post("/expenses/", json={
+        "groupId": bobs_group, "amount": 10, "description": "Dinner", "category": "food", "paidBy": "bob@example.com"
+    }, headers=bob)
+    theirs = response.json()["id"]
+
+    assert _ids(_search(client, alice, "dinner")) == [mine]
+    assert _ids(_search(client, bob, "dinner")) == [theirs]
+
+    client.post(f"/groups/{bobs_group}/add-member?member_email=alice@example.com", headers=bob)
+    assert set(_ids(_search(client, alice, "dinner"))) == {mine, theirs}
+
+
+def test_ranking(client, alice, group_id):
+    in_category = _add(client, alice, group_id, "Pizza", category="dinner", day=5)
+    in_description = _add(client, alice, group_id, "Dinner", day=1)
+    both_words = _add(client, alice, group_id, "Team dinner", day=2)
+    newer = _add(client, alice, group_id, "Dinner out", day=3)
+    _add(client, alice, group_id, "Taxi", category="transport")
+
+    results = _search(client, alice, "team dinner")
+
+    assert _ids(results) == [both_words, newer, in_description, in_category]
+    assert [item["score"] for item in results["items"]] == [6, 3, 3, 1]
+
+
+def test_filters_and_exclusions(client, alice, group_id):
+    cheap = _add(client, alice, group_id, "Dinner", amount=10, day=1)
+    pricey = _add(client, alice, group_id, "Dinner", amount=90, day=20)
+    _add(client, alice, group_id, "Pizza dinner", amount=30, day=10)
+
+    assert _ids(_search(client, alice, "dinner", min_amount=50)) == [pricey]
+    assert _ids(_search(client, alice, "dinner", end_date="2024-03-05T00:00:00")) == [cheap]
+    assert _ids(_search(client, alice, "dinner -pizza")) == [pricey, cheap]
+    assert _search(client, alice, "dinner", paid_by="bob@example.com")["items"] == []
+
+
+def test_updates_are_searchable(client, alice, group_id):
+    expense_id = _add(client, alice, group_id, "Dinner")
+    client.put(f"/expenses/{expense_id}", json={"description": "Lunch"}, headers=alice)
+
+    assert _search(client, alice, "dinner")["items"] == []
+    assert _ids(_search(client, alice, "lunch")) == [expense_id]
+    assert _ids(_search(client, alice, "food")) == [expense_id]
+
+
+def test_pagination(client, alice, group_id):
+    ids = [_add(client, alice, group_id, "Dinner", day=day) for day in range(1, 6)]
+    newest_first = list(reversed(ids))
+
+    pages = [_search(client, alice, "dinner", page=page, page_size=2) for page in (1, 2, 3)]
+
+    assert [_ids(page) for page in pages] == [newest_first[:2], newest_first[2:4], newest_first[4:]]
+    assert [page["hasMore"] for page in pages] == [True, True, False]
+    assert _search(client, alice, "dinner", page=4, page_size=2)["items"] == []
+
+
+def test_deep_pages_are_refused(client, alice, group_id):
+    response = client.get(
+        "/expenses/search", params={"q": "dinner", "page": expense_service.SEARCH_MAX_PAGE + 1}, headers=alice
+    )
+    assert response.status_code == 400
+    assert client.get("/expenses/search", params={"q": "dinner", "page_size": 51}, headers=alice).status_code == 422
+
+
+def test_slow_searches_are_cut_off(client, db, alice, group_id, monkeypatch):
+    _add(client, alice, group_id, "Dinner")
+    collection_type = type(db.expenses)
+    aggregate = collection_type.aggregate
+    limits = []
+
+    def time_out(self, pipeline, **kwargs):
+        if self.name != "expenses":
+            return aggregate(self, pipeline, **kwargs)
+        limits.append(kwargs.get("maxTimeMS"))
+        raise ExecutionTimeout("operation exceeded time limit")
+
+    monkeypatch.setattr(collection_type, "aggregate", time_out)
+    response = client.get("/expenses/search", params={"q": "dinner"}, headers=alice)
+
+    assert response.status_code == 503
+    assert limits == [expense_service.SEARCH_MAX_TIME_MS]
+
+
+@pytest.mark.parametrize("bucketed", [False, True])
+def test_backfill(client, db, alice, group_id, bucketed):
+    db.expenses.insert_one({
+        "groupId": group_id, "amount": 10, "description": "Old dinner", "category": "food",
+        "paidBy": "alice@example.com", "splitType": "equal", "splits": None,
+        "date": datetime(2020, 1, 1), "createdAt": datetime(2020, 1, 1)
+    })
+    if bucketed:
+        expense_buckets.migrate_group_to_buckets(group_id)
+    assert _search(client, alice, "dinner")["items"] == []
+
+    assert expense_search.backfill_tokens() == 1
+    assert [item["description"] for item in _search(client, alice, "dinner")["items"]] == ["Old dinner"]
+    assert expense_search.backfill_tokens() == 0